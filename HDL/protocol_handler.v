@@ -40,6 +40,33 @@ module protocol_handler(
     localparam WAIT_TX    = 3'd6;
     localparam RFID_SEND  = 3'd7;
 
+    // Binary framing (see serial_link.py), offered by the host with "BIN1":
+    //   SYNC | type, payload length | seq | payload | CRC-8 (poly 0x07)
+    // Commands are answered in the framing they arrived in.
+    localparam [7:0] SYNC     = 8'hB1;      // 0xB0 | protocol version
+    localparam [3:0] T_START  = 4'h1;
+    localparam [3:0] T_MED    = 4'h2;
+    localparam [3:0] T_END    = 4'h3;
+    localparam [3:0] T_PING   = 4'h4;
+    localparam [3:0] T_HELLO  = 4'h8;
+    localparam [3:0] T_PID    = 4'h9;
+    localparam [3:0] T_ACK    = 4'hA;
+    localparam [3:0] T_DONE   = 4'hB;
+    localparam [3:0] T_STK    = 4'hC;
+    localparam [3:0] T_PONG   = 4'hD;
+    localparam [3:0] T_ERR    = 4'hE;
+
+    // Binary receive progress
+    localparam BIN_NONE   = 3'd0;
+    localparam BIN_HDR    = 3'd1;
+    localparam BIN_SEQ    = 3'd2;
+    localparam BIN_DATA   = 3'd3;
+    localparam BIN_CRC    = 3'd4;
+    localparam BIN_DONE   = 3'd5;       // CRC byte taken; checked in PROCESS
+
+    // A frame cut short is dropped after ~1 ms of silence (125 MHz clock)
+    localparam BIN_GAP    = 20'd125_000;
+
     // State Registers
     reg [2:0] current_state, next_state;
 
@@ -52,6 +79,7 @@ module protocol_handler(
 
     // Edge detection for "Dispense Done"
     reg       disp_active_prev;
+    reg       done_pending;              // Edge seen, "DONE" not yet sent
 
     // Buffers and Pointers
     reg [7:0] rx_buf [0:CMD_MAX-1];
@@ -60,6 +88,48 @@ module protocol_handler(
     reg [5:0] tx_len;
     reg [5:0] tx_idx;
 
+    // Binary Framing Registers
+    reg       bin_mode;                  // Reply in binary (last command was a frame)
+    reg [2:0] bin_state;
+    reg [3:0] bin_type;
+    reg [3:0] bin_len;
+    reg [7:0] bin_seq;
+    reg [7:0] rx_crc;
+    reg [7:0] last_seq;                  // Repeats of the last frame are dropped
+    reg       last_seq_valid;
+    reg [19:0] bin_gap_cnt;
+    reg [7:0] tx_seq;
+    reg       tx_bin;                    // tx_buf holds a frame; CRC follows it
+    reg [7:0] tx_crc;
+
+    // CRC-8, poly 0x07, one byte at a time
+    function [7:0] crc8;
+        input [7:0] crc;
+        input [7:0] data;
+        integer i;
+        reg [7:0] c;
+        begin
+            c = crc ^ data;
+            for (i = 0; i < 8; i = i + 1)
+                c = c[7] ? ((c << 1) ^ 8'h07) : (c << 1);
+            crc8 = c;
+        end
+    endfunction
+
+    // Header of a binary reply; the payload goes in tx_buf[3..]
+    task bin_reply;
+        input [3:0] kind;
+        input [3:0] len;
+        begin
+            tx_buf[0] <= SYNC;
+            tx_buf[1] <= {kind, len};
+            tx_buf[2] <= tx_seq;
+            tx_seq    <= tx_seq + 1'b1;
+            tx_len    <= 6'd3 + len;
+            tx_bin    <= 1'b1;
+        end
+    endtask
+
     // Logic for normalization
     wire [7:0] rx_upper = (rx_data >= 8'h61 && rx_data <= 8'h7A) ? (rx_data - 8'h20) : rx_data;
 
@@ -88,8 +158,9 @@ module protocol_handler(
         if (card_OK && system_authorized && !session_captured && lockout_cnt == 0 && current_state == IDLE) begin
             next_state = RFID_SEND;
         end 
-        // Priority 2 : Dispensing Action Done
-        else if (disp_active_prev && !dispensing_active && current_state == IDLE) begin
+        // Priority 2 : Dispensing Action Done (latched, so a command being
+        // processed on the falling edge cannot swallow it)
+        else if (done_pending && current_state == IDLE) begin
             next_state = RESPOND;
         end
         else begin
@@ -104,7 +175,12 @@ module protocol_handler(
                     next_state = PROCESS;
 
                 PROCESS: begin
-                    if (rx_len == 0 && (rx_upper <= 8'h20)) next_state = IDLE;
+                    if (bin_state == BIN_DONE) begin
+                        if (rx_data == rx_crc && !(last_seq_valid && bin_seq == last_seq)) next_state = RESPOND;
+                        else next_state = IDLE;
+                    end
+                    else if (bin_state != BIN_NONE) next_state = IDLE;
+                    else if (rx_len == 0 && (rx_upper <= 8'h20)) next_state = IDLE;
                     else if (rx_upper == 8'h0A || rx_upper == 8'h0D) begin
                         if (rx_len == 1 && rx_buf[0] == "T") next_state = RFID_SEND;
                         else next_state = RESPOND;
@@ -121,7 +197,7 @@ module protocol_handler(
                     next_state = TRANSMIT;
                 
                 TRANSMIT: begin
-                    if (tx_idx < tx_len) begin
+                    if (tx_idx < tx_len + tx_bin) begin
                         if (!tx_full) next_state = WAIT_TX;
                         else          next_state = TRANSMIT;
                     end else begin
@@ -151,9 +227,36 @@ module protocol_handler(
             lockout_cnt       <= 0;
             blink_timer       <= 0;
             session_uid       <= 32'h0;
+            done_pending      <= 1'b0;
+            bin_mode          <= 1'b0;
+            bin_state         <= BIN_NONE;
+            last_seq_valid    <= 1'b0;
+            bin_gap_cnt       <= 0;
+            tx_seq            <= 8'h00;
+            tx_bin            <= 1'b0;
+            tx_crc            <= 8'h00;
         end else begin
             rx_rd <= 1'b0;
             tx_wr <= 1'b0;
+
+            if (disp_active_prev && !dispensing_active) done_pending <= 1'b1;
+
+            // Drop a binary frame whose remaining bytes never arrive
+            if (bin_state == BIN_NONE || !rx_empty) begin
+                bin_gap_cnt <= 0;
+            end else if (bin_gap_cnt == BIN_GAP) begin
+                bin_state   <= BIN_NONE;
+                rx_len      <= 6'd0;
+                bin_gap_cnt <= 0;
+            end else begin
+                bin_gap_cnt <= bin_gap_cnt + 1'b1;
+            end
+
+            // A bad or repeated frame has been checked and is discarded
+            if (current_state == PROCESS && bin_state == BIN_DONE && next_state == IDLE) begin
+                bin_state <= BIN_NONE;
+                rx_len    <= 6'd0;
+            end
             
             // --- LED Logic Tree ---
             // Centralized control avoids blocking session_captured logic
@@ -178,27 +281,106 @@ module protocol_handler(
 
                 PROCESS: begin
                     if (current_state == WAIT_RX) begin
-                        if (rx_len < CMD_MAX && rx_upper > 8'h20 && rx_upper != 8'h0A && rx_upper != 8'h0D) begin
-                            rx_buf[rx_len] <= rx_upper;
-                            rx_len         <= rx_len + 1'b1;
-                        end
+                        case (bin_state)
+                            BIN_NONE: begin
+                                if (rx_len == 0 && rx_data == SYNC) begin
+                                    bin_state <= BIN_HDR;
+                                end
+                                else if (rx_len < CMD_MAX && rx_upper > 8'h20 && rx_upper != 8'h0A && rx_upper != 8'h0D) begin
+                                    rx_buf[rx_len] <= rx_upper;
+                                    rx_len         <= rx_len + 1'b1;
+                                end
+                            end
+                            BIN_HDR: begin
+                                bin_type  <= rx_data[7:4];
+                                bin_len   <= rx_data[3:0];
+                                rx_crc    <= crc8(8'h00, rx_data);
+                                bin_state <= BIN_SEQ;
+                            end
+                            BIN_SEQ: begin
+                                bin_seq   <= rx_data;
+                                rx_crc    <= crc8(rx_crc, rx_data);
+                                bin_state <= (bin_len == 0) ? BIN_CRC : BIN_DATA;
+                            end
+                            BIN_DATA: begin
+                                rx_buf[rx_len] <= rx_data;
+                                rx_len         <= rx_len + 1'b1;
+                                rx_crc         <= crc8(rx_crc, rx_data);
+                                if (rx_len + 1'b1 == bin_len) bin_state <= BIN_CRC;
+                            end
+                            BIN_CRC:
+                                bin_state <= BIN_DONE;
+                        endcase
                     end
                 end
 
                 RESPOND: begin
                     tx_len          <= 0;
                     tx_idx          <= 0;
+                    tx_bin          <= 1'b0;
+                    tx_crc          <= 8'h00;
                     dispenser_start <= 5'b00000;
 
-                    if (disp_active_prev && !dispensing_active) begin
+                    if (current_state == IDLE && done_pending) begin
+						done_pending <= 1'b0;
+                        if (bin_mode) begin
+                            bin_reply(T_DONE, 4'd0);
+                        end else begin
 						tx_buf[0] <= "D"; 
 						tx_buf[1] <= "O"; 
 						tx_buf[2] <= "N"; 
 						tx_buf[3] <= "E"; 
 						tx_buf[4] <= 8'h0A;
 						tx_len    <= 5;
+                        end
                     end
-                    else if (rx_len == 5 && rx_buf[0] == "S" && rx_buf[1] == "T" && rx_buf[2] == "A" && rx_buf[3] == "R" && rx_buf[4] == "T") begin
+                    else if (bin_state == BIN_DONE) begin
+                        // Binary command; rx_buf holds its payload
+                        bin_state      <= BIN_NONE;
+                        bin_mode       <= 1'b1;
+                        last_seq       <= bin_seq;
+                        last_seq_valid <= 1'b1;
+
+                        if (bin_type == T_START && bin_len == 0) begin
+                            system_authorized <= 1'b1;
+                            session_captured  <= 1'b0;
+                            session_uid       <= 32'h0;
+                        end
+                        else if (bin_type == T_END && bin_len == 0) begin
+                            system_authorized <= 1'b0;
+                            session_captured  <= 1'b0;
+                            session_uid       <= 32'h0;
+                            bin_reply(T_STK, 4'd1);
+                            tx_buf[3] <= {3'b000, input_ir};
+                        end
+                        else if (system_authorized) begin
+                            if (bin_type == T_PING && bin_len == 0) begin
+                                bin_reply(T_PONG, 4'd0);
+                            end
+                            else if (bin_type == T_MED && bin_len == 3 && !dispensing_active) begin
+                                // Counts are packed two slots per byte: A B, C D, E -
+                                count_A <= rx_buf[0][7:4];
+                                count_B <= rx_buf[0][3:0];
+                                count_C <= rx_buf[1][7:4];
+                                count_D <= rx_buf[1][3:0];
+                                count_E <= rx_buf[2][7:4];
+
+                                dispenser_start[0] <= (rx_buf[0][7:4] != 0);
+                                dispenser_start[1] <= (rx_buf[0][3:0] != 0);
+                                dispenser_start[2] <= (rx_buf[1][7:4] != 0);
+                                dispenser_start[3] <= (rx_buf[1][3:0] != 0);
+                                dispenser_start[4] <= (rx_buf[2][7:4] != 0);
+                                bin_reply(T_ACK, 4'd0);
+                            end else begin
+                                bin_reply(T_ERR, 4'd0);
+                            end
+                        end
+                        rx_len <= 6'd0;
+                    end
+                    else begin
+                    // ASCII command: answer in ASCII
+                    bin_mode <= 1'b0;
+                    if (rx_len == 5 && rx_buf[0] == "S" && rx_buf[1] == "T" && rx_buf[2] == "A" && rx_buf[3] == "R" && rx_buf[4] == "T") begin
                         system_authorized <= 1'b1;
                         session_captured  <= 1'b0;
                         session_uid       <= 32'h0;
@@ -228,6 +410,15 @@ module protocol_handler(
 							tx_buf[4] <= 8'h0A;
 							tx_len    <= 5;
                         end
+                        else if (rx_len == 4 && rx_buf[0] == "B" && rx_buf[1] == "I" && rx_buf[2] == "N" && rx_buf[3] == "1") begin
+                            // Binary framing offered: HELLO restarts both sequence counts
+                            bin_mode       <= 1'b1;
+                            last_seq_valid <= 1'b0;
+                            bin_reply(T_HELLO, 4'd1);
+                            tx_buf[2]      <= 8'h00;
+                            tx_buf[3]      <= 8'h01;
+                            tx_seq         <= 8'h01;
+                        end
                         else if (rx_len == 14 && rx_buf[0] == "M" && rx_buf[1] == "E" && rx_buf[2] == "D" && !dispensing_active) begin
 						// else if (rx_len == 14 && rx_buf[0] == "M" && rx_buf[1] == "E" && rx_buf[2] == "D" && !dispensing_active) begin
 							count_A <= rx_buf[5] - 8'h30; 
@@ -262,11 +453,21 @@ module protocol_handler(
                         end
                     end
                     rx_len <= 6'd0;
+                    end
                 end
 
                 RFID_SEND: begin
 					session_captured 	<= 1'b1; // Card is read
 					session_uid      	<= UID;
+                    tx_idx              <= 0;
+                    tx_crc              <= 8'h00;
+                    if (bin_mode) begin
+                        bin_reply(T_PID, 4'd4);
+                        tx_buf[3]       <= UID[31:24];
+                        tx_buf[4]       <= UID[23:16];
+                        tx_buf[5]       <= UID[15:8];
+                        tx_buf[6]       <= UID[7:0];
+                    end else begin
 					tx_buf[0] 			<= "P"; 
 					tx_buf[1] 			<= "I"; 
 					tx_buf[2] 			<= "D"; 
@@ -277,13 +478,21 @@ module protocol_handler(
 					tx_buf[7] 			<= UID[7:0];
 					tx_buf[8] 			<= 8'h0A;
 					tx_len    			<= 9;
-					tx_idx    			<= 0;
-					rx_len    			<= 0;
+                    tx_bin              <= 1'b0;
+                    end
+                    // Only the "T" test command is consumed here; a card
+                    // tapped mid-command must not cut the line short
+					if (current_state == PROCESS) rx_len <= 0;
 					lockout_cnt 		<= 28'd30_000_000;
                 end
 
                 WAIT_TX: begin
-                    tx_data <= tx_buf[tx_idx];
+                    if (tx_bin && tx_idx == tx_len) begin
+                        tx_data <= tx_crc;
+                    end else begin
+                        tx_data <= tx_buf[tx_idx];
+                        if (tx_idx != 0) tx_crc <= crc8(tx_crc, tx_buf[tx_idx]);
+                    end
                     tx_wr   <= 1'b1;
                     tx_idx  <= tx_idx + 1'b1;
                 end 
@@ -0,0 +1,269 @@
+// tb_protocol_handler.v
+//
+// Drives uart_controller (UART RX/TX, FIFOs, protocol_handler) over its
+// serial pins: binary framing negotiated with "BIN1", binary commands and
+// replies, CRC and duplicate rejection, a frame cut short, and the ASCII
+// protocol afterwards.
+//
+// Run:  iverilog -g2005 -o tb_protocol_handler tb_protocol_handler.v uart_controller.v \
+//           protocol_handler.v uart_rx.v uart_tx.v fifo_sync.v && vvp tb_protocol_handler
+
+`timescale 1ns / 1ps
+
+module tb_protocol_handler;
+
+    localparam CLK_NS   = 8;                    // 125 MHz
+    localparam BIT_NS   = 1085 * CLK_NS;        // 115200 baud, as uart_tx counts it
+    localparam REPLY_NS = 20 * 10 * BIT_NS;     // wait for up to 20 bytes
+
+    localparam [7:0] SYNC = 8'hB1;
+
+    reg         clk = 1'b0;
+    reg         rst = 1'b1;
+    reg         rx  = 1'b1;
+    wire        tx;
+    wire        led1;
+    reg  [31:0] UID = 32'hACC0176D;
+    reg         card_OK = 1'b0;
+    reg  [4:0]  ir_status = 5'b01000;
+    reg         dispensing_active = 1'b0;
+    wire [4:0]  dispenser_start;
+    wire [3:0]  count_A, count_B, count_C, count_D, count_E;
+
+    integer     errors = 0;
+    reg  [7:0]  got [0:15];
+    integer     got_len;
+
+    always #(CLK_NS / 2) clk = ~clk;
+
+    uart_controller dut (
+        .clk                (clk),
+        .rst                (rst),
+        .rx                 (rx),
+        .tx                 (tx),
+        .led1               (led1),
+        .UID                (UID),
+        .card_OK            (card_OK),
+        .ir_status          (ir_status),
+        .dispensing_active  (dispensing_active),
+        .dispenser_start    (dispenser_start),
+        .count_A            (count_A),
+        .count_B            (count_B),
+        .count_C            (count_C),
+        .count_D            (count_D),
+        .count_E            (count_E)
+    );
+
+    // --- Host side of the serial line ---
+
+    function [7:0] crc8;
+        input [7:0] crc;
+        input [7:0] data;
+        integer i;
+        reg [7:0] c;
+        begin
+            c = crc ^ data;
+            for (i = 0; i < 8; i = i + 1)
+                c = c[7] ? ((c << 1) ^ 8'h07) : (c << 1);
+            crc8 = c;
+        end
+    endfunction
+
+    task send_byte;
+        input [7:0] b;
+        integer i;
+        begin
+            rx = 1'b0;
+            #(BIT_NS);
+            for (i = 0; i < 8; i = i + 1) begin
+                rx = b[i];
+                #(BIT_NS);
+            end
+            rx = 1'b1;
+            #(BIT_NS);
+        end
+    endtask
+
+    task send_line;
+        input [8*8-1:0] text;       // right-aligned, leading NULs skipped
+        integer i;
+        begin
+            for (i = 7; i >= 0; i = i - 1)
+                if (text[i*8 +: 8] != 8'h00) send_byte(text[i*8 +: 8]);
+            send_byte(8'h0A);
+        end
+    endtask
+
+    // SYNC | type, length | seq | payload | CRC; `bad_crc` flips the CRC
+    task send_frame;
+        input [3:0]  kind;
+        input [7:0]  seq;
+        input [3:0]  len;
+        input [23:0] payload;       // first byte in [23:16]
+        input        bad_crc;
+        reg   [7:0]  crc;
+        integer      i;
+        begin
+            send_byte(SYNC);
+            send_byte({kind, len});
+            crc = crc8(8'h00, {kind, len});
+            send_byte(seq);
+            crc = crc8(crc, seq);
+            for (i = 0; i < len; i = i + 1) begin
+                send_byte(payload[23 - 8*i -: 8]);
+                crc = crc8(crc, payload[23 - 8*i -: 8]);
+            end
+            send_byte(bad_crc ? ~crc : crc);
+        end
+    endtask
+
+    // Collects bytes from tx until the line stays idle for two byte times
+    task receive;
+        input integer first_wait_ns;
+        integer waited, i;
+        reg [7:0] b;
+        begin
+            got_len = 0;
+            waited  = 0;
+            while (waited < first_wait_ns) begin
+                if (tx === 1'b0) begin
+                    #(BIT_NS / 2);
+                    for (i = 0; i < 8; i = i + 1) begin
+                        #(BIT_NS);
+                        b[i] = tx;
+                    end
+                    #(BIT_NS);
+                    if (got_len < 16) got[got_len] = b;
+                    got_len = got_len + 1;
+                    waited  = first_wait_ns - 20 * BIT_NS;
+                end else begin
+                    #(100);
+                    waited = waited + 100;
+                end
+            end
+        end
+    endtask
+
+    task check_frame;
+        input [8*24-1:0] name;
+        input [3:0]  kind;
+        input [7:0]  seq;
+        input [3:0]  len;
+        input [31:0] payload;       // first byte in [31:24]
+        reg   [7:0]  crc;
+        integer      i;
+        reg          ok;
+        begin
+            receive(REPLY_NS);
+            ok  = (got_len == 4 + len) && got[0] == SYNC && got[1] == {kind, len} && got[2] == seq;
+            crc = crc8(crc8(8'h00, {kind, len}), seq);
+            for (i = 0; i < len; i = i + 1) begin
+                ok  = ok && got[3 + i] == payload[31 - 8*i -: 8];
+                crc = crc8(crc, payload[31 - 8*i -: 8]);
+            end
+            ok = ok && got[3 + len] == crc;
+            if (ok) $display("PASS  %0s", name);
+            else begin
+                $display("FAIL  %0s: %0d bytes, %h %h %h %h", name, got_len, got[0], got[1], got[2], got[3]);
+                errors = errors + 1;
+            end
+        end
+    endtask
+
+    task check_text;
+        input [8*24-1:0] name;
+        input [8*12-1:0] text;      // right-aligned, ends in a newline
+        integer i, n;
+        reg ok;
+        begin
+            receive(REPLY_NS);
+            n = 0;
+            for (i = 11; i >= 0; i = i - 1)
+                if (text[i*8 +: 8] != 8'h00) n = n + 1;
+            ok = (got_len == n);
+            for (i = 0; i < n && i < 16; i = i + 1)
+                ok = ok && got[i] == text[(n - 1 - i)*8 +: 8];
+            if (ok) $display("PASS  %0s", name);
+            else begin
+                $display("FAIL  %0s: %0d bytes", name, got_len);
+                errors = errors + 1;
+            end
+        end
+    endtask
+
+    task check_silent;
+        input [8*24-1:0] name;
+        begin
+            receive(30 * BIT_NS);
+            if (got_len == 0) $display("PASS  %0s", name);
+            else begin
+                $display("FAIL  %0s: %0d unexpected bytes", name, got_len);
+                errors = errors + 1;
+            end
+        end
+    endtask
+
+    initial begin
+        #(20 * CLK_NS);
+        rst = 1'b0;
+        #(20 * CLK_NS);
+
+        // Negotiation: START, then BIN1 -> HELLO v1 (seq 0)
+        send_line("START");
+        send_line("BIN1");
+        check_frame("HELLO", 4'h8, 8'd0, 4'd1, 32'h01000000);
+
+        send_frame(4'h4, 8'd0, 4'd0, 24'h0, 1'b0);
+        check_frame("PING -> PONG", 4'hD, 8'd1, 4'd0, 32'h0);
+
+        // MED A3 B0 C2 D0 E1, packed two slots per byte
+        send_frame(4'h2, 8'd1, 4'd3, 24'h302010, 1'b0);
+        check_frame("MED -> ACK", 4'hA, 8'd2, 4'd0, 32'h0);
+        if (dispenser_start == 5'b10101 && count_A == 3 && count_C == 2 && count_E == 1)
+            $display("PASS  MED counts");
+        else begin
+            $display("FAIL  MED counts: start %b A%0d C%0d E%0d", dispenser_start, count_A, count_C, count_E);
+            errors = errors + 1;
+        end
+
+        dispensing_active = 1'b1;
+        #(50 * BIT_NS);
+        dispensing_active = 1'b0;
+        check_frame("DONE", 4'hB, 8'd3, 4'd0, 32'h0);
+
+        // The same MED again (same seq) must not dispense twice
+        send_frame(4'h2, 8'd1, 4'd3, 24'h302010, 1'b0);
+        check_silent("duplicate MED ignored");
+
+        send_frame(4'h4, 8'd2, 4'd0, 24'h0, 1'b1);
+        check_silent("bad CRC ignored");
+
+        // A frame cut short is dropped after the line goes quiet
+        send_byte(SYNC);
+        send_byte({4'h4, 4'd0});
+        #(2_000_000);
+        send_frame(4'h4, 8'd2, 4'd0, 24'h0, 1'b0);
+        check_frame("resync after truncation", 4'hD, 8'd4, 4'd0, 32'h0);
+
+        // Card tapped during a binary session
+        card_OK = 1'b1;
+        #(10 * CLK_NS);
+        card_OK = 1'b0;
+        check_frame("PID", 4'h9, 8'd5, 4'd4, 32'hACC0176D);
+
+        send_frame(4'h3, 8'd3, 4'd0, 24'h0, 1'b0);
+        check_frame("END -> STK", 4'hC, 8'd6, 4'd1, {3'b000, 5'b01000, 24'h0});
+
+        // ASCII commands are still answered in ASCII
+        send_line("START");
+        send_line("PING");
+        check_text("ASCII PONG", "PONG\n");
+        send_line("END");
+        check_text("ASCII STK", "STK:01000\n");
+
+        if (errors == 0) $display("All protocol checks passed.");
+        else             $display("%0d protocol check(s) failed.", errors);
+        $finish;
+    end
+
+endmodule
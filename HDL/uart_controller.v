@@ -103,7 +103,8 @@ module uart_controller (
         .rst        (rst), 
         .rx         (rx),
         .data_out   (rx_data_raw), 
-        .data_valid (rx_valid_raw)
+        .data_valid (rx_valid_raw),
+        .frame_err  ()
     );
 
     // --- Buffer: RX FIFO ---
@@ -6,7 +6,8 @@ module uart_rx #(
     input  wire        rst,
     input  wire        rx,
     output reg  [7:0]  data_out,
-    output reg         data_valid
+    output reg         data_valid,
+    output reg         frame_err    // Stop bit low: byte dropped
 );
     // Calculate ticks for 16x oversampling
     localparam integer TICKS_16X = CLOCK_FREQ / (BAUD_RATE * 16);
@@ -21,6 +22,7 @@ module uart_rx #(
     reg [3:0]  sample_cnt; // Counts 0-15 for oversampling
     reg [2:0]  bit_cnt;
     reg [7:0]  shift_reg;
+    reg        stop_ok;
     reg [1:0]  rx_sync;
 
     // Double-flop to prevent metastability
@@ -74,8 +76,11 @@ module uart_rx #(
             shift_reg  <= 8'b00;
             data_valid <= 1'b0;
             data_out   <= 8'b0;
+            stop_ok    <= 1'b0;
+            frame_err  <= 1'b0;
         end else begin
             data_valid <= 1'b0;
+            frame_err  <= 1'b0;
 
             if (tick_cnt < TICKS_16X - 1) begin
                 tick_cnt <= tick_cnt + 1;
@@ -109,10 +114,15 @@ module uart_rx #(
                     end
                 
                     STOP: begin
+                        // Binary frames have no line ending to resync on, so a
+                        // misframed byte is dropped for the CRC to catch
+                        if (sample_cnt == 7) stop_ok <= rx_s;
+
                         if (sample_cnt == 15) begin
                             sample_cnt <= 0;
                             data_out   <= shift_reg;
-                            data_valid <= 1'b1;
+                            data_valid <= stop_ok;
+                            frame_err  <= !stop_ok;
                         end else begin
                             sample_cnt <= sample_cnt + 1;
                         end
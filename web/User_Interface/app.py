@@ -1,20 +1,40 @@
 # app.py
 
-from flask import Flask, render_template, jsonify, request, send_from_directory
+from flask import Flask, Response, g, render_template, jsonify, request, stream_with_context
 import json
+import re
 import time
-import serial
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from serial_link import DispenseError, SLOTS
+from dispense_jobs import JobRegistry
+from machine_pool import MachinePool, DEFAULT_MACHINES
+from dispense_plan import plan_frames, frame_counts
+from medicine_slots import SlotMap, UnmappedMedicineError, DEFAULT_CONFIG
+from doc_cache import TTLCache
+from page_cache import PageCache
+from dashboard_feed import DashboardFeed
+from stock_forecast import StockLedger, load_slot_limits
+from static_files import send_static, STATIC_DIR, ADMIN_DASHBOARD_PATH
+import metrics
+from metrics import timed, observe_stage
 
 # =======================================================
 # ============ Serial Port Setup =======================
 # =======================================================
-try:
-    ser = serial.Serial('/dev/serial0', 115200, timeout=2) 
-    ser.reset_input_buffer()
-except Exception as e:
-    print(f"Serial Port Error: {e}")
-    ser = None
+# One FPGA per serial port; each port has a background reader that owns it
+# and a command queue that requests submit conversations to. The ports are
+# opened in the background by create_app(), or by the first request that
+# needs one.
+# UART_TRACE_DIR captures every byte on the wire for replay (uart_trace.py).
+pool = MachinePool.from_spec(os.environ.get("DISPENSER_MACHINES", DEFAULT_MACHINES), 115200,
+                             trace_dir=os.environ.get("UART_TRACE_DIR"))
+
+# Dispense jobs run off the request thread; each link still serializes its UART
+jobs = JobRegistry()
+job_pool = ThreadPoolExecutor(max_workers=max(4, 2 * len(pool.machines)), thread_name_prefix="dispense")
 
 # =======================================================
 # == FIREBASE INTEGRATION
@@ -24,33 +44,113 @@ try:
         db, 
         read_visit_data, 
         read_patient_data,
-        create_dispensing_log,
-        update_sensor_status,
-        get_available_visit_dates 
+        record_dispense,
+        write_queue,
+        lookup_patient,
+        cache_stats,
+        watch_slot_config,
+        claim_dispense,
+        release_dispense_claim,
+        dispensed_locally,
+        record_partial_dispense,
+        FirestoreUnreachable,
+        firestore_reachable,
+        watch_document,
+        watch_log_day,
+        read_log_page,
+        on_visit_change,
+        visit_version,
+        stock_tracker_for,
+        warm_up as warm_up_firestore
     )
 except ImportError:
     print("FATAL ERROR: Could not import functions from firebase.py.")
 
-app = Flask(__name__)
+# Static files go through send_static() (cache headers, precompressed variants)
+app = Flask(__name__, static_folder=None)
+
+# Medicine -> slot letter, compiled once from the dashboard's config.json
+# (MEDICINE_CONFIG overrides the path); a Firestore document can override it
+MEDICINE_CONFIG = os.environ.get("MEDICINE_CONFIG", DEFAULT_CONFIG)
+slot_map = SlotMap(MEDICINE_CONFIG)
+
+# Unit counts per machine and slot, from refills and every MED: frame sent,
+# with consumption forecasts; orders a machine cannot fill are rerouted or
+# refused before queueing (stock_forecast.py)
+stock_ledger = StockLedger(
+    os.environ.get("STOCK_LEDGER", os.path.join(os.path.dirname(os.path.abspath(__file__)), "stock_ledger.sqlite3")),
+    load_slot_limits(MEDICINE_CONFIG))
+# Machine choice and its stock reservation happen together
+_assign_lock = threading.Lock()
+
+# Compiled orders, staged right after a scan so that pressing Dispense only
+# has to queue the frames (see stage_orders)
+staged_orders = TTLCache("staged_order", maxsize=64, ttl=600)
+# Separate from job_pool, whose threads wait out the servos of every dispense
+stage_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="staging")
+
+# Rendered patient pages with ETags; dropped when their visit changes or is
+# dispensed (page_cache.py)
+page_cache = PageCache()
+on_visit_change(page_cache.invalidate)
+
+# =======================================================
+# == REQUEST TIMING
+# =======================================================
+# Hot-path endpoints get an end-to-end histogram; their stages are timed
+# inline with metrics.timed(). PROFILE_SAMPLE_RATE profiles a sample.
+INSTRUMENTED_ENDPOINTS = {
+    'scan_id': 'scan_id',
+    'get_prescription_details': 'get_prescription_details',
+    'dispense_medicine': 'dispense',
+}
+DISPENSE_STAGES = ("firestore_read", "command_build", "uart_tx", "done", "stk", "db_commit", "dispense_total")
+
+@app.before_request
+def start_request_timer():
+    if request.endpoint in INSTRUMENTED_ENDPOINTS:
+        g.request_start = time.perf_counter()
+        g.profiler = metrics.start_profile()
+
+@app.after_request
+def stop_request_timer(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        name = INSTRUMENTED_ENDPOINTS[request.endpoint]
+        metrics.request_seconds.observe(time.perf_counter() - start, endpoint=name, status=response.status_code)
+    return response
+
+@app.teardown_request
+def stop_request_profiler(error=None):
+    # Runs even when the view raised, so the profiler is always released
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        metrics.stop_profile(profiler, INSTRUMENTED_ENDPOINTS[request.endpoint])
 
 # =======================================================
 # == ADMIN & PATH CONFIGURATION
 # =======================================================
 ADMIN_HEX_ID = "E2FA4206"
-# This points to: capstone/admin_dashboard/website
-ADMIN_DASHBOARD_PATH = os.path.join(os.getcwd(), 'admin_dashboard', 'website')
+# Only offer visits that still need dispensing after a scan; these are
+# served from the local replica, so scans work without the network
+SCAN_PENDING_ONLY = True
 print(f"Checking Dashboard Path: {ADMIN_DASHBOARD_PATH}")
 print(f"Does folder exist? {os.path.exists(ADMIN_DASHBOARD_PATH)}")
 
 # Route to serve the Admin Dashboard HTML
 @app.route('/monitoring')
 def monitoring_page():
-    return send_from_directory(ADMIN_DASHBOARD_PATH, 'index.html')
+    return send_static(ADMIN_DASHBOARD_PATH, 'index.html', max_age=0)
 
 # Route to serve Dashboard Assets (CSS, JS, Images)
 @app.route('/monitoring/<path:filename>')
 def serve_monitoring_assets(filename):
-    return send_from_directory(ADMIN_DASHBOARD_PATH, filename)
+    return send_static(ADMIN_DASHBOARD_PATH, filename)
+
+# Kiosk assets; keeps the 'static' endpoint name for url_for()
+@app.route('/static/<path:filename>', endpoint='static')
+def serve_static(filename):
+    return send_static(STATIC_DIR, filename)
 
 # =======================================================
 # == UI PAGE ROUTES
@@ -60,19 +160,52 @@ def serve_monitoring_assets(filename):
 def index():
     return render_template('auth.html')
 
+def cached_page(page, patient_id, visit_date, render):
+    """
+    Serves a patient page from page_cache, or a 304 when the browser's ETag
+    is still current, without reading Firestore or rendering. `render()`
+    returns the HTML, or an error response that is passed through uncached.
+    """
+    def key():
+        return (page, patient_id, visit_date, visit_version(patient_id, visit_date) if visit_date else None)
+
+    entry = page_cache.get(key())
+    if entry is None:
+        epoch = page_cache.epoch
+        body = render()
+        if not isinstance(body, str):
+            return body
+        # Keyed after rendering: the read may have learned the visit version
+        entry = page_cache.put(key(), body, epoch)
+
+    etag, body = entry
+    if request.if_none_match.contains(etag):
+        page_cache.not_modified += 1
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    # Always revalidate: the page changes once the visit is dispensed
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/schedule')
 def schedule_page():
     patient_id = request.args.get('patient_id')
     if not patient_id:
         return render_template('status.html', status_title="Error", status_message="Patient ID is missing.")
-    patient_info = read_patient_data(patient_id) 
-    return render_template('schedule.html', patient_id=patient_id, patient_info=patient_info)
+    return cached_page('schedule', patient_id, None, lambda: render_template(
+        'schedule.html', patient_id=patient_id, patient_info=read_patient_data(patient_id)))
 
 @app.route('/prescription')
 def prescription_page():
     patient_id = request.args.get('patient_id')
     visit_date = request.args.get('visit_date')
-    return render_template('prescription.html', patient_id=patient_id, visit_date=visit_date)
+    if not patient_id or not visit_date:
+        return render_template('prescription.html', patient_id=patient_id, visit_date=visit_date)
+    visit_date = visit_date.strip()
+    return cached_page('prescription', patient_id, visit_date, lambda: render_template(
+        'prescription.html', patient_id=patient_id, visit_date=visit_date))
     
 @app.route('/status')
 def status_page():
@@ -94,11 +227,12 @@ def status_page():
 
 @app.route('/api/scan_id', methods=['POST'])
 def scan_id():
-    raw_id = get_id_from_fpga()
+    with timed("scan_id", "uart_scan"):
+        raw_id = get_id_from_fpga()
     # raw_id = "ACC0176D" ----testing 
     
     if not raw_id:
-        if ser: ser.write(b"END\n")
+        if pool.primary.online: pool.primary.link.end_session()
         return jsonify({
             "status": "error", 
             "message": "Hardware Timeout: No card detected.",
@@ -114,11 +248,16 @@ def scan_id():
     
     # Check for Patient
     try:
-        patient_doc = db.collection("consultations").document(raw_id).get()
-        if patient_doc.exists:
-            visit_dates = get_available_visit_dates(raw_id)
+        # Profile and visit IDs in one parallel round trip; also primes the
+        # cache that /schedule reads from
+        with timed("scan_id", "firestore_read"):
+            patient_info, visit_dates = lookup_patient(raw_id, pending_only=SCAN_PENDING_ONLY)
+        if patient_info:
             if not visit_dates:
                 return jsonify({"status": "error", "message": "No valid prescriptions.", "error_type": "no_prescriptions"})
+            # Fetch and compile this patient's orders while they pick a visit
+            # (and while any earlier patient's dispense is still running)
+            stage_pool.submit(stage_orders, raw_id, visit_dates)
             return jsonify({"status": "success", "patient_id": raw_id, "visit_dates": visit_dates})
         else:
             return jsonify({"status": "error", "message": "ID not registered.", "error_type": "unregistered"})
@@ -126,26 +265,70 @@ def scan_id():
         return jsonify({"status": "error", "message": f"Scan error: {str(e)}"})
 
 def get_id_from_fpga():
-    if ser is None: return None
+    # The RFID reader is wired to the primary machine's FPGA. The scan does
+    # not queue behind a running dispense, so the next patient can tap in
+    # while the servos turn.
+    pool.open()
+    link = pool.primary.link
+    if not link.is_open: return None
     try:
-        ser.reset_input_buffer()
-        ser.write(b"START\n")
-        start_time = time.time()
-        while (time.time() - start_time) < 10:
-            if ser.in_waiting >= 4:
-                chunk = ser.read(ser.in_waiting)
-                if b"PID:" in chunk:
-                    header_pos = chunk.find(b"PID:")
-                    remaining_in_chunk = chunk[header_pos+4:]
-                    if len(remaining_in_chunk) >= 4:
-                        raw_bytes = remaining_in_chunk[:4]
-                    else:
-                        raw_bytes = remaining_in_chunk + ser.read(4 - len(remaining_in_chunk))
-                    return "".join([f"{b:02X}" for b in raw_bytes])
-            time.sleep(0.05)
+        return link.scan_card(timeout=10)
     except Exception as e:
         print(f"Hardware Error: {e}")
     return None
+
+
+# =======================================================
+# == ORDER STAGING
+# =======================================================
+
+def compile_order(patient_id, visit_date, prescription_data):
+    """
+    Returns (slot counts, MED: frames) for a visit. Cached per visit and
+    keyed by its medication list and the slot map version, so an edited
+    prescription or a remapped slot recompiles. Raises UnmappedMedicineError.
+    """
+    medications = prescription_data.get('medications', [])
+    # Pick up an edited config.json before its reload count keys the cache
+    slot_map.refresh()
+    version = (json.dumps(medications, sort_keys=True, default=str), slot_map.reloads)
+    staged = staged_orders.get((patient_id, visit_date))
+    if staged is not None and staged[0] == version:
+        return staged[1], staged[2]
+
+    # Any medicine without a slot rejects the whole order
+    counts = slot_map.resolve(medications)
+    # Each slot counter is one digit, so large orders span several frames
+    frames = plan_frames(counts)
+    staged_orders.put((patient_id, visit_date), (version, counts, frames))
+    return counts, frames
+
+
+def stage_orders(patient_id, visit_dates):
+    """
+    Prefetches, validates and compiles every pending visit of a freshly
+    scanned patient, and checks them against the machines' last STK
+    readings. Runs on stage_pool; results are only logged and cached.
+    """
+    for visit_date in visit_dates:
+        try:
+            prescription_data = read_visit_data(patient_id, visit_date)
+            if not prescription_data:
+                continue
+            counts, frames = compile_order(patient_id, visit_date, prescription_data)
+        except UnmappedMedicineError as e:
+            print(f"[Staging] {patient_id}/{visit_date}: unmapped medicines {e.names}")
+            continue
+        except Exception as e:
+            print(f"[Staging] {patient_id}/{visit_date}: {e}")
+            continue
+
+        slots = [letter for letter, qty in counts.items() if qty > 0]
+        in_stock = any(m.online and m.has_stock(slots) and not stock_ledger.shortfall(m.machine_id, counts)
+                       for m in pool.machines)
+        print(f"[Staging] {patient_id}/{visit_date}: {' | '.join(frames) or 'nothing to dispense'}"
+              f"{'' if in_stock else ' (no machine has stock)'}")
+
     
 @app.route('/api/get_prescription_details', methods=['GET'])
 def get_prescription_details():
@@ -159,11 +342,12 @@ def get_prescription_details():
     try:
         # 1. Fetch static data (Name, Age, Gender) from the main document
         # This calls read_patient_data(patient_id) from your firebase.py
-        patient_profile = read_patient_data(patient_id) 
-        
-        # 2. Fetch specific visit medications from the sub-collection
-        # This calls read_visit_data(patient_id, visit_date) from your firebase.py
-        prescription_data = read_visit_data(patient_id, visit_date)
+        with timed("get_prescription_details", "firestore_read"):
+            patient_profile = read_patient_data(patient_id) 
+            
+            # 2. Fetch specific visit medications from the sub-collection
+            # This calls read_visit_data(patient_id, visit_date) from your firebase.py
+            prescription_data = read_visit_data(patient_id, visit_date)
         
         if prescription_data and patient_profile:
             # We return both objects so the frontend can display them together
@@ -183,9 +367,6 @@ def get_prescription_details():
         return jsonify({"status": "error", "message": "Internal server error fetching details."})
 
 
-import time
-from flask import jsonify, request
-
 @app.route('/api/dispense', methods=['POST'])
 def dispense_medicine():
     data = request.get_json()
@@ -195,124 +376,397 @@ def dispense_medicine():
     if not patient_id or not visit_date:
         return jsonify({"status": "error", "message": "Missing ID or Date."})
 
+    # A double tap or a browser retry joins the job already running
+    running = jobs.running(patient_id, visit_date)
+    if running is not None:
+        return _job_accepted(running, duplicate=True)
+
     try:
         # 1. READ prescription data
-        prescription_data = read_visit_data(patient_id, visit_date)
+        with timed("dispense", "firestore_read"):
+            prescription_data = read_visit_data(patient_id, visit_date)
         
         if not prescription_data:
             return jsonify({"status": "error", "message": "Prescription not found."})
+        if prescription_data.get('status') == 'dispensed':
+            return jsonify({"status": "error", "message": "Prescription already dispensed.",
+                            "error_type": "already_dispensed"})
 
-        # 2. ASSIGNMENT LOGIC (Mapping Names to FPGA Letters)
-        counts = {'A': 0, 'B': 0, 'C': 0, 'D': 0, 'E': 0}
-        
-        mapping = {
-            "Paracetamol": "B",
-            "Ceterizine": "E",
-            "Loperamide": "D",
-            "Mefenamic Acid": "C",
-            "Bromhexine HCL": "A"
-        }
-
-        # 3. CALCULATE QUANTITIES
-        medications = prescription_data.get('medications', [])
-        for med in medications:
-            name = med.get('medicineName')
-            qty = int(med.get('quantity', 0))
-            
-            if name in mapping:
-                letter = mapping[name]
-                counts[letter] += qty
-
-        # 4. CONSTRUCT FPGA COMMAND STRING
-        fpga_command = f"MED:A{counts['A']}B{counts['B']}C{counts['C']}D{counts['D']}E{counts['E']}"
+        # 2 - 4. MAP NAMES TO FPGA LETTERS, SUM QUANTITIES, BUILD FRAMES
+        # Usually already staged when the card was scanned
+        build_start = time.perf_counter()
+        try:
+            counts, fpga_commands = compile_order(patient_id, visit_date, prescription_data)
+        except UnmappedMedicineError as e:
+            print(f"Unmapped medicines: {e.names}")
+            return jsonify({"status": "error", "message": str(e), "unmapped": e.names})
+        observe_stage("dispense", "command_build", time.perf_counter() - build_start)
+        if not fpga_commands:
+            return jsonify({"status": "error", "message": "Nothing to dispense for this prescription."})
         
-        print(f"FINAL FPGA STRING: {fpga_command}")
+        print(f"FINAL FPGA STRING(S): {' | '.join(fpga_commands)}")
         print("-------------------------------------------\n")
         
         # =======================================================
-        # == UART TRANSMISSION BLOCK ============================
+        # == HAND OFF TO BACKGROUND JOB ========================
         # =======================================================
-        stock_status = None
-        
-        if ser and ser.is_open:
-            try:
-                # Clear buffers and give hardware a tiny moment to stabilize
-                ser.reset_input_buffer()
-                # ser.reset_output_buffer()
-                # time.sleep(0.1) 
-
-                # Send command with newline
-                full_command = fpga_command + "\n"
-                ser.write(full_command.encode('utf-8'))
-                print(f"[UART TX] Command Sent: {full_command.strip()}. Waiting for response...")
-
-                # --- Wait for responses ---
-                confirmed = False
-                start_wait = time.time()
-                timeout = 30 
-
-                while (time.time() - start_wait) < timeout:
-                    if ser.in_waiting > 0:
-                        response = ser.readline().decode('utf-8', errors='replace').strip()
-                        print(f"[UART RX] Incoming: {response}")
-                        
-                        # Handle Explicit FPGA Error
-                        if "ERR" in response:
-                            return jsonify({"status": "error", "message": "FPGA returned ERR: Command rejected."})
-
-                        # Handle Completion Signal
-                        if "DONE" in response:
-                            confirmed = True
-                            print("[System] Dispense Complete. Requesting Stock Status...")
-                            ser.write(b"END\n") # Triggering FPGA to send STK
-                        
-                        # Handle Stock Data
-                        if response.startswith("STK:"):
-                            stock_status = response.replace("STK:", "")
-                            print(f"[System] Stock Data Captured: {stock_status}")
-                            
-                    # Exit loop only when we have both confirmation and stock data
-                    if confirmed and stock_status:
-                        break
-
-                    time.sleep(0.05) # Prevent high CPU usage
-
-                if not confirmed:
-                    return jsonify({"status": "error", "message": "Hardware Timeout: 'DONE' not received."})
-
-            except Exception as uart_err:
-                return jsonify({"status": "error", "message": f"UART Failure: {uart_err}"})
-        else:
+        pool.open()
+        if not any(m.online for m in pool.machines):
             return jsonify({"status": "error", "message": "Serial port disconnected."})
-        
-        # =======================================================
-        # 5. UPDATE DATABASE (Only if UART loop finished successfully)
-        
-        # Log the Dispensing Event
-        try:
-            create_dispensing_log(patient_id, visit_date)
-        except Exception as log_err:
-            print(f"[Error] Dispensing log failed: {log_err}")
 
-        # Update Sensor Status from FPGA Data
-        try:
-            if stock_status:
-                update_sensor_status(stock_status)
-                print(f"[System] Sensors updated in DB.")
-        except Exception as sensor_err:
-            print(f"[Error] Sensor update failed: {sensor_err}")
+        # One job per visit in this process...
+        job, created = jobs.start(patient_id, visit_date, fpga_commands)
+        if not created:
+            return _job_accepted(job, duplicate=True)
 
-        # 6. RETURN SUCCESS
-        return jsonify({
-            "status": "dispense_success", 
-            "message": "Medicine dispensed successfully!",
-            "fpga_command": fpga_command  
-        })
+        machine = None
+        try:
+            # ...and one claim per visit across kiosks, taken before any UART traffic
+            rejected = claim_visit(job)
+            if rejected:
+                job.emit("failed", message=rejected["message"])
+                return jsonify(rejected)
+
+            # Least-loaded machine with stock in every slot this order needs:
+            # per the last STK reading and per the unit counts, less what queued
+            # orders have already reserved
+            slots = [letter for letter, qty in counts.items() if qty > 0]
+            with _assign_lock:
+                machine = pool.assign(slots, can_fill=lambda m: not stock_ledger.shortfall(m.machine_id, counts))
+                if machine is not None:
+                    stock_ledger.reserve(job.id, machine.machine_id, counts)
+            if machine is None:
+                rejected = out_of_stock(slots, counts)
+                fail_job(job, rejected["message"])
+                return jsonify(rejected)
+
+            # Queued behind a running dispense, the frames go out as soon as it
+            # reports DONE and STK
+            job.machine_id = machine.machine_id
+            job.emit("queued", machine=machine.machine_id, position=machine.assigned - 1)
+            job_pool.submit(run_dispense_job, job, machine, slots)
+        except Exception as e:
+            # Not handed off: without this the job would stay in flight and
+            # every retry would attach to it
+            abandon_job(job, machine, f"Dispense could not be queued: {e}")
+            raise
+
+        return _job_accepted(job)
 
     except Exception as e:
         print(f"Dispensing Error: {e}")
         return jsonify({"status": "error", "message": str(e)})
-        
+
+
+def _job_accepted(job, duplicate=False):
+    body = {
+        "status": "queued",
+        "job_id": job.id,
+        "events_url": f"/api/dispense/{job.id}/events",
+        "fpga_commands": job.commands
+    }
+    if duplicate:
+        print(f"[Dispense] Duplicate request for {job.patient_id}/{job.visit_date}; attached to job {job.id}")
+        body["duplicate"] = True
+    return jsonify(body), 202
+
+
+def claim_visit(job):
+    """
+    Claims the job's visit in Firestore. Returns None when the job may go
+    ahead, else the error response body. While Firestore is down, or when
+    the claim gets no answer within CLAIM_TIMEOUT, the kiosk's own record of
+    dispensed visits stands alone, as for the rest of offline mode.
+    """
+    if firestore_reachable():
+        try:
+            outcome = claim_dispense(job.patient_id, job.visit_date, job.id)
+        except FirestoreUnreachable as e:
+            print(f"[Dispense] Claim got no answer for {job.patient_id}/{job.visit_date}: {e}")
+            outcome = None
+        except Exception as e:
+            print(f"[Dispense] Claim failed for {job.patient_id}/{job.visit_date}: {e}")
+            return {"status": "error", "message": "Could not reserve this prescription. Please try again."}
+    else:
+        outcome = None
+
+    if outcome is None:
+        outcome = dispensed_locally(job.patient_id, job.visit_date)
+        if outcome is None:
+            print(f"[Dispense] Firestore offline; {job.patient_id}/{job.visit_date} claimed locally only")
+            return None
+
+    if outcome == "claimed":
+        job.claimed = True
+        return None
+    if outcome == "dispensed":
+        return {"status": "error", "message": "Prescription already dispensed.", "error_type": "already_dispensed"}
+    if outcome == "partial":
+        return {"status": "error", "message": "This prescription was partly dispensed. Please see the pharmacist.",
+                "error_type": "partially_dispensed"}
+    if outcome == "busy":
+        return {"status": "error", "message": "This prescription is being dispensed at another kiosk.",
+                "error_type": "in_progress"}
+    return {"status": "error", "message": "Prescription not found."}
+
+
+def out_of_stock(slots, counts):
+    """Error body for an order no machine can fill, naming the short slots."""
+    shortfalls = {m.machine_id: stock_ledger.shortfall(m.machine_id, counts)
+                  for m in pool.machines if m.online and m.has_stock(slots)}
+    if not shortfalls:
+        return {"status": "error", "message": "No dispenser has stock for this prescription."}
+    # Closest machine to being able to fill it
+    missing = min(shortfalls.values(), key=lambda s: sum(s.values()))
+    names = ", ".join(f"slot {slot} ({qty} short)" for slot, qty in sorted(missing.items()))
+    return {"status": "error", "message": f"Not enough stock for this prescription: {names}.",
+            "error_type": "insufficient_stock", "shortfall": shortfalls}
+
+
+def fail_job(job, message):
+    """Ends a job as failed and gives back its visit claim, if it took one, so it can be retried."""
+    job.emit("failed", message=message)
+    if not job.claimed:
+        return
+    try:
+        release_dispense_claim(job.patient_id, job.visit_date, job.id)
+    except Exception as e:
+        print(f"[Dispense] Could not release claim of job {job.id}: {e}")
+
+
+def abandon_job(job, machine, message):
+    """Undoes a job whose setup failed before run_dispense_job took it over."""
+    if machine is not None:
+        pool.release(machine)
+    stock_ledger.release(job.id)
+    fail_job(job, message)
+    jobs.discard(job)
+
+
+def fail_dispense(job, message):
+    """
+    Ends a job whose UART conversation failed. Once a frame has reached the
+    machine some medicine may be in the tray: the claim stays and the visit
+    is recorded as partially dispensed rather than offered for a retry.
+    """
+    if not job.sent:
+        fail_job(job, message)
+        return
+    counts = {}
+    for frame in job.sent:
+        for slot, qty in frame_counts(frame).items():
+            counts[slot] = counts.get(slot, 0) + qty
+    print(f"[Dispense] Job {job.id} failed after {len(job.sent)} frame(s); {counts} may have been dispensed")
+    try:
+        record_partial_dispense(job.patient_id, job.visit_date, counts, job.machine_id)
+    except Exception as db_err:
+        print(f"[Error] Partial dispense record failed: {db_err}")
+    job.emit("failed", message=f"{message} Part of the prescription may have been dispensed; please see the pharmacist.",
+             partial=True, dispensed=counts)
+
+
+def _timed_events(job):
+    """job.emit, also recording the UART stage timings the events carry."""
+    def on_event(name, **data):
+        if name == "sent":
+            job.sent.append(data["command"])
+            observe_stage("dispense", "uart_tx", data["tx"])
+            stock_ledger.record_frame(job.machine_id, frame_counts(data["command"]), job.id)
+        elif name in ("done", "stk"):
+            observe_stage("dispense", name, data["elapsed"])
+        job.emit(name, **data)
+    return on_event
+
+
+def run_dispense_job(job, machine, slots=None):
+    """Runs the hardware conversation and DB updates for one dispense job."""
+    # UART conversation; queued behind any in-flight command on this machine.
+    # `slots` are re-checked against the STK of the dispense ahead of it.
+    try:
+        stock_status = machine.dispense(job.commands, slots or (), timeout=30, on_event=_timed_events(job))
+    except DispenseError as fpga_err:
+        pool.release(machine)
+        fail_dispense(job, str(fpga_err))
+        return
+    except Exception as uart_err:
+        pool.release(machine)
+        fail_dispense(job, f"UART Failure: {uart_err}")
+        return
+    finally:
+        # Frames sent were counted as they went out; the rest is not coming
+        stock_ledger.release(job.id)
+    pool.release(machine, stock_status, dispensed=True)
+    if stock_status:
+        stock_ledger.observe_stk(machine.machine_id, stock_status)
+
+    # UPDATE DATABASE (Only if UART conversation finished successfully)
+    # Log entry, visit status and sensor bitmap are journaled as one batch
+    # and committed to Firestore in the background
+    try:
+        with timed("dispense", "db_commit"):
+            record_dispense(job.patient_id, job.visit_date, stock_status, machine.machine_id)
+    except Exception as db_err:
+        print(f"[Error] Dispense record failed: {db_err}")
+
+    observe_stage("dispense", "dispense_total", time.time() - job.created)
+
+    job.emit("db_committed", message="Medicine dispensed successfully!")
+    # The status page now shows the QR code for this visit's page
+    prerender_patient_view(job.patient_id, job.visit_date)
+
+
+@app.route('/api/dispense/<job_id>', methods=['GET'])
+def dispense_job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown dispense job."}), 404
+    return jsonify({"status": "success", "job": job.to_dict()})
+
+
+@app.route('/api/dispense/<job_id>/events')
+def dispense_job_events(job_id):
+    """Server-sent progress events: queued, sent, done, stk, db_committed (or failed)."""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown dispense job."}), 404
+    return Response(stream_with_context(job.stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/machines', methods=['GET'])
+def get_machines():
+    """Per-machine queue depth and last stock reading, for the dashboard."""
+    return jsonify({"status": "success", "machines": pool.status()})
+
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    caches = dict(cache_stats(), staged_order=staged_orders.stats(), dashboard_feed=dashboard_feed.stats(),
+                  page=page_cache.stats())
+    return jsonify({"status": "success", "caches": caches, "write_queue": write_queue.stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/latency', methods=['GET'])
+def get_latency():
+    """p50/p95 per dispense stage, for the dashboard."""
+    return jsonify({"status": "success", "dispense": metrics.latency_summary("dispense", DISPENSE_STAGES)})
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    """Readiness of the lazily started backends."""
+    return jsonify({
+        "status": "success",
+        "warm": _started.is_set(),
+        "firestore": db.ready,
+        "machines_online": sum(m.online for m in pool.machines),
+    })
+
+@app.route('/api/stock/forecast', methods=['GET'])
+def get_stock_forecast():
+    """Per machine and slot: units, consumption rates, hours to empty and status."""
+    return jsonify({"status": "success",
+                    "machines": stock_ledger.forecast([m.machine_id for m in pool.machines])})
+
+@app.route('/api/stock/refill', methods=['POST'])
+def refill_stock():
+    """Records a refill: {"machine_id", "slots": ["A", ...] or "slot", "units" (default: capacity)}."""
+    data = request.get_json(silent=True) or {}
+    machine_id = data.get('machine_id') or pool.primary.machine_id
+    slots = data.get('slots') or ([data['slot']] if data.get('slot') else [])
+    units = data.get('units')
+    if pool.get(machine_id) is None:
+        return jsonify({"status": "error", "message": f"Unknown machine {machine_id}."}), 400
+    if not slots or any(slot not in SLOTS or len(slot) != 1 for slot in slots):
+        return jsonify({"status": "error", "message": "Slots must be letters A-E."}), 400
+    if units is not None and (not isinstance(units, int) or units < 0):
+        return jsonify({"status": "error", "message": "Units must be a non-negative integer."}), 400
+    levels = {slot: stock_ledger.refill(machine_id, slot, units) for slot in slots}
+    return jsonify({"status": "success", "machine_id": machine_id, "units": levels})
+
+@app.route('/api/slots', methods=['GET'])
+def get_slot_map():
+    return jsonify({"status": "success", **slot_map.stats()})
+
+# =======================================================
+# == MONITORING DASHBOARD FEED
+# =======================================================
+# Every dashboard tab shares one set of Firestore listeners held here and
+# gets updates as deltas over one SSE stream (dashboard_feed.py). Each open
+# stream holds a server thread, like the dispense progress streams, so they
+# are capped well below gunicorn's THREADS; raise it under WORKER_CLASS=gevent.
+DASHBOARD_REFRESH = float(os.environ.get("DASHBOARD_REFRESH", "3"))   # config.json refreshInterval
+DASHBOARD_MAX_STREAMS = int(os.environ.get("DASHBOARD_MAX_STREAMS", "4"))
+DASHBOARD_RETRY_AFTER = 30      # seconds, for tabs turned away at the cap
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def dashboard_kiosk_stats():
+    dispense = metrics.latency_summary("dispense", ("dispense_total",))["dispense_total"]
+    forecast = stock_ledger.forecast([pool.primary.machine_id])[pool.primary.machine_id]
+    return {
+        "queue": {m.machine_id: m.assigned for m in pool.machines},
+        "online": {m.machine_id: m.online for m in pool.machines},
+        "dispense_p50": dispense["p50"],
+        "dispense_p95": dispense["p95"],
+        "dispense_count": dispense["count"],
+        # Primary machine's slots, rounded so the delta only changes with the estimate
+        "forecast": {slot: {"status": entry["status"], "units": entry["available"],
+                            "hours": None if entry["hours_to_empty"] is None else round(entry["hours_to_empty"], 1)}
+                     for slot, entry in forecast.items()},
+    }
+
+
+dashboard_feed = DashboardFeed(watch_document, watch_log_day, dashboard_kiosk_stats, DASHBOARD_REFRESH,
+                               max_streams=DASHBOARD_MAX_STREAMS)
+
+
+def _dashboard_date():
+    day = request.args.get('date') or time.strftime("%Y-%m-%d")
+    return day if DATE_PATTERN.match(day) else None
+
+
+@app.route('/api/dashboard/stream')
+def dashboard_stream():
+    """Server-sent dashboard state: a "snapshot" event, then "delta" events."""
+    day = _dashboard_date()
+    if day is None:
+        return jsonify({"status": "error", "message": "Date must be YYYY-MM-DD."}), 400
+    # Scans and dispenses need the worker threads more than another tab does
+    if not dashboard_feed.acquire():
+        return jsonify({"status": "error", "message": "Too many open dashboards; retrying shortly.",
+                        "error_type": "busy"}), 503, {'Retry-After': str(DASHBOARD_RETRY_AFTER)}
+    response = Response(stream_with_context(dashboard_feed.stream(day)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Called by the server when the stream ends, even if it never started
+    response.call_on_close(dashboard_feed.release)
+    return response
+
+@app.route('/api/dashboard/logs', methods=['GET'])
+def dashboard_logs():
+    """Older log events for "Load older": newest first, before the `before` timestamp."""
+    day = _dashboard_date()
+    if day is None:
+        return jsonify({"status": "error", "message": "Date must be YYYY-MM-DD."}), 400
+    page_size = max(1, min(request.args.get('limit', 25, type=int), 100))
+    try:
+        events = read_log_page(day, request.args.get('before'), page_size)
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Could not read logs: {e}"})
+    return jsonify({"status": "success", "date": day, "events": [{"id": doc_id, **entry} for doc_id, entry in events]})
+
+@app.route('/api/dashboard/visit', methods=['GET'])
+def dashboard_visit():
+    """Patient and visit behind a log row, from the kiosk's caches."""
+    patient_id = request.args.get('patient_id')
+    visit_date = request.args.get('visit_date')
+    if not patient_id or not visit_date:
+        return jsonify({"status": "error", "message": "Missing Patient ID or Visit Date."})
+    visit = read_visit_data(patient_id, visit_date)
+    if not visit:
+        return jsonify({"status": "error", "message": "Visit not found."})
+    return jsonify({"status": "success", "patient": read_patient_data(patient_id) or {}, "visit": visit})
+
 @app.route('/patient_view')
 def patient_view():
     """Route for patients to view their prescription after scanning the QR code."""
@@ -321,18 +775,74 @@ def patient_view():
     
     if not patient_id or not visit_date:
         return "Missing information to load prescription.", 400
+    visit_date = visit_date.strip()
 
-    # Use your existing firebase.py functions to get data
-    patient_info = read_patient_data(patient_id) 
-    prescription_data = read_visit_data(patient_id, visit_date)
-    
-    if not patient_info or not prescription_data:
-        return "Prescription record not found.", 404
+    def render():
+        # Use your existing firebase.py functions to get data
+        patient_info = read_patient_data(patient_id) 
+        prescription_data = read_visit_data(patient_id, visit_date)
+
+        if not patient_info or not prescription_data:
+            return "Prescription record not found.", 404
+
+        return render_template('patient_view.html', 
+                               patient=patient_info, 
+                               prescription=prescription_data,
+                               visit_date=visit_date)
+
+    return cached_page('patient_view', patient_id, visit_date, render)
+
+def prerender_patient_view(patient_id, visit_date):
+    """Renders a visit's QR-code page into page_cache, so the patient's first view is a hit."""
+    try:
+        with app.test_request_context('/patient_view', query_string={'patient_id': patient_id, 'visit_date': visit_date}):
+            patient_view()
+        page_cache.prerendered += 1
+    except Exception as e:
+        print(f"[Pages] Pre-render failed for {patient_id}/{visit_date}: {e}")
+
+# =======================================================
+# == APP FACTORY
+# =======================================================
+_started = threading.Event()        # warm-up finished
+_warm_up_thread = None
+_start_lock = threading.Lock()
+
+
+def warm_up():
+    """Opens the serial links and connects to Firestore, off the request path."""
+    start = time.perf_counter()
+    pool.open()
+    try:
+        warm_up_firestore()
+        watch_slot_config(slot_map.apply_override)
+        for machine in pool.machines:
+            stock_tracker_for(machine.machine_id)
+    except Exception as e:
+        # Requests connect on demand; the replica covers scans meanwhile
+        print(f"[System] Firestore warm-up failed: {e}")
+    _started.set()
+    print(f"[System] Warm-up finished in {time.perf_counter() - start:.2f}s")
+
+
+def create_app():
+    """
+    Returns the app immediately; hardware and Firestore are brought up by a
+    background thread so the first page is served without waiting for
+    them. Safe to call more than once per process.
+    Production:  gunicorn -c gunicorn.conf.py wsgi:app
+    """
+    global _warm_up_thread
+    with _start_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+            _warm_up_thread.start()
+    return app
 
-    return render_template('patient_view.html', 
-                           patient=patient_info, 
-                           prescription=prescription_data,
-                           visit_date=visit_date)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # Development server. The reloader would fork a second process that
+    # opens the serial ports and initializes Firebase again, so it stays off.
+    create_app().run(host='0.0.0.0', port=int(os.environ.get("PORT", "5000")),
+                     debug=os.environ.get("FLASK_DEBUG", "1") == "1",
+                     use_reloader=False, threaded=True)
@@ -0,0 +1,244 @@
+# dashboard_feed.py
+#
+# One set of server-side listeners for every open Monitoring Dashboard tab.
+# Firestore changes (and the kiosk's own queue/latency figures) are folded
+# into a shared state and fanned out as server-sent events, so adding a
+# dashboard costs one HTTP stream instead of another set of Firestore
+# listeners and polls.
+#
+# Stream: GET /api/dashboard/stream?date=YYYY-MM-DD
+#   snapshot  full state, on connect (and if a client falls behind HISTORY)
+#   delta     only the fields changed since the client's previous message
+# Under gthread every open stream holds a worker thread, so at most
+# `max_streams` are served at once; further tabs get a 503 and retry later.
+#
+# Payload keys (any subset in a delta; a field set to null was removed):
+#   machine   fields of machines/MED-001        e.g. {"status": "online"}
+#   stock     fields of sensor/status           e.g. {"B": 1}
+#   kiosk     queue depth and dispense latency  e.g. {"queue": {"MED-001": 2}}
+#   logs      {"date", "count", "legacy", "events": {doc id: entry}} for the
+#             client's date; events only ever grow
+
+import copy
+import json
+import threading
+import time
+from collections import deque
+
+HISTORY = 512           # deltas kept for clients that are momentarily behind
+KEEPALIVE = 15          # seconds between SSE comments on a quiet stream
+LOG_PAGE_SIZE = 25      # newest events of a day kept live
+
+
+def diff(old, new):
+    """Top-level fields of `new` that differ from `old`; removed ones map to None."""
+    delta = {key: value for key, value in new.items() if old.get(key) != value}
+    delta.update({key: None for key in old if key not in new})
+    return delta
+
+
+def merge(into, delta):
+    """Folds a later delta into an earlier one (nested dicts are merged)."""
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(into.get(key), dict):
+            merge(into[key], value)
+        else:
+            into[key] = value
+    return into
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+
+class DashboardFeed:
+    """
+    `watch_document(path, on_change)` and `watch_log_day(day, page_size,
+    on_rollup, on_events)` start Firestore listeners (see firebase.py) and
+    return handles with unsubscribe(). `kiosk_stats()` is polled every
+    `refresh_interval` seconds while at least one client is connected.
+    Listeners start with the first client; a day's log listeners stop when
+    its last client leaves. A request takes a stream slot with acquire()
+    before streaming and gives it back with release() once the response
+    is closed.
+    """
+
+    def __init__(self, watch_document, watch_log_day, kiosk_stats=None, refresh_interval=3.0,
+                 documents=None, max_streams=4):
+        self.watch_document = watch_document
+        self.watch_log_day = watch_log_day
+        self.kiosk_stats = kiosk_stats
+        self.refresh_interval = refresh_interval
+        self.documents = documents or {"machine": "machines/MED-001", "stock": "sensor/status"}
+        self.clients = 0
+        self.messages = 0
+        self.max_streams = max_streams
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(max_streams)
+        self._state = {topic: {} for topic in self.documents}
+        self._state["kiosk"] = {}
+        self._days = {}                 # day -> {"clients", "watches", "rollup", "events"}
+        self._changes = deque(maxlen=HISTORY)   # (seq, day or None, payload)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._doc_watches = None
+        self._poller = None
+        self._start_lock = threading.Lock()
+
+    # --- Publishing (listener and poller threads) ---
+
+    def _emit(self, payload, day=None):
+        self._seq += 1
+        self._changes.append((self._seq, day, payload))
+        self._cond.notify_all()
+
+    def publish(self, topic, values):
+        """Replaces a topic's fields and emits what changed."""
+        with self._cond:
+            delta = diff(self._state[topic], values or {})
+            if delta:
+                self._state[topic] = dict(values or {})
+                self._emit({topic: delta})
+
+    def _on_rollup(self, day, data):
+        data = data or {}
+        entries = data.get("entries") or []
+        values = {
+            "count": data.get("count", 0),
+            # Days logged before per-event documents keep an entries array
+            "legacy": list(entries.values()) if isinstance(entries, dict) else list(entries),
+        }
+        with self._cond:
+            state = self._days.get(day)
+            if state is None:
+                return
+            delta = diff(state["rollup"], values)
+            if delta:
+                state["rollup"] = values
+                self._emit({"logs": {"date": day, **delta}}, day)
+
+    def _on_events(self, day, events):
+        with self._cond:
+            state = self._days.get(day)
+            if state is None:
+                return
+            changed = {doc_id: entry for doc_id, entry in events.items() if state["events"].get(doc_id) != entry}
+            if changed:
+                state["events"].update(changed)
+                self._emit({"logs": {"date": day, "events": changed}}, day)
+
+    def _poll_kiosk(self):
+        while True:
+            with self._cond:
+                if not self.clients:
+                    self._poller = None
+                    return
+            try:
+                self.publish("kiosk", self.kiosk_stats())
+            except Exception as e:
+                print(f"[Dashboard] Kiosk stats failed: {e}")
+            time.sleep(self.refresh_interval)
+
+    # --- Subscriptions ---
+
+    def acquire(self):
+        """Takes a stream slot; False when all `max_streams` are in use."""
+        if self._slots.acquire(blocking=False):
+            return True
+        with self._cond:
+            self.rejected += 1
+        return False
+
+    def release(self):
+        self._slots.release()
+
+    def _join(self, day):
+        with self._start_lock:
+            if self._doc_watches is None:
+                try:
+                    self._doc_watches = [
+                        self.watch_document(path, lambda data, topic=topic: self.publish(topic, data))
+                        for topic, path in self.documents.items()
+                    ]
+                except Exception as e:
+                    # Firestore unreachable; the next client retries
+                    print(f"[Dashboard] Could not start listeners: {e}")
+            with self._cond:
+                self.clients += 1
+                state = self._days.get(day)
+                if state is None:
+                    state = self._days[day] = {"clients": 0, "watches": [], "rollup": {}, "events": {}}
+                state["clients"] += 1
+                start_day = state["clients"] == 1
+                if self.kiosk_stats and self._poller is None:
+                    self._poller = threading.Thread(target=self._poll_kiosk, name="dashboard-kiosk", daemon=True)
+                    self._poller.start()
+            if start_day:
+                try:
+                    state["watches"] = self.watch_log_day(day, LOG_PAGE_SIZE,
+                                                          lambda data: self._on_rollup(day, data),
+                                                          lambda events: self._on_events(day, events))
+                except Exception as e:
+                    print(f"[Dashboard] Could not watch logs for {day}: {e}")
+
+    def _leave(self, day):
+        with self._start_lock:
+            with self._cond:
+                self.clients -= 1
+                state = self._days[day]
+                state["clients"] -= 1
+                if state["clients"]:
+                    return
+                del self._days[day]
+            for watch in state["watches"]:
+                watch.unsubscribe()
+
+    def snapshot(self, day):
+        with self._cond:
+            state = self._days.get(day) or {"rollup": {}, "events": {}}
+            payload = {topic: dict(values) for topic, values in self._state.items()}
+            payload["logs"] = {"date": day, "count": 0, "legacy": [], **state["rollup"],
+                               "events": dict(state["events"])}
+            return payload
+
+    def stream(self, day, keepalive=KEEPALIVE):
+        """Yields a text/event-stream for one dashboard: a snapshot, then merged deltas."""
+        self._join(day)
+        try:
+            with self._cond:
+                cursor = self._seq
+                payload = self.snapshot(day)
+            self.messages += 1
+            yield sse("snapshot", payload)
+
+            while True:
+                with self._cond:
+                    if self._seq == cursor:
+                        self._cond.wait(keepalive)
+                    behind = bool(self._changes) and self._changes[0][0] > cursor + 1
+                    batch = [] if behind else [c for c in self._changes if c[0] > cursor]
+                    cursor = self._seq
+                    if behind:
+                        payload = self.snapshot(day)
+
+                if behind:
+                    self.messages += 1
+                    yield sse("snapshot", payload)
+                    continue
+                delta = {}
+                for _, change_day, change in batch:
+                    if change_day in (None, day):
+                        # Copied: merge() mutates, and the change is shared
+                        merge(delta, copy.deepcopy(change))
+                if delta:
+                    self.messages += 1
+                    yield sse("delta", delta)
+                elif not batch:
+                    yield ": keepalive\n\n"
+        finally:
+            self._leave(day)
+
+    def stats(self):
+        with self._cond:
+            return {"clients": self.clients, "days": sorted(self._days), "seq": self._seq,
+                    "messages": self.messages, "max_streams": self.max_streams, "rejected": self.rejected}
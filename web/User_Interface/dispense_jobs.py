@@ -0,0 +1,129 @@
+# dispense_jobs.py
+
+import json
+import threading
+import time
+import uuid
+
+# Progress stages a dispense job reports, in order:
+#   queued -> sent -> done -> stk -> db_committed
+# "failed" may replace any stage after queued and ends the job; it carries
+# partial=True and the dispensed units when frames had reached the machine.
+# db_committed means the Firestore writes are journaled locally; the
+# write-behind queue delivers them (see write_behind.py).
+TERMINAL_EVENTS = ("db_committed", "failed")
+
+# Finished jobs are kept this long so late SSE subscribers still get the result
+JOB_RETENTION = 600
+
+
+class DispenseJob:
+    def __init__(self, patient_id, visit_date, commands, machine_id=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.patient_id = patient_id
+        self.visit_date = visit_date
+        self.commands = commands         # MED: frames, sent back to back
+        self.machine_id = machine_id
+        self.claimed = False             # holds the visit's Firestore dispense claim
+        self.sent = []                   # frames that reached the machine
+        self.created = time.time()
+        self.finished = None
+        self.events = []
+        self._cond = threading.Condition()
+
+    def emit(self, name, **data):
+        with self._cond:
+            self.events.append((name, data))
+            if name in TERMINAL_EVENTS:
+                self.finished = time.time()
+            self._cond.notify_all()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def state(self):
+        return self.events[-1][0] if self.events else "new"
+
+    def wait_events(self, cursor, timeout=15):
+        """Returns events after index `cursor`, blocking up to `timeout` for new ones."""
+        with self._cond:
+            if cursor >= len(self.events) and not self.done:
+                self._cond.wait(timeout)
+            return self.events[cursor:]
+
+    def stream(self, keepalive=15):
+        """Yields the job's events as a text/event-stream until it finishes."""
+        cursor = 0
+        while True:
+            batch = self.wait_events(cursor, keepalive)
+            if not batch:
+                yield ": keepalive\n\n"
+                continue
+            for name, data in batch:
+                yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+            cursor += len(batch)
+            if self.done and cursor >= len(self.events):
+                return
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "patient_id": self.patient_id,
+            "visit_date": self.visit_date,
+            "fpga_commands": self.commands,
+            "machine_id": self.machine_id,
+            "state": self.state,
+            "events": [{"event": name, **data} for name, data in self.events],
+        }
+
+
+class JobRegistry:
+    """
+    Jobs by id, plus the unfinished job of each (patient_id, visit_date), so
+    a repeated dispense request attaches to the job already running.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._in_flight = {}            # (patient_id, visit_date) -> unfinished job
+        self._lock = threading.Lock()
+
+    def start(self, patient_id, visit_date, commands, machine_id=None):
+        """
+        Returns (job, True) for a new job, or (running job, False) when the
+        visit already has one in flight.
+        """
+        key = (patient_id, visit_date.strip())
+        with self._lock:
+            running = self._in_flight.get(key)
+            if running is not None and not running.done:
+                return running, False
+            self._prune()
+            job = DispenseJob(patient_id, visit_date.strip(), commands, machine_id)
+            self._jobs[job.id] = job
+            self._in_flight[key] = job
+        return job, True
+
+    def running(self, patient_id, visit_date):
+        with self._lock:
+            job = self._in_flight.get((patient_id, visit_date.strip()))
+            return job if job is not None and not job.done else None
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job):
+        """Forgets a job that never got going, so the next request starts afresh."""
+        with self._lock:
+            if self._in_flight.get((job.patient_id, job.visit_date)) is job:
+                del self._in_flight[(job.patient_id, job.visit_date)]
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION
+        for job_id in [j.id for j in self._jobs.values() if j.done and j.finished < cutoff]:
+            del self._jobs[job_id]
+        for key in [k for k, j in self._in_flight.items() if j.done]:
+            del self._in_flight[key]
@@ -0,0 +1,40 @@
+# dispense_plan.py
+#
+# protocol_handler.v accepts exactly one digit per slot ("MED:A3B0C2D0E1",
+# rx_len == 14) and loads it into a 4-bit servo counter, so a single frame
+# can ask for at most 9 units per slot. Larger orders are split into the
+# fewest frames that stay within that limit and are sent back to back.
+#
+# Tested against fpga_sim in tests/test_dispense_plan.py.
+
+from serial_link import SLOTS
+
+MAX_PER_FRAME = 9
+
+
+def format_frame(counts):
+    return "MED:" + "".join(f"{slot}{counts.get(slot, 0)}" for slot in SLOTS)
+
+
+def plan_frames(counts):
+    """
+    Turns {'A': 12, 'B': 3, ...} into the shortest list of protocol-legal
+    MED: frames whose per-slot totals add up to `counts`. Returns [] when
+    nothing is to be dispensed.
+    """
+    remaining = {slot: int(counts.get(slot, 0)) for slot in SLOTS}
+    if any(qty < 0 for qty in remaining.values()):
+        raise ValueError("Quantities cannot be negative.")
+
+    frames = []
+    while any(remaining.values()):
+        chunk = {slot: min(MAX_PER_FRAME, qty) for slot, qty in remaining.items()}
+        frames.append(format_frame(chunk))
+        remaining = {slot: qty - chunk[slot] for slot, qty in remaining.items()}
+    return frames
+
+
+def frame_counts(frame):
+    """Inverse of format_frame: "MED:A3B0C2D0E1" -> {'A': 3, 'B': 0, ...}."""
+    return {slot: int(frame[5 + 2 * i]) for i, slot in enumerate(SLOTS)}
+
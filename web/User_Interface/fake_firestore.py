@@ -0,0 +1,460 @@
+# fake_firestore.py
+#
+# In-memory stand-in for the parts of the Firestore Admin SDK that firebase.py
+# uses, so the kiosk can be run and measured without the network:
+#
+#     FIRESTORE_BACKEND=fake python app.py
+#
+# `latency` adds a simulated round trip to every read and write, and
+# `reads` / `writes` count billed document operations.
+
+import copy
+import enum
+import itertools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+
+class NotFound(Exception):
+    """Mirrors google.api_core.exceptions.NotFound for update() on a missing doc."""
+
+
+class ServiceUnavailable(Exception):
+    """Raised for every call while the fake client is set `offline`."""
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+# Field value that removes the field, like firestore.DELETE_FIELD
+DELETE_FIELD = object()
+
+
+class ChangeType(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+
+class DocumentChange:
+    def __init__(self, change_type, document):
+        self.type = change_type
+        self.document = document
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, update_time):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class Watch:
+    def __init__(self, client, entry):
+        self._client = client
+        self._entry = entry
+
+    def unsubscribe(self):
+        with self._client._lock:
+            if self._entry in self._client._listeners:
+                self._client._listeners.remove(self._entry)
+
+
+# =========================================================
+# REFERENCES
+# =========================================================
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path[:-1])
+
+    def collection(self, name):
+        return CollectionReference(self._client, self.path + (name,))
+
+    def get(self, transaction=None):
+        client = self._client
+        client._round_trip()
+        with client._lock:
+            client.reads += 1
+            return client._snapshot(self.path)
+
+    def set(self, data, merge=False):
+        client = self._client
+        client._round_trip()
+        with client._lock:
+            current = client._docs.get(self.path)
+            base = dict(current[0]) if (merge and current) else {}
+            client._write(self.path, _apply(base, data))
+
+    def update(self, data):
+        client = self._client
+        client._round_trip()
+        with client._lock:
+            current = client._docs.get(self.path)
+            if current is None:
+                raise NotFound(f"No document to update: {'/'.join(self.path)}")
+            client._write(self.path, _apply(dict(current[0]), data))
+
+    def delete(self):
+        client = self._client
+        client._round_trip()
+        with client._lock:
+            client._delete(self.path)
+
+    def on_snapshot(self, callback):
+        return self._client._listen(self, callback)
+
+    # --- listener target protocol ---
+
+    def _covers(self, path):
+        return path == self.path
+
+    def _snapshots(self):
+        return [self._client._snapshot(self.path)]
+
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "array_contains": lambda a, b: b in (a or []),
+}
+
+
+class Query:
+    """
+    Filters, ordering, projections and limits over one collection's
+    documents, or over every collection with the same ID when
+    `all_descendants` is set (collection-group queries).
+    """
+
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, client, path, all_descendants=False, filters=(), fields=None, limit=None, order=None):
+        self._client = client
+        self.path = path
+        self._all_descendants = all_descendants
+        self._filters = tuple(filters)
+        self._fields = fields
+        self._limit = limit
+        self._order = order             # (field, direction)
+
+    def _copy(self, **changes):
+        args = dict(all_descendants=self._all_descendants, filters=self._filters,
+                    fields=self._fields, limit=self._limit, order=self._order)
+        args.update(changes)
+        return Query(self._client, self.path, **args)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def order_by(self, field, direction=ASCENDING):
+        return self._copy(order=(field, direction))
+
+    def _covers(self, path):
+        if len(path) % 2:
+            return False
+        if self._all_descendants:
+            return path[-2] == self.path[-1]
+        return path[:-1] == self.path
+
+    def _matches(self, snap):
+        data = snap._data or {}
+        # Like Firestore, documents missing a filtered field never match
+        return all(field in data and _OPERATORS[op](data[field], value)
+                   for field, op, value in self._filters)
+
+    def _snapshots(self):
+        client = self._client
+        snaps = [client._snapshot(p) for p in sorted(client._docs) if self._covers(p)]
+        snaps = [s for s in snaps if self._matches(s)]
+        if self._order is not None:
+            # Like Firestore, documents without the field are left out
+            field, direction = self._order
+            snaps = sorted((s for s in snaps if field in (s._data or {})), key=lambda s: s._data[field],
+                           reverse=direction == self.DESCENDING)
+        if self._limit is not None:
+            snaps = snaps[:self._limit]
+        if self._fields is not None:
+            snaps = [DocumentSnapshot(s.reference, {f: s._data[f] for f in self._fields if f in s._data},
+                                      s.update_time) for s in snaps]
+        return snaps
+
+    def stream(self):
+        client = self._client
+        client._round_trip()
+        with client._lock:
+            snaps = self._snapshots()
+            client.reads += max(1, len(snaps))
+        return iter(snaps)
+
+    def get(self):
+        return list(self.stream())
+
+    def on_snapshot(self, callback):
+        return self._client._listen(self, callback)
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path[-1]
+
+    @property
+    def parent(self):
+        return DocumentReference(self._client, self.path[:-1]) if len(self.path) > 1 else None
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self.path + (document_id or uuid.uuid4().hex[:20],))
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return self._client._clock_now(), ref
+
+
+class WriteBatch:
+    """Collects writes and applies them atomically on commit()."""
+
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference, data, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        client = self._client
+        client._round_trip()
+        with client._lock:
+            for kind, ref, data, merge in self._writes:
+                if kind == "update" and ref.path not in client._docs:
+                    raise NotFound(f"No document to update: {'/'.join(ref.path)}")
+            for kind, ref, data, merge in self._writes:
+                current = client._docs.get(ref.path)
+                if kind == "delete":
+                    client._delete(ref.path)
+                elif kind == "set" and not merge:
+                    client._write(ref.path, _apply({}, data))
+                else:
+                    client._write(ref.path, _apply(dict(current[0]) if current else {}, data))
+        self._writes = []
+
+
+class Transaction(WriteBatch):
+    """Writes staged by a @transactional function; see transactional()."""
+
+
+def transactional(fn):
+    """
+    Runs `fn(transaction, ...)` and commits its writes. The client lock is
+    held throughout, so transactions are serialized against every other
+    read and write (the real client retries on contention instead).
+    """
+    def run(transaction, *args, **kwargs):
+        with transaction._client._lock:
+            result = fn(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+    return run
+
+
+# =========================================================
+# CLIENT
+# =========================================================
+
+class Client:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.offline = False
+        self.reads = 0
+        self.writes = 0
+        self._docs = {}             # path tuple -> (data, update_time)
+        self._listeners = []        # (target, callback); target is a DocumentReference or Query
+        self._lock = threading.RLock()
+        self._clock = itertools.count(1)
+
+    def collection(self, name):
+        return CollectionReference(self, (name,))
+
+    def document(self, path):
+        return DocumentReference(self, tuple(path.split("/")))
+
+    def collection_group(self, collection_id):
+        return Query(self, (collection_id,), all_descendants=True)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self):
+        return Transaction(self)
+
+    # --- internals ---
+
+    def _round_trip(self):
+        if self.offline:
+            raise ServiceUnavailable("fake Firestore is offline")
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _clock_now(self):
+        # Strictly increasing so update_time works as a version
+        return datetime.now(timezone.utc).replace(microsecond=0).isoformat() + f"#{next(self._clock)}"
+
+    def _snapshot(self, path):
+        data, update_time = self._docs.get(path, (None, None))
+        return DocumentSnapshot(DocumentReference(self, path), data, update_time)
+
+    def _write(self, path, data):
+        change = ChangeType.MODIFIED if path in self._docs else ChangeType.ADDED
+        self._docs[path] = (data, self._clock_now())
+        self.writes += 1
+        self._notify(path, change)
+
+    def _delete(self, path):
+        if self._docs.pop(path, None) is not None:
+            self.writes += 1
+            self._notify(path, ChangeType.REMOVED)
+
+    def _listen(self, target, callback):
+        entry = (target, callback)
+        with self._lock:
+            self._listeners.append(entry)
+            snaps = target._snapshots()
+            changes = [DocumentChange(ChangeType.ADDED, s) for s in snaps if s.exists]
+            self.reads += max(1, len(snaps))
+        callback(snaps, changes, self._clock_now())
+        return Watch(self, entry)
+
+    def _notify(self, path, change_type):
+        for target, callback in list(self._listeners):
+            if not target._covers(path):
+                continue
+            snaps = target._snapshots()
+            changed = self._snapshot(path)
+            kind = change_type
+            if isinstance(target, Query) and not any(s.reference.path == path for s in snaps):
+                # Write moved the document out of the query's result set
+                kind = ChangeType.REMOVED
+            self.reads += 1
+            callback(snaps, [DocumentChange(kind, changed)], self._clock_now())
+
+
+def _apply(base, updates):
+    for key, value in updates.items():
+        if isinstance(value, ArrayUnion):
+            existing = list(base.get(key, []))
+            existing.extend(v for v in value.values if v not in existing)
+            base[key] = existing
+        elif isinstance(value, Increment):
+            base[key] = base.get(key, 0) + value.value
+        elif value is DELETE_FIELD:
+            base.pop(key, None)
+        else:
+            base[key] = copy.deepcopy(value)
+    return base
+
+
+def client(latency=0.0):
+    return Client(latency=latency)
+
+
+# =========================================================
+# BENCHMARK: kiosk sessions through firebase.py's cache
+# =========================================================
+
+def main():
+    import argparse
+    import os
+    import random
+    import statistics
+
+    parser = argparse.ArgumentParser(description="Measure firebase.py cache hit rate and latency offline.")
+    parser.add_argument("--patients", type=int, default=20)
+    parser.add_argument("--visits", type=int, default=10)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="simulated round trip in seconds")
+    args = parser.parse_args()
+
+    os.environ["FIRESTORE_BACKEND"] = "fake"
+    import firebase
+
+    firebase.db.latency = 0
+    for p in range(args.patients):
+        patient = firebase.db.collection("consultations").document(f"P{p:04d}")
+        patient.set({"patientID": f"P{p:04d}", "patientName": f"Patient {p}", "age": 20, "gender": "F"})
+        for v in range(args.visits):
+            patient.collection("visits").document(f"2025-01-{v + 1:02d}").set(
+                {"medications": [{"medicineName": "Paracetamol", "quantity": 2}]})
+    firebase.db.latency = args.latency
+
+    def session(patient_id):
+        _, dates = firebase.lookup_patient(patient_id)             # /api/scan_id
+        firebase.read_patient_data(patient_id)                     # /schedule
+        firebase.read_patient_data(patient_id)                     # /api/get_prescription_details
+        firebase.read_visit_data(patient_id, dates[-1])
+        firebase.read_visit_data(patient_id, dates[-1])            # /api/dispense
+
+    rng = random.Random(1)
+    timings = []
+    reads_before = firebase.db.reads
+    for _ in range(args.sessions):
+        t0 = time.perf_counter()
+        session(f"P{rng.randrange(args.patients):04d}")
+        timings.append(time.perf_counter() - t0)
+
+    timings.sort()
+    print(f"sessions: {args.sessions}   simulated RTT: {args.latency * 1000:.0f} ms")
+    print(f"session latency: mean {statistics.mean(timings) * 1000:.1f} ms   "
+          f"p95 {timings[int(0.95 * (len(timings) - 1))] * 1000:.1f} ms   "
+          f"(uncached ~{5 * args.latency * 1000:.0f} ms)")
+    print(f"document reads: {firebase.db.reads - reads_before}")
+    for name, stats in firebase.cache_stats().items():
+        print(f"{name:>16}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
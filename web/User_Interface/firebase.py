@@ -1,25 +1,104 @@
 # firebase.py
 
-import firebase_admin
-from firebase_admin import credentials, firestore
-from datetime import datetime
+from datetime import datetime, date, timedelta
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import hashlib
 import json
+import os
+import threading
 import time
 import re
+import socket
+
+from doc_cache import TTLCache
+from write_behind import WriteBehindQueue
+from local_replica import LocalReplica
+from stock_tracker import StockTracker
+from serial_link import decode_stk
+from metrics import observe_stage
 
 # =========================================================
 # 1. ADMIN SDK INITIALIZATION FOR FIRESTORE
 # =========================================================
 
+# "admin" talks to the real project; "fake" uses the in-memory fake_firestore
+# backend so the kiosk can be exercised offline.
+FIRESTORE_BACKEND = os.environ.get("FIRESTORE_BACKEND", "admin")
+
 # Path to the JSON key file (Ensure this path is correct on your Pi)
-SERVICE_ACCOUNT_KEY = "/home/capstone/Desktop/capstone/capstone-doctor-interface-firebase-adminsdk-fbsvc-1a0663a6e1.json"
+SERVICE_ACCOUNT_KEY = os.environ.get(
+    "FIREBASE_SERVICE_ACCOUNT",
+    "/home/capstone/Desktop/capstone/capstone-doctor-interface-firebase-adminsdk-fbsvc-1a0663a6e1.json")
+
+firestore = None        # client library module, imported by _connect()
+
+
+def _connect():
+    """Imports the client library and builds the Firestore client (slow: gRPC, credentials)."""
+    global firestore
+    if FIRESTORE_BACKEND == "fake":
+        import fake_firestore as module
+        client = module.client(latency=float(os.environ.get("FAKE_FIRESTORE_LATENCY", "0")))
+    else:
+        import firebase_admin
+        from firebase_admin import credentials, firestore as module
+
+        # Initialize Firebase App (once per process, even if this module is re-imported)
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            cred = credentials.Certificate(SERVICE_ACCOUNT_KEY)
+            firebase_admin.initialize_app(cred)
+        client = module.client()
+
+    firestore = module
+    print(f"[Firestore] Connected ({FIRESTORE_BACKEND} backend)")
+    return client
+
+
+class LazyClient:
+    """
+    Stands in for the Firestore client so importing this module costs
+    nothing; the real client is built on first use (or by warm_up()) and
+    every attribute is forwarded to it.
+    """
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self):
+        return self._client is not None
 
-# Initialize Firebase App
-cred = credentials.Certificate(SERVICE_ACCOUNT_KEY)
-firebase_admin.initialize_app(cred)
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._connect()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+
+db = LazyClient(_connect)
+
+
+def _transport_errors():
+    """Exception types meaning Firestore could not be reached, as opposed to a rejected call."""
+    if FIRESTORE_BACKEND == "fake":
+        from fake_firestore import ServiceUnavailable
+        return (ServiceUnavailable, OSError)
+    # Imported on first use: google.api_core pulls in gRPC
+    try:
+        from google.api_core import exceptions
+    except ImportError:
+        return (OSError,)
+    return (exceptions.ServiceUnavailable, exceptions.DeadlineExceeded, exceptions.RetryError, OSError)
 
-# Get a reference to the Firestore client
-db = firestore.client() 
 
 # =========================================================
 # 2. RESTORED UTILITY FUNCTIONS (For project stability)
@@ -48,41 +127,258 @@ def stream_patient_visits(patient_id):
 
 
 # =========================================================
-# 3. CORE PROJECT FUNCTIONS (with stability fixes)
+# 3. READ-THROUGH CACHE (kept coherent by on_snapshot)
 # =========================================================
 
-def read_patient_data(patient_id):
+CACHE_TTL = 300                 # seconds; listeners normally refresh sooner
+CACHE_SIZE = 256
+MAX_WATCHED_PATIENTS = 32       # each watched patient holds two listeners
+
+patient_cache = TTLCache("patient", CACHE_SIZE, CACHE_TTL)
+visit_cache = TTLCache("visit", CACHE_SIZE, CACHE_TTL)
+visit_status_cache = TTLCache("visit_status", CACHE_SIZE, CACHE_TTL)    # {visit_date: status}
+visit_version_cache = TTLCache("visit_version", CACHE_SIZE, CACHE_TTL)  # see _content_version
+
+# Written by the claim transaction; pages never show it
+VERSION_IGNORED = ("dispense_claim",)
+
+_lookup_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="firestore")
+
+_watches = OrderedDict()        # patient_id -> (patient watch, visits watch)
+_watch_lock = threading.Lock()
+
+
+def _patient_profile(data):
+    return {
+        "patientID": data.get("patientID"),
+        "patientName": data.get("patientName"),
+        "age": data.get("age"),
+        "gender": data.get("gender")
+    }
+
+
+def _visit_status(doc):
+    return (doc.to_dict() or {}).get("status")
+
+
+_visit_change_callbacks = []
+
+
+def on_visit_change(callback):
     """
-    Reads the patient's static data (name, age, gender) 
-    from the main document in the 'consultations' collection.
+    Calls `callback(patient_id, visit_date)` when a visit document changes,
+    is removed or is dispensed here; visit_date is None when the patient's
+    profile changed. Called from listener and dispense threads.
     """
+    _visit_change_callbacks.append(callback)
+
+
+def _visit_changed(patient_id, visit_date=None):
+    for callback in _visit_change_callbacks:
+        try:
+            callback(patient_id, visit_date)
+        except Exception as e:
+            print(f"[Firestore] Visit change callback failed: {e}")
+
+
+def visit_version(patient_id, visit_date):
+    """The visit's content version as last read, heard or dispensed here, or None if not cached."""
+    return visit_version_cache.get((patient_id, visit_date.strip()))
+
+
+def _content_version(data):
+    # Content, not update_time: the write-behind commit of a dispense already
+    # shown here, or a claim, changes the document but not the page
+    content = {k: v for k, v in data.items() if k not in VERSION_IGNORED}
+    return hashlib.blake2b(json.dumps(content, sort_keys=True, default=str).encode("utf-8"),
+                           digest_size=8).hexdigest()
+
+
+def _cache_visit(key, data):
+    """Caches a visit and its version. Returns True if the version changed."""
+    version = _content_version(data)
+    changed = visit_version_cache.get(key) != version
+    visit_cache.put(key, data)
+    visit_version_cache.put(key, version)
+    return changed
+
+
+def _on_patient_snapshot(patient_id, doc_snapshots):
+    # The replica copy is what offline scans show, so it follows too
+    for doc in doc_snapshots:
+        if doc.exists:
+            profile = _patient_profile(doc.to_dict())
+            if patient_cache.get(patient_id) != profile:
+                _visit_changed(patient_id)
+            patient_cache.put(patient_id, profile)
+            replica.upsert_patient(patient_id, profile)
+        else:
+            patient_cache.invalidate(patient_id)
+            replica.remove_patient(patient_id)
+            _visit_changed(patient_id)
+
+
+def _on_visits_snapshot(patient_id, doc_snapshots, changes):
+    for change in changes:
+        key = (patient_id, change.document.id)
+        if change.type.name == "REMOVED":
+            visit_cache.invalidate(key)
+            visit_version_cache.invalidate(key)
+            _visit_changed(*key)
+            continue
+        # The first snapshot repeats documents already read; only real changes count
+        if _cache_visit(key, change.document.to_dict()):
+            _visit_changed(*key)
+    visit_status_cache.put(patient_id, {doc.id: _visit_status(doc) for doc in doc_snapshots})
+
+
+def watch_patient(patient_id):
+    """
+    Keeps the cached patient, visits and visit dates for `patient_id` in sync
+    through Firestore listeners. The least recently watched patient is
+    dropped once MAX_WATCHED_PATIENTS is reached.
+    """
+    with _watch_lock:
+        if patient_id in _watches:
+            _watches.move_to_end(patient_id)
+            return
+
+        patient_ref = db.collection("consultations").document(patient_id)
+        _watches[patient_id] = (
+            patient_ref.on_snapshot(
+                lambda doc_snapshots, changes, read_time: _on_patient_snapshot(patient_id, doc_snapshots)),
+            patient_ref.collection("visits").on_snapshot(
+                lambda doc_snapshots, changes, read_time: _on_visits_snapshot(patient_id, doc_snapshots, changes)),
+        )
+
+        while len(_watches) > MAX_WATCHED_PATIENTS:
+            old_id, watches = _watches.popitem(last=False)
+            for watch in watches:
+                watch.unsubscribe()
+            patient_cache.invalidate(old_id)
+            visit_status_cache.invalidate(old_id)
+            visit_cache.invalidate_where(lambda key: key[0] == old_id)
+            visit_version_cache.invalidate_where(lambda key: key[0] == old_id)
+
+
+def cache_stats():
+    """Hit/miss counters for each cache, plus the number of watched patients."""
+    return {
+        "patient": patient_cache.stats(),
+        "visit": visit_cache.stats(),
+        "visit_status": visit_status_cache.stats(),
+        "watched_patients": len(_watches),
+        "replica": {**replica.stats(), "online": _replica_state["online"]},
+        "stock": {path: tracker.stats() for path, tracker in _stock_trackers.items()},
+    }
+
+
+# =========================================================
+# 4. CORE PROJECT FUNCTIONS (with stability fixes)
+# =========================================================
+
+def _fetch_patient(patient_id):
     doc_ref = db.collection("consultations").document(patient_id)
     doc = doc_ref.get()
     
     if doc.exists:
-        data = doc.to_dict()
         print(f"\n--- Reading Static Data for Patient: {patient_id} ---")
-        return {
-            "patientID": data.get("patientID"),
-            "patientName": data.get("patientName"),
-            "age": data.get("age"),
-            "gender": data.get("gender")
-        }
+        profile = _patient_profile(doc.to_dict())
+        patient_cache.put(patient_id, profile)
+        replica.upsert_patient(patient_id, profile)
+        return profile
     else:
         print(f"\nNo static patient data found for ID: {patient_id}")
         return None
 
 
-def get_available_visit_dates(patient_id):
-    """Fetches all visit dates (document IDs) for a patient from Firestore."""
+def _fetch_visit_statuses(patient_id):
     # Path: consultations / [patient_id] / visits
     visits_ref = db.collection("consultations").document(patient_id).collection("visits")
-    
-    # Get all documents in the 'visits' subcollection
-    docs = visits_ref.stream()
-    
-    # Return a list of the document IDs (which are the visit dates)
-    return [doc.id for doc in docs]
+
+    # Projection: only the status field is downloaded, never the medications array
+    docs = visits_ref.select(["status"]).stream()
+
+    statuses = {doc.id: _visit_status(doc) for doc in docs}
+    visit_status_cache.put(patient_id, statuses)
+    return statuses
+
+
+def read_patient_data(patient_id):
+    """
+    Reads the patient's static data (name, age, gender) 
+    from the main document in the 'consultations' collection.
+    The local replica only stands in while Firestore is unreachable.
+    """
+    profile = patient_cache.get(patient_id)
+    if profile is not None:
+        return profile
+    if not firestore_reachable():
+        return replica.get_patient(patient_id)
+    try:
+        profile = _fetch_patient(patient_id)
+    except _transport_errors() as e:
+        _mark_unreachable(e)
+        return replica.get_patient(patient_id)
+    if profile is not None:
+        watch_patient(patient_id)
+    return profile
+
+
+def get_available_visit_dates(patient_id, pending_only=False):
+    """
+    Fetches the visit dates (document IDs) for a patient from Firestore.
+    With `pending_only`, visits already marked dispensed are left out.
+    """
+    statuses = visit_status_cache.get(patient_id)
+    if statuses is None:
+        try:
+            statuses = _fetch_visit_statuses(patient_id)
+        except Exception as e:
+            print(f"[Replica] Firestore unavailable ({e}); using local pending visits")
+            return replica.pending_dates(patient_id)
+        watch_patient(patient_id)
+    return [visit for visit, status in statuses.items() if not (pending_only and status == "dispensed")]
+
+
+def lookup_patient(patient_id, pending_only=False):
+    """
+    Scan-path lookup: fetches the patient profile and the visit dates in
+    parallel (visits as a status-only projection) and primes the caches so
+    the schedule page does not fetch them again.
+    Returns (profile, visit_dates); profile is None for unregistered IDs.
+    """
+    if pending_only and replica.synced and not firestore_reachable():
+        # Firestore is known to be down: answer from the replica instead of
+        # waiting out a timeout. It only holds the last REPLICA_WINDOW_DAYS
+        # of visits, so while online the visit list always comes from Firestore.
+        profile = patient_cache.get(patient_id) or replica.get_patient(patient_id)
+        if profile is not None:
+            return profile, replica.pending_dates(patient_id)
+
+    profile = patient_cache.get(patient_id)
+    statuses = visit_status_cache.get(patient_id)
+
+    try:
+        profile_future = _lookup_pool.submit(_fetch_patient, patient_id) if profile is None else None
+        statuses_future = _lookup_pool.submit(_fetch_visit_statuses, patient_id) if statuses is None else None
+        if profile_future:
+            profile = profile_future.result()
+        if statuses_future:
+            statuses = statuses_future.result()
+    except Exception as e:
+        profile = replica.get_patient(patient_id)
+        if profile is None:
+            raise
+        print(f"[Replica] Firestore unavailable ({e}); serving {patient_id} from local replica")
+        return profile, replica.pending_dates(patient_id)
+
+    if profile is None:
+        return None, []
+
+    watch_patient(patient_id)
+    visit_dates = [visit for visit, status in statuses.items() if not (pending_only and status == "dispensed")]
+    return profile, visit_dates
 
 
 def read_visit_data(patient_id, visit_date):
@@ -92,6 +388,10 @@ def read_visit_data(patient_id, visit_date):
     """
     # --- STABILITY FIX: Clean the date string immediately before use ---
     cleaned_visit_date = visit_date.strip()
+
+    cached = visit_cache.get((patient_id, cleaned_visit_date)) or replica.get_visit(patient_id, cleaned_visit_date)
+    if cached is not None:
+        return cached
     
     # Path: consultations / [patient_id] / visits / [cleaned_visit_date]
     doc_ref = (
@@ -104,42 +404,40 @@ def read_visit_data(patient_id, visit_date):
     
     if doc.exists:
         print(f"\n--- Reading Visit Data for Patient {patient_id} on {cleaned_visit_date} ---")
-        return doc.to_dict() # Returns the data dictionary
+        data = doc.to_dict() # Returns the data dictionary
+        _cache_visit((patient_id, cleaned_visit_date), data)
+        watch_patient(patient_id)
+        return data
     else:
         print(f"\nNo visit data found for Patient {patient_id} on {cleaned_visit_date}")
         return None
 
-def update_dispense_status(patient_id, visit_date):
-    try:
-        doc_ref = db.collection("consultations").document(patient_id).collection("visits").document(visit_date)
-        doc_ref.update({"status": "dispensed"})
-        return True
-    except Exception as e:
-        print(f"Error updating status: {e}")
-        return False
+# Dispensing logs: one small document per event under logs/{date}/events,
+# plus counters in the logs/{date} rollup document. A day's log no longer
+# grows toward the 1 MiB document limit, and dashboard listeners receive
+# only the new event. Days logged before this layout keep their "entries"
+# array in the rollup document.
+def log_event_path(now, patient_id):
+    # Time first, so document IDs sort chronologically; fixed per event, so
+    # a retried batch rewrites the same document
+    return f"logs/{now.strftime('%Y-%m-%d')}/events/{now.strftime('%H%M%S%f')}-{patient_id}"
 
-def create_dispensing_log(patient_id, visit_date):
-    try:
-        # Get today's date for the log filename (e.g., 2025-12-31)
-        today_str = datetime.now().strftime("%Y-%m-%d")
-        
-        log_ref = db.collection("logs").document(today_str)
-        
-        new_entry = {
-            "patient_id": patient_id,
-            "timestamp": datetime.now().strftime("%H:%M:%S"),
-            "source_visit": visit_date
-        }
-
-        # ArrayUnion adds the new entry to a list called 'entries' without overwriting old ones
-        log_ref.update({
-            "entries": firestore.ArrayUnion([new_entry])
-        })
-        return True
-    except Exception as e:
-        # If the document doesn't exist yet, .update() fails, so we .set() it
-        log_ref.set({"entries": [new_entry]})
-        return True
+
+def _log_entry(now, patient_id, visit_date, machine_id=None):
+    entry = {
+        "patient_id": patient_id,
+        "timestamp": now.strftime("%H:%M:%S"),
+        "logged_at": now.isoformat(),
+        "source_visit": visit_date
+    }
+    if machine_id:
+        entry["machine_id"] = machine_id
+    return entry
+
+
+def _log_rollup(now):
+    """Counter fields for the day's rollup document (values are increments)."""
+    return {"count": 1, f"hour_{now.strftime('%H')}": 1}
 
 
 def write_sensor_data(patient_id, value):
@@ -162,14 +460,8 @@ def update_sensor_status(stock_status):
     Input stock_status: "01000"
     """
     try:
-        # 1. Define the sensor keys
-        sensor_keys = ['E', 'D', 'C', 'B', 'A']
-        
-        # 2. Map the string "01000" to a dictionary
-        updates = {}
-        for i in range(len(sensor_keys)):
-            if i < len(stock_status):
-                updates[sensor_keys[i]] = int(stock_status[i])
+        # 1-2. Map the string "01000" to a dictionary of sensor keys
+        updates = decode_stk(stock_status)
 
         # 3. Use Firestore syntax (db.collection.document)
         # This will update fields A, B, C, D, E inside the document 'status'
@@ -187,3 +479,409 @@ def update_sensor_status(stock_status):
         except Exception as e2:
             print(f"[Firestore Error] IR Sensor update failed: {e2}")
             return False
+
+
+# =========================================================
+# 5. WRITE-BEHIND DISPENSE RECORDS
+# =========================================================
+
+# Pending writes survive restarts and network drops in this SQLite journal
+WRITE_JOURNAL = os.environ.get(
+    "WRITE_JOURNAL",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "pending_writes.sqlite3"))
+
+# Journal entries are plain JSON, so field transforms are stored as markers
+ARRAY_UNION = "__array_union__"      # journals written before sharded logs still hold these
+INCREMENT = "__increment__"
+
+
+def _decode_field(value):
+    if isinstance(value, dict) and ARRAY_UNION in value:
+        return firestore.ArrayUnion(value[ARRAY_UNION])
+    if isinstance(value, dict) and INCREMENT in value:
+        return firestore.Increment(value[INCREMENT])
+    return value
+
+
+def _commit_ops(ops):
+    """Commits journaled ops as a single Firestore batch (all or nothing)."""
+    batch = db.batch()
+    for op in ops:
+        data = {field: _decode_field(value) for field, value in op["data"].items()}
+        # set(merge=True) creates missing docs, so no update-then-set round trip
+        batch.set(db.document(op["path"]), data, merge=True)
+    start = time.perf_counter()
+    batch.commit()
+    observe_stage("write_behind", "firestore_commit", time.perf_counter() - start)
+
+
+# google.api_core errors carry their HTTP status: contention, quota and
+# server errors clear up by themselves, bad paths or values never do
+TRANSIENT_STATUS = (409, 429, 500, 503, 504)
+
+
+def _write_is_transient(e):
+    return isinstance(e, _transport_errors()) or getattr(e, "code", None) in TRANSIENT_STATUS
+
+
+write_queue = WriteBehindQueue(WRITE_JOURNAL, _commit_ops, _write_is_transient)
+write_queue.start()
+
+
+# The first machine keeps the original sensor/status document the dashboard reads
+PRIMARY_MACHINE = "MED-001"
+
+
+def sensor_doc_path(machine_id=None):
+    if machine_id in (None, PRIMARY_MACHINE):
+        return "sensor/status"
+    return f"sensor/{machine_id}"
+
+
+def _load_sensor_fields(path):
+    doc = db.document(path).get()
+    return doc.to_dict() if doc.exists else None
+
+
+# Delta-update logic: a sensor document only receives fields whose IR state
+# changed, so dashboard listeners fire on stock changes, not on dispenses
+_stock_trackers = {}
+
+
+def stock_tracker_for(machine_id=None):
+    path = sensor_doc_path(machine_id)
+    if path not in _stock_trackers:
+        _stock_trackers[path] = StockTracker(
+            write=lambda delta: write_queue.enqueue([{"path": path, "data": delta}]),
+            load=lambda: _load_sensor_fields(path))
+        # The Firestore read never runs on the dispense thread
+        _lookup_pool.submit(_stock_trackers[path].prime)
+    return _stock_trackers[path]
+
+
+def record_dispense(patient_id, visit_date, stock_status=None, machine_id=None):
+    """
+    Queues the dispensing log entry, the visit's "dispensed" status and the
+    sensor update as one batch. Returns once the batch is journaled; the
+    Firestore commit happens in the background.
+    """
+    visit_date = visit_date.strip()
+    now = datetime.now()
+
+    rollup = {field: {INCREMENT: n} for field, n in _log_rollup(now).items()}
+    ops = [
+        {"path": log_event_path(now, patient_id), "data": _log_entry(now, patient_id, visit_date, machine_id)},
+        {"path": f"logs/{now.strftime('%Y-%m-%d')}", "data": rollup},
+        {"path": f"consultations/{patient_id}/visits/{visit_date}", "data": {"status": "dispensed"}},
+    ]
+    stock_delta = stock_tracker_for(machine_id).observe(stock_status) if stock_status else None
+    if stock_delta:
+        ops.append({"path": sensor_doc_path(machine_id), "data": stock_delta})
+
+    write_queue.enqueue(ops)
+
+    # Show the new status locally before the batch lands
+    visit = visit_cache.get((patient_id, visit_date)) or replica.get_visit(patient_id, visit_date)
+    replica.mark_dispensed(patient_id, visit_date, visit)
+    if visit is not None:
+        _cache_visit((patient_id, visit_date), {**visit, "status": "dispensed"})
+    statuses = visit_status_cache.get(patient_id)
+    if statuses is not None:
+        visit_status_cache.put(patient_id, {**statuses, visit_date: "dispensed"})
+    _visit_changed(patient_id, visit_date)
+    return True
+
+
+# A dispense that failed after frames reached the machine: some medicine may
+# be in the tray, so the visit waits for a pharmacist instead of a retry
+PARTIALLY_DISPENSED = "partially_dispensed"
+
+
+def record_partial_dispense(patient_id, visit_date, counts, machine_id=None):
+    """
+    Queues the visit's "partially_dispensed" status with the units per slot
+    in the frames that reached the machine. The job's claim is left on the
+    visit.
+    """
+    visit_date = visit_date.strip()
+    partial = {"status": PARTIALLY_DISPENSED, "dispensed_counts": counts, "dispensed_by": machine_id}
+    write_queue.enqueue([{"path": f"consultations/{patient_id}/visits/{visit_date}", "data": partial}])
+
+    visit = visit_cache.get((patient_id, visit_date)) or replica.get_visit(patient_id, visit_date)
+    if visit is not None:
+        _cache_visit((patient_id, visit_date), {**visit, **partial})
+        replica.apply_visit(patient_id, visit_date, {**visit, **partial})
+    statuses = visit_status_cache.get(patient_id)
+    if statuses is not None:
+        visit_status_cache.put(patient_id, {**statuses, visit_date: PARTIALLY_DISPENSED})
+    _visit_changed(patient_id, visit_date)
+
+
+# =========================================================
+# 6. OFFLINE REPLICA OF PENDING PRESCRIPTIONS
+# =========================================================
+
+LOCAL_REPLICA = os.environ.get(
+    "LOCAL_REPLICA",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "replica.sqlite3"))
+REPLICA_WINDOW_DAYS = int(os.environ.get("REPLICA_WINDOW_DAYS", "7"))
+REPLICA_CHECK_INTERVAL = 60     # seconds between connectivity probes
+
+replica = LocalReplica(LOCAL_REPLICA)
+_replica_state = {"watch": None, "cutoff": None, "online": None, "thread": None}
+
+
+def _replica_query(cutoff):
+    # Needs a collection-group index on visits.dateOfVisit (ascending).
+    # "status" is not filtered here because new visits do not have the field.
+    return db.collection_group("visits").where("dateOfVisit", ">=", cutoff)
+
+
+def _visit_owner(doc):
+    return doc.reference.parent.parent.id
+
+
+def _on_replica_snapshot(doc_snapshots, changes, read_time):
+    for change in changes:
+        doc = change.document
+        data = None if change.type.name == "REMOVED" else doc.to_dict()
+        replica.apply_visit(_visit_owner(doc), doc.id, data)
+        # Pages may have been rendered from the replica for unwatched patients
+        if data is None or visit_version_cache.get((_visit_owner(doc), doc.id)) != _content_version(data):
+            _visit_changed(_visit_owner(doc), doc.id)
+    replica.mark_synced()
+    for patient_id in replica.missing_patients():
+        _lookup_pool.submit(_fetch_patient, patient_id)
+
+
+def _subscribe_replica(cutoff):
+    if _replica_state["watch"] is not None:
+        _replica_state["watch"].unsubscribe()
+    _replica_state["watch"] = _replica_query(cutoff).on_snapshot(_on_replica_snapshot)
+    _replica_state["cutoff"] = cutoff
+
+
+def reconcile_replica():
+    """Replaces the local pending visits with Firestore's current set."""
+    cutoff = (date.today() - timedelta(days=REPLICA_WINDOW_DAYS)).isoformat()
+    docs = _replica_query(cutoff).stream()
+    replica.replace_visits({(_visit_owner(doc), doc.id): doc.to_dict() for doc in docs})
+    replica.mark_synced()
+    for patient_id in replica.missing_patients():
+        _fetch_patient(patient_id)
+
+
+def _mark_unreachable(e):
+    """Switches to offline mode until the next probe succeeds."""
+    if _replica_state["online"] is not False:
+        print(f"[Replica] Firestore unreachable, serving from local replica: {e}")
+    _replica_state["online"] = False
+
+
+def _replica_loop():
+    while True:
+        cutoff = (date.today() - timedelta(days=REPLICA_WINDOW_DAYS)).isoformat()
+        try:
+            if _replica_state["online"] is False:
+                # Back online: catch up on everything the listener may have missed
+                reconcile_replica()
+                print("[Replica] Firestore reachable again; local replica reconciled.")
+                _subscribe_replica(cutoff)
+            elif cutoff != _replica_state["cutoff"]:
+                # First start, or the date window moved on
+                _subscribe_replica(cutoff)
+            else:
+                db.collection("sensor").document("status").get()
+            _replica_state["online"] = True
+        except Exception as e:
+            _mark_unreachable(e)
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+
+def start_replica_sync():
+    if _replica_state.get("thread") is None:
+        _replica_state["thread"] = threading.Thread(target=_replica_loop, name="replica-sync", daemon=True)
+        _replica_state["thread"].start()
+
+
+def warm_up():
+    """Starts the replica listener and connects to Firestore. Call once the server is up."""
+    start_replica_sync()
+    db.get()
+
+
+# =========================================================
+# 7. SLOT ASSIGNMENT OVERRIDE
+# =========================================================
+# Optional document with the same "medications" list as the dashboard's
+# config.json; when present it replaces the file's slot assignments live.
+SLOT_CONFIG_DOC = "config/medications"
+
+
+def watch_document(path, on_change):
+    """Calls on_change(data or None) now and whenever the document changes."""
+    def _on_snapshot(doc_snapshots, changes, read_time):
+        for doc in doc_snapshots:
+            on_change(doc.to_dict() if doc.exists else None)
+
+    return db.document(path).on_snapshot(_on_snapshot)
+
+
+def watch_slot_config(on_change):
+    """Calls on_change(medications or None) now and whenever the document changes."""
+    try:
+        return watch_document(SLOT_CONFIG_DOC, lambda data: on_change(data.get("medications") if data else None))
+    except Exception as e:
+        print(f"[Firestore] Could not watch {SLOT_CONFIG_DOC}: {e}")
+        return None
+
+
+# =========================================================
+# 8. DISPENSE CLAIMS
+# =========================================================
+# A visit is claimed in a transaction before any MED: frame is sent, so a
+# retried request or a second kiosk cannot dispense it twice. The claim
+# stays on the visit; a failed job removes it so the visit can be retried.
+# Claims older than CLAIM_TTL are abandoned (the kiosk died mid-dispense).
+CLAIM_TTL = 300                 # seconds; longer than any queued dispense
+CLAIM_TIMEOUT = float(os.environ.get("CLAIM_TIMEOUT", "3"))    # seconds the request waits for the claim
+
+# Claims that outlive CLAIM_TIMEOUT finish here, not on the lookup pool scans use
+_claim_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="claim")
+
+
+class FirestoreUnreachable(Exception):
+    """Firestore did not answer in time, or the connection to it failed."""
+
+
+def _within_claim_timeout(transaction_fn, transaction):
+    """Runs a claim transaction on _claim_pool, waiting at most CLAIM_TIMEOUT for it."""
+    future = _claim_pool.submit(transaction_fn, transaction)
+    try:
+        return future.result(timeout=CLAIM_TIMEOUT)
+    except FutureTimeout:
+        e = FirestoreUnreachable(f"no answer within {CLAIM_TIMEOUT:g}s")
+    except _transport_errors() as err:
+        e = FirestoreUnreachable(str(err))
+    _mark_unreachable(e)
+    raise e
+
+
+def _visit_ref(patient_id, visit_date):
+    return db.collection("consultations").document(patient_id).collection("visits").document(visit_date.strip())
+
+
+def _claim_is_live(claim):
+    try:
+        claimed_at = datetime.fromisoformat(claim["claimed_at"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return (datetime.now() - claimed_at).total_seconds() < CLAIM_TTL
+
+
+def claim_dispense(patient_id, visit_date, job_id):
+    """
+    Claims a visit for dispense job `job_id`. Returns "claimed", "dispensed"
+    (already dispensed), "partial" (a failed dispense left medicine in the
+    tray), "busy" (another live job holds it) or "missing".
+    Raises FirestoreUnreachable if there is no answer within CLAIM_TIMEOUT
+    or the transport fails; the transaction may still land later, under
+    this job's id.
+    """
+    ref = _visit_ref(patient_id, visit_date)
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _claim(transaction):
+        snapshot = ref.get(transaction=transaction)
+        if not snapshot.exists:
+            return "missing"
+        visit = snapshot.to_dict()
+        if visit.get("status") == "dispensed":
+            return "dispensed"
+        if visit.get("status") == PARTIALLY_DISPENSED:
+            return "partial"
+        claim = visit.get("dispense_claim") or {}
+        if claim.get("job_id") not in (None, job_id) and _claim_is_live(claim):
+            return "busy"
+        transaction.update(ref, {"dispense_claim": {
+            "job_id": job_id,
+            "kiosk": socket.gethostname(),
+            "claimed_at": datetime.now().isoformat(),
+        }})
+        return "claimed"
+
+    return _within_claim_timeout(_claim, transaction)
+
+
+def dispensed_locally(patient_id, visit_date):
+    """
+    "dispensed" or "partial" when this kiosk knows the visit was dispensed
+    (as claim_dispense reports it), else None; never asks Firestore.
+    """
+    visit_date = visit_date.strip()
+    if replica.was_dispensed(patient_id, visit_date):
+        return "dispensed"
+    visit = visit_cache.get((patient_id, visit_date)) or replica.get_visit(patient_id, visit_date) or {}
+    return {"dispensed": "dispensed", PARTIALLY_DISPENSED: "partial"}.get(visit.get("status"))
+
+
+def release_dispense_claim(patient_id, visit_date, job_id):
+    """
+    Drops the claim of a job that failed, if it still holds it. Raises
+    FirestoreUnreachable like claim_dispense; the claim then lapses after
+    CLAIM_TTL.
+    """
+    ref = _visit_ref(patient_id, visit_date)
+    transaction = db.transaction()
+
+    @firestore.transactional
+    def _release(transaction):
+        snapshot = ref.get(transaction=transaction)
+        claim = (snapshot.to_dict() or {}).get("dispense_claim") or {}
+        if claim.get("job_id") == job_id:
+            transaction.update(ref, {"dispense_claim": firestore.DELETE_FIELD})
+            return True
+        return False
+
+    return _within_claim_timeout(_release, transaction)
+
+
+def firestore_reachable():
+    """False once the replica sync has found Firestore unreachable."""
+    return _replica_state["online"] is not False
+
+
+# =========================================================
+# 9. MONITORING DASHBOARD FEED
+# =========================================================
+# The kiosk holds these listeners once for all dashboard tabs (see
+# dashboard_feed.py); browsers no longer talk to Firestore.
+
+def _log_events_query(day):
+    events = db.collection("logs").document(day).collection("events")
+    return events.order_by("logged_at", direction=firestore.Query.DESCENDING)
+
+
+def watch_log_day(day, page_size, on_rollup, on_events):
+    """
+    Listens to the logs/{day} rollup and the day's newest `page_size`
+    events. on_events({doc id: entry}) gets only added or changed events.
+    Returns the listener handles.
+    """
+    def _on_snapshot(doc_snapshots, changes, read_time):
+        # REMOVED means pushed out of the page by a newer event; the row stays
+        events = {c.document.id: c.document.to_dict() for c in changes if c.type.name != "REMOVED"}
+        if events:
+            on_events(events)
+
+    rollup = watch_document(f"logs/{day}", on_rollup)
+    return [rollup, _log_events_query(day).limit(page_size).on_snapshot(_on_snapshot)]
+
+
+def read_log_page(day, before=None, page_size=25):
+    """One page of a day's events, newest first, logged strictly before `before`."""
+    query = _log_events_query(day)
+    if before:
+        query = query.where("logged_at", "<", before)
+    return [(doc.id, doc.to_dict()) for doc in query.limit(page_size).stream()]
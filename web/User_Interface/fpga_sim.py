@@ -0,0 +1,202 @@
+# fpga_sim.py
+#
+# Pseudo-terminal stand-in for the FPGA so the serial layer can be exercised
+# and benchmarked without hardware. It follows protocol_handler.v:
+#   START  -> authorize, then report a card as "PID:" + 4 raw bytes
+#   MED:.. -> "DISPENSING..." and, once the servos finish, "DONE"
+#   END    -> de-authorize and reply "STK:" + 5-bit IR bitmap (E..A)
+#   PING   -> "PONG"
+#   BIN1   -> a binary HELLO (or ERR with binary=False, like older firmware)
+# Binary frames (serial_link.py) are answered in binary, ASCII lines in ASCII.
+#
+# Usage:  python fpga_sim.py --cycles 50
+#         python fpga_sim.py --cycles 50 --ascii
+
+import argparse
+import os
+import select
+import statistics
+import threading
+import time
+import tty
+
+from serial_link import (COMMAND_TYPES, FRAME_OVERHEAD, PROTOCOL_VERSION, SLOTS, SYNC, crc8,
+                         describe_command, encode_frame, med_counts)
+
+REPLY_CODES = {"HELLO": 0x8, "PID": 0x9, "ACK": 0xA, "DONE": 0xB, "STK": 0xC, "PONG": 0xD, "ERR": 0xE}
+
+
+class FPGASimulator:
+    def __init__(self, uid="ACC0176D", units=None, scan_delay=0.2, turn_time=0.05, binary=True):
+        self.uid = bytes.fromhex(uid)
+        self.units = dict(units or {slot: 100 for slot in SLOTS})
+        self.scan_delay = scan_delay        # time until the card is "tapped"
+        self.turn_time = turn_time          # servo time per unit dispensed
+        self.binary = binary                # firmware supports binary framing
+        self.authorized = False
+        self.dispensing = False
+        self.bin_mode = False               # last command arrived as a binary frame
+        self.tx_seq = 0
+        self.last_seq = None
+        self.master = None
+        self.slave = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Opens the pty pair and returns the device path for the host side."""
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self._thread = threading.Thread(target=self._run, name="fpga-sim", daemon=True)
+        self._thread.start()
+        return os.ttyname(self.slave)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+
+    @property
+    def stock_bitmap(self):
+        # input_ir[4] is slot E ... input_ir[0] is slot A; 1 means empty
+        return "".join("1" if self.units[slot] <= 0 else "0" for slot in reversed(SLOTS))
+
+    # --- Wire side ---
+
+    def _write(self, data):
+        with self._lock:
+            os.write(self.master, data)
+
+    def _reply(self, kind, line, payload=b""):
+        """Sends `kind` as a binary frame or as the ASCII `line`, following the last command."""
+        with self._lock:
+            if self.bin_mode:
+                data = encode_frame(REPLY_CODES[kind], self.tx_seq, payload)
+                self.tx_seq = (self.tx_seq + 1) & 0xFF
+            else:
+                data = line
+            os.write(self.master, data)
+
+    def _run(self):
+        line = bytearray()
+        frame = bytearray()
+        while not self._stop.is_set():
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                data = os.read(self.master, 1024)
+            except OSError:
+                break
+            for byte in data:
+                if frame or (self.binary and byte == SYNC and not line):
+                    frame.append(byte)
+                    if len(frame) >= 2 and len(frame) == FRAME_OVERHEAD + (frame[1] & 0x0F):
+                        self._handle_frame(bytes(frame))
+                        frame.clear()
+                elif byte in (0x0A, 0x0D):
+                    if line:
+                        self.bin_mode = False
+                        self._handle(line.decode("ascii", errors="replace"))
+                    line.clear()
+                elif byte > 0x20:
+                    # protocol_handler upper-cases and drops whitespace
+                    line.append(byte - 0x20 if 0x61 <= byte <= 0x7A else byte)
+
+    def _handle_frame(self, frame):
+        if crc8(frame[1:-1]) != frame[-1]:
+            return
+        if self.last_seq is not None and frame[2] == self.last_seq:
+            # A repeated frame (e.g. a retried MED) is acted on once
+            return
+        self.last_seq = frame[2]
+        self.bin_mode = True
+        if frame[1] >> 4 in COMMAND_TYPES.values():
+            self._handle(describe_command(frame))
+        elif self.authorized:
+            self._reply("ERR", b"ERR\n")
+
+    def _handle(self, cmd):
+        if cmd == "START":
+            self.authorized = True
+            threading.Timer(self.scan_delay, self._tap_card).start()
+        elif cmd == "END":
+            self.authorized = False
+            self._reply("STK", f"STK:{self.stock_bitmap}\n".encode("ascii"),
+                        bytes((int(self.stock_bitmap, 2),)))
+        elif not self.authorized:
+            return
+        elif cmd == "PING":
+            self._reply("PONG", b"PONG\n")
+        elif cmd == f"BIN{PROTOCOL_VERSION}" and self.binary:
+            with self._lock:
+                self.bin_mode, self.tx_seq, self.last_seq = True, 0, None
+            self._reply("HELLO", b"", bytes((PROTOCOL_VERSION,)))
+        elif med_counts(cmd) and not self.dispensing:
+            counts = dict(zip(SLOTS, med_counts(cmd)))
+            self.dispensing = True
+            self._reply("ACK", b"DISPENSING...\n")
+            duration = max(counts.values()) * self.turn_time
+            threading.Timer(duration, self._finish, args=(counts,)).start()
+        else:
+            self._reply("ERR", b"ERR\n")
+
+    def _tap_card(self):
+        if self.authorized and not self._stop.is_set():
+            self._reply("PID", b"PID:" + self.uid + b"\n", self.uid)
+
+    def _finish(self, counts):
+        for slot, n in counts.items():
+            self.units[slot] = max(0, self.units[slot] - n)
+        self.dispensing = False
+        if not self._stop.is_set():
+            self._reply("DONE", b"DONE\n")
+
+
+# =========================================================
+# BENCHMARK: scan + dispense cycles through SerialLink
+# =========================================================
+
+def main():
+    from serial_link import SerialLink
+
+    parser = argparse.ArgumentParser(description="Benchmark the serial layer against the simulator.")
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--scan-delay", type=float, default=0.0)
+    parser.add_argument("--turn-time", type=float, default=0.0)
+    parser.add_argument("--ascii", action="store_true", help="simulate firmware without binary framing")
+    args = parser.parse_args()
+
+    sim = FPGASimulator(scan_delay=args.scan_delay, turn_time=args.turn_time, binary=not args.ascii)
+    link = SerialLink(sim.start())
+    link.open()
+
+    scans, dispenses = [], []
+    try:
+        for _ in range(args.cycles):
+            t0 = time.perf_counter()
+            uid = link.scan_card(timeout=5)
+            t1 = time.perf_counter()
+            link.dispense("MED:A1B0C0D0E0", timeout=5)
+            t2 = time.perf_counter()
+            assert uid is not None, "no PID frame received"
+            scans.append(t1 - t0)
+            dispenses.append(t2 - t1)
+    finally:
+        link.close()
+        sim.stop()
+
+    for name, samples in (("scan", scans), ("dispense", dispenses)):
+        samples.sort()
+        p95 = samples[int(0.95 * (len(samples) - 1))]
+        print(f"{name:>9}: mean {statistics.mean(samples) * 1000:7.2f} ms   "
+              f"p95 {p95 * 1000:7.2f} ms   (n={len(samples)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# gunicorn.conf.py
+#
+# Usage:  gunicorn -c gunicorn.conf.py wsgi:app
+#
+# A single worker process owns the serial ports and the Firestore client and
+# listeners; none of them can be shared between processes, so concurrency
+# comes from threads (gthread) or, with WORKER_CLASS=gevent, greenlets.
+
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = 1
+worker_class = os.environ.get("WORKER_CLASS", "gthread")
+threads = int(os.environ.get("THREADS", "16"))      # gthread: SSE streams hold one each (DASHBOARD_MAX_STREAMS)
+worker_connections = 200                            # gevent
+keepalive = 5
+timeout = 120
+
+# Import the app in the worker, not the master: threads started before a
+# fork (serial readers, Firestore listeners) would not survive it
+preload_app = False
+
+
+def on_starting(server):
+    from static_files import precompress, STATIC_DIR, ADMIN_DASHBOARD_PATH
+
+    for directory in (STATIC_DIR, ADMIN_DASHBOARD_PATH):
+        if os.path.isdir(directory):
+            precompress(directory)
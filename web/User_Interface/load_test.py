@@ -0,0 +1,103 @@
+# load_test.py
+#
+# Closed-loop HTTP load test for the kiosk server. Run it once against the
+# development server (python app.py) and once against production
+# (gunicorn -c gunicorn.conf.py wsgi:app) to compare requests/sec.
+#
+# Usage:  python load_test.py --url http://127.0.0.1:5000 --concurrency 16 --duration 10
+
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = [
+    "/",
+    "/static/style.css",
+    "/static/prescription.js",
+    "/monitoring/script.js",
+    "/api/machines",
+]
+
+
+def _worker(host, port, paths, headers, deadline, results, lock):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    latencies, errors, received = {p: [] for p in paths}, 0, 0
+    i = 0
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            received += len(response.read())
+            if response.status >= 400:
+                errors += 1
+            if response.getheader("Connection", "").lower() == "close":
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+            continue
+        latencies[path].append(time.perf_counter() - start)
+    conn.close()
+
+    with lock:
+        for path, samples in latencies.items():
+            results["latencies"][path].extend(samples)
+        results["errors"] += errors
+        results["bytes"] += received
+
+
+def run(url, paths, concurrency, duration, encoding):
+    parts = urlsplit(url)
+    headers = {"Accept-Encoding": encoding} if encoding else {}
+    results = {"latencies": {p: [] for p in paths}, "errors": 0, "bytes": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    threads = [threading.Thread(target=_worker, args=(parts.hostname, parts.port or 80, paths,
+                                                      headers, deadline, results, lock))
+               for _ in range(concurrency)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    total = sum(len(s) for s in results["latencies"].values())
+    print(f"{url}  concurrency={concurrency}  duration={elapsed:.1f}s  encoding={encoding or 'identity'}")
+    print(f"{'path':<28}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for path, samples in results["latencies"].items():
+        if not samples:
+            print(f"{path:<28}{0:>10}")
+            continue
+        samples.sort()
+        p50 = statistics.median(samples) * 1000
+        p95 = samples[int(0.95 * (len(samples) - 1))] * 1000
+        print(f"{path:<28}{len(samples):>10}{p50:>10.1f}{p95:>10.1f}")
+    print(f"total: {total} requests, {total / elapsed:.1f} req/s, "
+          f"{results['bytes'] / elapsed / 1024:.0f} KiB/s, {results['errors']} errors")
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure kiosk server throughput.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--path", action="append", dest="paths",
+                        help="path to request (repeatable); defaults to pages, static assets and an API")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--encoding", default="br, gzip", help="Accept-Encoding header ('' for none)")
+    args = parser.parse_args()
+
+    run(args.url, args.paths or DEFAULT_PATHS, args.concurrency, args.duration, args.encoding)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# local_replica.py
+
+import json
+import sqlite3
+import threading
+import time
+
+# A visit dispensed locally stays hidden this long, even if a stale
+# snapshot or reconcile still reports it pending (the write may be queued).
+TOMBSTONE_TTL = 7 * 24 * 3600
+
+PENDING = "COALESCE(json_extract(data, '$.status'), '') != 'dispensed'"
+
+
+class LocalReplica:
+    """
+    SQLite copy of the recent visits and the profiles of the patients they
+    belong to, so scans and prescription lookups keep working without the
+    network. Filled by a Firestore listener in firebase.py. Dispensed visits
+    are kept with their status, so an offline re-tap is still refused.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.synced_at = None           # time of the last listener/reconcile update
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS patients (
+                patient_id TEXT PRIMARY KEY,
+                profile    TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS visits (
+                patient_id TEXT NOT NULL,
+                visit_date TEXT NOT NULL,
+                data       TEXT NOT NULL,
+                PRIMARY KEY (patient_id, visit_date));
+            CREATE TABLE IF NOT EXISTS tombstones (
+                patient_id TEXT NOT NULL,
+                visit_date TEXT NOT NULL,
+                created    REAL NOT NULL,
+                PRIMARY KEY (patient_id, visit_date));
+        """)
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @property
+    def synced(self):
+        return self.synced_at is not None
+
+    def mark_synced(self):
+        self.synced_at = time.time()
+
+    # --- Patients ---
+
+    def upsert_patient(self, patient_id, profile):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO patients VALUES (?, ?)",
+                               (patient_id, json.dumps(profile)))
+            self._conn.commit()
+
+    def remove_patient(self, patient_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM patients WHERE patient_id = ?", (patient_id,))
+            self._conn.commit()
+
+    def get_patient(self, patient_id):
+        with self._lock:
+            row = self._conn.execute("SELECT profile FROM patients WHERE patient_id = ?",
+                                     (patient_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def missing_patients(self):
+        """Patients with pending visits whose profile has not been fetched yet."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT v.patient_id FROM visits v"
+                " LEFT JOIN patients p ON p.patient_id = v.patient_id"
+                " WHERE p.patient_id IS NULL").fetchall()
+        return [r[0] for r in rows]
+
+    # --- Visits ---
+
+    def apply_visit(self, patient_id, visit_date, data):
+        """Applies one listener change; `data` is None when the visit was deleted."""
+        with self._lock:
+            self._apply_visit(patient_id, visit_date, data)
+            self._conn.commit()
+
+    def _apply_visit(self, patient_id, visit_date, data):
+        key = (patient_id, visit_date)
+        if data is None:
+            self._conn.execute("DELETE FROM visits WHERE patient_id = ? AND visit_date = ?", key)
+            return
+        if data.get("status") == "dispensed":
+            # Firestore has caught up with the local dispense
+            self._conn.execute("DELETE FROM tombstones WHERE patient_id = ? AND visit_date = ?", key)
+        else:
+            tombstone = self._conn.execute(
+                "SELECT created FROM tombstones WHERE patient_id = ? AND visit_date = ?", key).fetchone()
+            if tombstone and tombstone[0] > time.time() - TOMBSTONE_TTL:
+                # A stale pending copy: the dispense write may still be queued
+                data = {**data, "status": "dispensed"}
+        self._conn.execute("INSERT OR REPLACE INTO visits VALUES (?, ?, ?)", key + (json.dumps(data),))
+
+    def replace_visits(self, visits):
+        """Reconcile: `visits` is the full {(patient_id, visit_date): data} set from Firestore."""
+        with self._lock:
+            # Visits dispensed here stay until Firestore reports them dispensed
+            self._conn.execute(
+                "DELETE FROM visits WHERE NOT EXISTS (SELECT 1 FROM tombstones t"
+                " WHERE t.patient_id = visits.patient_id AND t.visit_date = visits.visit_date AND t.created > ?)",
+                (time.time() - TOMBSTONE_TTL,))
+            for (patient_id, visit_date), data in visits.items():
+                self._apply_visit(patient_id, visit_date, data)
+            self._conn.execute("DELETE FROM tombstones WHERE created < ?", (time.time() - TOMBSTONE_TTL,))
+            self._conn.commit()
+
+    def get_visit(self, patient_id, visit_date):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM visits WHERE patient_id = ? AND visit_date = ?",
+                                     (patient_id, visit_date)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pending_dates(self, patient_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT visit_date FROM visits WHERE patient_id = ? AND " + PENDING
+                                      + " ORDER BY visit_date", (patient_id,)).fetchall()
+        return [r[0] for r in rows]
+
+    def was_dispensed(self, patient_id, visit_date):
+        """True if this kiosk dispensed the visit recently (its write may still be queued)."""
+        with self._lock:
+            row = self._conn.execute("SELECT created FROM tombstones WHERE patient_id = ? AND visit_date = ?",
+                                     (patient_id, visit_date)).fetchone()
+        return row is not None and row[0] > time.time() - TOMBSTONE_TTL
+
+    def mark_dispensed(self, patient_id, visit_date, data=None):
+        """Keeps the visit as dispensed; `data` stores it if it was not mirrored yet (e.g. outside the window)."""
+        with self._lock:
+            if data is not None:
+                self._conn.execute("INSERT OR REPLACE INTO visits VALUES (?, ?, ?)",
+                                   (patient_id, visit_date, json.dumps({**data, "status": "dispensed"})))
+            else:
+                self._conn.execute("UPDATE visits SET data = json_set(data, '$.status', 'dispensed')"
+                                   " WHERE patient_id = ? AND visit_date = ?", (patient_id, visit_date))
+            self._conn.execute("INSERT OR REPLACE INTO tombstones VALUES (?, ?, ?)",
+                               (patient_id, visit_date, time.time()))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            visits = self._conn.execute("SELECT COUNT(*) FROM visits WHERE " + PENDING).fetchone()[0]
+            patients = self._conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+        return {"pending_visits": visits, "patients": patients, "synced_at": self.synced_at}
@@ -0,0 +1,132 @@
+# machine_pool.py
+
+import os
+import threading
+import time
+
+from serial_link import DispenseError, SerialLink, decode_stk, dispense_conversation
+
+# "MACHINE_ID=PORT" pairs, comma separated. The first machine also hosts the
+# kiosk's RFID reader.
+DEFAULT_MACHINES = "MED-001=/dev/serial0"
+
+
+class Machine:
+    def __init__(self, machine_id, port, baudrate=115200, trace_path=None):
+        self.machine_id = machine_id
+        self.link = SerialLink(port, baudrate, trace_path=trace_path)
+        self.stock = None               # last STK bitmap (E..A, 1 = empty); None = unknown
+        self.assigned = 0               # jobs routed here and not yet finished
+        self.dispensed = 0
+
+    @property
+    def online(self):
+        return self.link.is_open
+
+    def empty_slots(self, slots):
+        if self.stock is None:
+            return set()
+        empty = {slot for slot, bit in decode_stk(self.stock).items() if bit}
+        return set(slots) & empty
+
+    def has_stock(self, slots):
+        return not self.empty_slots(slots)
+
+    def dispense(self, commands, slots=(), timeout=30, on_event=None):
+        """
+        Runs a dispense on this machine's link and returns the STK payload.
+        An order queued behind another dispense was assigned on an older STK
+        reading, so `slots` are checked again when its turn comes, against
+        the STK the dispense ahead of it just returned.
+        """
+        def conversation(link):
+            empty = self.empty_slots(slots)
+            if empty:
+                raise DispenseError(f"Slot(s) {', '.join(sorted(empty))} reported empty; order not sent.")
+            stock = dispense_conversation(link, commands, timeout, on_event)
+            if stock:
+                self.stock = stock
+            return stock
+
+        return self.link.submit(conversation).result()
+
+    def status(self):
+        return {
+            "machine_id": self.machine_id,
+            "port": self.link.port,
+            "online": self.online,
+            "queue_depth": self.assigned,
+            "stock": self.stock,
+            "dispensed": self.dispensed,
+            "framing": self.link.framing,
+        }
+
+
+class MachinePool:
+    """
+    Registry of dispensers, one FPGA per serial port. Each machine's
+    SerialLink runs its own command thread, so dispenses routed to different
+    machines run in parallel.
+    """
+
+    def __init__(self, machines):
+        self.machines = list(machines)
+        self._by_id = {m.machine_id: m for m in self.machines}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec, baudrate=115200, trace_dir=None):
+        """`trace_dir` captures each machine's UART traffic to <dir>/<id>-<time>.utrace."""
+        machines = []
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        for entry in spec.split(","):
+            machine_id, _, port = entry.strip().partition("=")
+            machine_id = machine_id.strip()
+            trace_path = None
+            if trace_dir:
+                os.makedirs(trace_dir, exist_ok=True)
+                trace_path = os.path.join(trace_dir, f"{machine_id}-{stamp}.utrace")
+            machines.append(Machine(machine_id, port.strip(), baudrate, trace_path))
+        return cls(machines)
+
+    def open(self):
+        """Opens every link that is not open yet; cheap once all are online."""
+        with self._lock:
+            for machine in self.machines:
+                if not machine.online:
+                    machine.link.open()
+
+    @property
+    def primary(self):
+        return self.machines[0]
+
+    def get(self, machine_id):
+        return self._by_id.get(machine_id)
+
+    def assign(self, slots, can_fill=None):
+        """
+        Routes an order needing `slots` to the least-loaded online machine
+        whose last STK reading shows stock in all of them (and, if given,
+        for which `can_fill(machine)` is true). Returns None when no machine
+        qualifies. Call release() when the job finishes.
+        """
+        with self._lock:
+            candidates = [m for m in self.machines if m.online and m.has_stock(slots)
+                          and (can_fill is None or can_fill(m))]
+            if not candidates:
+                return None
+            machine = min(candidates, key=lambda m: m.assigned)
+            machine.assigned += 1
+            return machine
+
+    def release(self, machine, stock_status=None, dispensed=False):
+        with self._lock:
+            machine.assigned -= 1
+            if stock_status:
+                machine.stock = stock_status
+            if dispensed:
+                machine.dispensed += 1
+
+    def status(self):
+        with self._lock:
+            return [m.status() for m in self.machines]
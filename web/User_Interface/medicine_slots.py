@@ -0,0 +1,185 @@
+# medicine_slots.py
+#
+# Which medicine sits in which dispenser slot. Assignments come from the
+# Monitoring Dashboard's config.json (the "medications" list, in slot order
+# A..E unless an entry names its "slot"), optionally overridden by a
+# Firestore document, and are compiled into one normalized lookup table.
+#
+# Usage:  python medicine_slots.py "paracetamol " Cetirizine Aspirin
+
+import json
+import os
+import re
+import threading
+import time
+
+from serial_link import SLOTS
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "..", "Monitoring_Dashboard", "config.json")
+RELOAD_CHECK_INTERVAL = 1.0     # seconds between config file mtime checks
+
+
+class UnmappedMedicineError(ValueError):
+    """A prescription names medicines that are not loaded in any slot."""
+
+    def __init__(self, names):
+        self.names = list(names)
+        super().__init__("No dispenser slot for: " + ", ".join(self.names))
+
+
+def normalize_name(name):
+    """"  Bromhexine-HCl " -> "bromhexine hcl": casefolded, punctuation and runs of whitespace collapsed."""
+    return " ".join(re.split(r"[^0-9a-z]+", str(name or "").casefold())).strip()
+
+
+def slot_entries(medications):
+    """
+    Yields (slot, entry) for config entries; an entry without a "slot" takes
+    the letter of its position. Raises ValueError on a bad slot.
+    """
+    for position, entry in enumerate(medications):
+        slot = str(entry.get("slot") or (SLOTS[position] if position < len(SLOTS) else "")).upper()
+        if slot not in SLOTS or len(slot) != 1:
+            raise ValueError(f"Medication {entry.get('name')!r} has no valid slot.")
+        yield slot, entry
+
+
+def compile_index(medications):
+    """
+    Builds {normalized name or alias: (slot, display name)} from config
+    entries. Raises ValueError on a bad slot or a name claimed by two slots.
+    """
+    index = {}
+    for slot, entry in slot_entries(medications):
+        display = entry["name"]
+        for alias in [display] + list(entry.get("aliases", [])):
+            key = normalize_name(alias)
+            if not key:
+                continue
+            if key in index and index[key][0] != slot:
+                raise ValueError(f"{alias!r} is mapped to both slot {index[key][0]} and {slot}.")
+            index[key] = (slot, display)
+    return index
+
+
+class SlotMap:
+    """
+    Precompiled medicine -> slot lookup. The config file is re-read when its
+    mtime changes (checked at most once per RELOAD_CHECK_INTERVAL); a
+    Firestore override set through apply_override() wins over the file until
+    it is cleared. A config that fails to compile is logged and the previous
+    index stays in use.
+    """
+
+    def __init__(self, path=DEFAULT_CONFIG):
+        self.path = path
+        self.source = None
+        self.reloads = 0
+        self._index = {}
+        self._file_index = None
+        self._override_index = None
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    # --- Loading ---
+
+    def refresh(self, force=False):
+        """Recompiles from the config file if it changed since the last load."""
+        now = time.monotonic()
+        if not force and now - self._checked < RELOAD_CHECK_INTERVAL:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError as e:
+            if self._file_index is None:
+                print(f"[Slots] Config not readable ({e})")
+            return
+        if mtime == self._mtime:
+            return
+
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                index = compile_index(json.load(f).get("medications", []))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[Slots] Keeping previous slot map; {self.path} is invalid: {e}")
+            self._mtime = mtime
+            return
+
+        with self._lock:
+            self._mtime = mtime
+            self._file_index = index
+            self._activate()
+        print(f"[Slots] Loaded {len(index)} names from {self.path}")
+
+    def apply_override(self, medications):
+        """Installs (or with None, clears) assignments from a Firestore document."""
+        try:
+            index = None if medications is None else compile_index(medications)
+        except (ValueError, KeyError) as e:
+            print(f"[Slots] Ignoring invalid slot override: {e}")
+            return
+        if index is None and self._override_index is None:
+            return
+        with self._lock:
+            self._override_index = index
+            self._activate()
+        print(f"[Slots] Slot override {'cleared' if index is None else 'applied'}")
+
+    def _activate(self):
+        if self._override_index is not None:
+            self._index, self.source = self._override_index, "firestore"
+        else:
+            self._index, self.source = self._file_index or {}, self.path
+        self.reloads += 1
+
+    # --- Lookups ---
+
+    def slot_for(self, name):
+        self.refresh()
+        entry = self._index.get(normalize_name(name))
+        return entry[0] if entry else None
+
+    def resolve(self, medications):
+        """
+        Sums prescription quantities per slot: [{"medicineName", "quantity"}, ...]
+        -> {'A': 0, 'B': 2, ...}. Raises UnmappedMedicineError listing every
+        medicine without a slot, so an order is never dispensed partially.
+        """
+        self.refresh()
+        index = self._index
+        counts = {slot: 0 for slot in SLOTS}
+        unmapped = []
+        for med in medications:
+            entry = index.get(normalize_name(med.get("medicineName")))
+            if entry is None:
+                unmapped.append(med.get("medicineName") or "(unnamed)")
+                continue
+            counts[entry[0]] += int(med.get("quantity", 0) or 0)
+        if unmapped:
+            raise UnmappedMedicineError(unmapped)
+        return counts
+
+    def assignments(self):
+        """{slot: display name} of the active map."""
+        return {slot: name for slot, name in sorted(set(self._index.values()))}
+
+    def stats(self):
+        return {"source": self.source, "names": len(self._index),
+                "reloads": self.reloads, "slots": self.assignments()}
+
+
+def main():
+    import sys
+
+    slots = SlotMap()
+    print(slots.assignments())
+    for name in sys.argv[1:]:
+        print(f"{name!r:>24} -> {slots.slot_for(name)}")
+
+
+if __name__ == "__main__":
+    main()
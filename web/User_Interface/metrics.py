@@ -0,0 +1,177 @@
+# metrics.py
+#
+# Per-stage latency histograms in the Prometheus text format, plus an
+# optional sampled cProfile hook. No client library is needed: the kiosk
+# only exports a handful of histograms.
+#
+# Stages recorded (label "stage"):
+#   firestore_read   cache/replica/Firestore reads in a request
+#   uart_scan        waiting for the RFID card on /api/scan_id
+#   command_build    slot mapping and MED: frame planning
+#   uart_tx          writing one MED: frame to the FPGA
+#   done             first frame sent -> last DONE (servo time)
+#   stk              END sent -> STK received
+#   db_commit        journaling the dispense record (write-behind)
+#   firestore_commit one write-behind batch reaching Firestore
+#   dispense_total   dispense accepted -> db_committed
+
+import bisect
+import cProfile
+import itertools
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Fraction of instrumented requests to run under cProfile (0 disables)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+
+def _label_text(labelnames, values):
+    return ",".join(f'{name}="{value}"' for name, value in zip(labelnames, values))
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed label set, like prometheus_client's."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}           # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def quantile(self, q, **labels):
+        """Estimates the q-quantile by linear interpolation inside the bucket, as histogram_quantile() does."""
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            counts = list(series[:-1]) if series else None
+        if not counts or not sum(counts):
+            return None
+
+        rank = q * sum(counts)
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def count(self, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            return sum(series[:-1]) if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            labels = _label_text(self.labelnames, key)
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+stage_seconds = Histogram("dispenser_stage_seconds", "Time spent in one stage of a request or dispense.",
+                          ("endpoint", "stage"))
+request_seconds = Histogram("dispenser_request_seconds", "End-to-end time of an instrumented HTTP request.",
+                            ("endpoint", "status"))
+
+REGISTRY = [stage_seconds, request_seconds]
+
+
+def observe_stage(endpoint, stage, seconds):
+    stage_seconds.observe(seconds, endpoint=endpoint, stage=stage)
+
+
+@contextmanager
+def timed(endpoint, stage):
+    """Records the duration of the `with` block, whether or not it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(endpoint, stage, time.perf_counter() - start)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def latency_summary(endpoint, stages, quantiles=(0.5, 0.95)):
+    """{stage: {"p50": s, "p95": s, "count": n}} for the dashboard."""
+    summary = {}
+    for stage in stages:
+        entry = {"count": stage_seconds.count(endpoint=endpoint, stage=stage)}
+        for q in quantiles:
+            entry[f"p{int(q * 100)}"] = stage_seconds.quantile(q, endpoint=endpoint, stage=stage)
+        summary[stage] = entry
+    return summary
+
+
+# =========================================================
+# SAMPLED PROFILER
+# =========================================================
+# Only one profiler can be active per interpreter, so at most one sampled
+# request is profiled at a time; the rest run normally.
+_profile_lock = threading.Lock()
+_profile_seq = itertools.count(1)
+
+
+def start_profile():
+    """Returns a running cProfile.Profile for a sampled request, else None."""
+    if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+def stop_profile(profiler, endpoint):
+    """Stops a profiler from start_profile() and writes PROFILE_DIR/<endpoint>-<time>.prof."""
+    try:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{endpoint}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_seq)}.prof")
+        profiler.dump_stats(path)
+        top = pstats.Stats(path).sort_stats("cumulative")
+        print(f"[Metrics] Profiled {endpoint}: {top.total_tt * 1000:.1f} ms -> {path}")
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,62 @@
+# page_cache.py
+#
+# Rendered HTML for the patient pages (/patient_view, /schedule,
+# /prescription), memoized per (page, patient_id, visit_date, visit content
+# version). Each page carries a strong ETag of its body, so a phone that
+# refreshes the QR-code view gets a 304 straight from memory: no Firestore
+# read and no Jinja render.
+#
+# Entries are dropped when their visit changes or is dispensed, and when a
+# patient's profile changes (see firebase.on_visit_change).
+
+import hashlib
+import threading
+
+from doc_cache import TTLCache
+
+PAGE_CACHE_SIZE = 256
+PAGE_CACHE_TTL = 600            # seconds; invalidation normally comes first
+
+
+def etag_for(body):
+    return hashlib.blake2b(body.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class PageCache:
+    """
+    Keys are (page, patient_id, visit_date, version); visit_date is None for
+    pages that only show the patient. Values are (etag, body).
+    """
+
+    def __init__(self, maxsize=PAGE_CACHE_SIZE, ttl=PAGE_CACHE_TTL):
+        self.pages = TTLCache("page", maxsize, ttl)
+        self.not_modified = 0
+        self.prerendered = 0
+        # Bumped by every invalidation; a render that overlapped one is not stored
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    def get(self, key):
+        return self.pages.get(key)
+
+    def put(self, key, body, epoch):
+        """Stores a page rendered at `epoch` unless an invalidation has happened since. Returns (etag, body)."""
+        entry = (etag_for(body), body)
+        with self._lock:
+            if epoch == self._epoch:
+                self.pages.put(key, entry)
+        return entry
+
+    def invalidate(self, patient_id, visit_date=None):
+        """Drops a visit's pages, or every page of the patient when `visit_date` is None."""
+        with self._lock:
+            self._epoch += 1
+            self.pages.invalidate_where(
+                lambda key: key[1] == patient_id and (visit_date is None or key[2] == visit_date))
+
+    def stats(self):
+        return {**self.pages.stats(), "not_modified": self.not_modified, "prerendered": self.prerendered}
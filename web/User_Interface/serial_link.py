@@ -0,0 +1,569 @@
+# serial_link.py
+#
+# Host side of the FPGA UART protocol (protocol_handler.v). Two framings:
+#
+#   ASCII   commands are lines ("START", "MED:A3B0C2D0E1", "END", "PING");
+#           replies are lines, except "PID:" + 4 raw UID bytes
+#   binary  SYNC | type << 4 | payload length | seq | payload | CRC-8
+#           SYNC is 0xB0 | version; the CRC (poly 0x07) covers everything
+#           after SYNC. Each side numbers its frames, so a gap or a repeat
+#           in seq is a lost or duplicated frame.
+#
+# Binary framing is offered when the link opens ("START", then "BIN1"):
+# firmware that has it answers with a binary HELLO, older firmware with ERR,
+# and the link stays on ASCII. The FPGA answers each command in the framing
+# it arrived in, so a reset FPGA never strands the link.
+
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, wait
+
+import serial
+
+# =========================================================
+# 1. FRAME PARSING
+# =========================================================
+
+# kind:    "PID", "DONE", "ERR", "STK", "ACK", "PONG", "HELLO" or "UNKNOWN"
+# payload: hex UID for PID, the 5-bit bitmap for STK, the version for HELLO,
+#          the raw line otherwise
+Frame = namedtuple("Frame", ["kind", "payload", "timestamp"])
+
+PID_HEADER = b"PID:"
+PID_FRAME_LEN = len(PID_HEADER) + 4     # header + 4 raw UID bytes (newline follows)
+MAX_BUFFER = 4096                       # drop garbage beyond this without a newline
+
+PROTOCOL_VERSION = 1
+SYNC = 0xB0 | PROTOCOL_VERSION
+FRAME_OVERHEAD = 4                      # SYNC, type/length, seq, CRC
+
+# Frame types (high nibble of the second byte); host -> FPGA, then replies
+COMMAND_TYPES = {"START": 0x1, "MED": 0x2, "END": 0x3, "PING": 0x4}
+REPLY_TYPES = {0x8: "HELLO", 0x9: "PID", 0xA: "ACK", 0xB: "DONE", 0xC: "STK", 0xD: "PONG", 0xE: "ERR"}
+SLOTS = "ABCDE"
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data, crc=0):
+    """CRC-8 (poly 0x07, init 0), as protocol_handler.v computes it."""
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def encode_frame(frame_type, seq, payload=b""):
+    if len(payload) > 0x0F:
+        raise ValueError(f"Binary frame payload is limited to 15 bytes, got {len(payload)}.")
+    body = bytes((frame_type << 4 | len(payload), seq & 0xFF)) + payload
+    return bytes((SYNC,)) + body + bytes((crc8(body),))
+
+
+def med_counts(line):
+    """Slot counts of an ASCII MED: line ("MED:A3B0C2D0E1"), or None if it is not one."""
+    if len(line) != 14 or not line.startswith("MED:"):
+        return None
+    if not all(line[4 + 2 * i] == slot and line[5 + 2 * i].isdigit() for i, slot in enumerate(SLOTS)):
+        return None
+    return [int(line[5 + 2 * i]) for i in range(len(SLOTS))]
+
+
+def decode_stk(stock_status):
+    """{'A': 0, 'B': 1, ...} from an STK bitmap such as "01000" (input_ir[4..0], E..A; 1 = empty)."""
+    return {slot: int(bit) for slot, bit in zip(reversed(SLOTS), stock_status)}
+
+
+def encode_command(line, seq):
+    """
+    The binary frame for an ASCII command line, or None if the command has
+    no binary form. MED: counts are packed two slots per byte (A B, C D, E -).
+    """
+    if line in COMMAND_TYPES and line != "MED":
+        return encode_frame(COMMAND_TYPES[line], seq)
+    counts = med_counts(line)
+    if counts is None:
+        return None
+    a, b, c, d, e = counts
+    return encode_frame(COMMAND_TYPES["MED"], seq, bytes((a << 4 | b, c << 4 | d, e << 4)))
+
+
+def describe_command(data):
+    """The ASCII command a raw host write carries, whichever framing it used."""
+    if data[:1] == bytes((SYNC,)) and len(data) >= FRAME_OVERHEAD:
+        frame_type, payload = data[1] >> 4, data[3:-1]
+        names = {code: name for name, code in COMMAND_TYPES.items()}
+        if frame_type == COMMAND_TYPES["MED"] and len(payload) == 3:
+            counts = (payload[0] >> 4, payload[0] & 0x0F, payload[1] >> 4, payload[1] & 0x0F, payload[2] >> 4)
+            return "MED:" + "".join(f"{slot}{n}" for slot, n in zip(SLOTS, counts))
+        return names.get(frame_type, f"0x{frame_type:X}")
+    return bytes(data).decode("ascii", errors="replace").strip()
+
+
+class FrameParser:
+    """
+    Incremental parser for the FPGA's reply stream (see protocol_handler.v).
+
+    Bytes are appended to an internal buffer and complete frames are cut from
+    the front of it. `PID:` frames carry 4 raw UID bytes that may themselves
+    contain 0x0A, so they are length-delimited; every other ASCII frame is a
+    line. Binary frames are length-delimited and CRC-checked; a bad CRC
+    drops one byte and resynchronises on the next SYNC.
+
+    Once a HELLO has been seen the stream is binary only, and anything
+    between frames is discarded as noise. `lost`, `duplicates` and
+    `crc_errors` count what the sequence numbers and CRCs caught.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.binary = False
+        self.last_seq = None
+        self.lost = 0
+        self.duplicates = 0
+        self.crc_errors = 0
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        buf = self.buffer
+        now = time.monotonic()
+
+        while buf:
+            if buf[0] == SYNC:
+                if len(buf) < 2:
+                    break
+                size = FRAME_OVERHEAD + (buf[1] & 0x0F)
+                if len(buf) < size:
+                    break
+                if crc8(buf[1:size - 1]) != buf[size - 1]:
+                    self.crc_errors += 1
+                    del buf[:1]
+                    continue
+                frame = self._binary_frame(buf[1] >> 4, buf[2], bytes(buf[3:size - 1]), now)
+                del buf[:size]
+                if frame:
+                    frames.append(frame)
+                continue
+
+            sync = buf.find(SYNC)
+            if self.binary:
+                if sync == -1:
+                    buf.clear()
+                    break
+                del buf[:sync]
+                continue
+
+            if buf.startswith(PID_HEADER):
+                if len(buf) < PID_FRAME_LEN:
+                    break
+                uid = "".join(f"{b:02X}" for b in buf[len(PID_HEADER):PID_FRAME_LEN])
+                del buf[:PID_FRAME_LEN]
+                if buf[:1] == b"\n":
+                    del buf[:1]
+                frames.append(Frame("PID", uid, now))
+                continue
+
+            newline = buf.find(b"\n")
+            header = buf.find(PID_HEADER)
+            if header != -1 and (newline == -1 or header < newline):
+                # Line noise in front of a PID frame
+                del buf[:header]
+                continue
+            if sync != -1 and (newline == -1 or sync < newline):
+                # ASCII lines never hold a SYNC byte; a binary frame starts there
+                del buf[:sync]
+                continue
+            if newline == -1:
+                if len(buf) > MAX_BUFFER:
+                    buf.clear()
+                break
+
+            line = bytes(buf[:newline]).strip().decode("ascii", errors="replace")
+            del buf[:newline + 1]
+            if line:
+                frames.append(classify_line(line, now))
+
+        return frames
+
+    def _binary_frame(self, frame_type, seq, payload, timestamp):
+        kind = REPLY_TYPES.get(frame_type, "UNKNOWN")
+        if kind == "HELLO":
+            # The FPGA numbers its frames from HELLO on
+            self.binary = True
+            self.last_seq = seq
+            return Frame("HELLO", payload[0] if payload else None, timestamp)
+
+        if self.last_seq is not None:
+            if seq == self.last_seq:
+                self.duplicates += 1
+                return None
+            gap = (seq - self.last_seq - 1) & 0xFF
+            if gap:
+                self.lost += gap
+                print(f"[UART RX] {gap} frame(s) lost before seq {seq}")
+        self.last_seq = seq
+
+        if kind == "PID":
+            return Frame("PID", payload.hex().upper(), timestamp)
+        if kind == "STK":
+            # input_ir[4] (slot E) first, as in the ASCII bitmap
+            return Frame("STK", f"{payload[0] & 0x1F:05b}" if payload else "", timestamp)
+        if kind == "UNKNOWN":
+            return Frame("UNKNOWN", f"type 0x{frame_type:X} {payload.hex()}", timestamp)
+        return Frame(kind, kind, timestamp)
+
+    def reset(self):
+        self.buffer.clear()
+        self.binary = False
+        self.last_seq = None
+
+
+def classify_line(line, timestamp):
+    if line.startswith("STK:"):
+        return Frame("STK", line[4:], timestamp)
+    if "DONE" in line:
+        return Frame("DONE", line, timestamp)
+    if "ERR" in line:
+        return Frame("ERR", line, timestamp)
+    if line.startswith("DISPENSING"):
+        return Frame("ACK", line, timestamp)
+    if line == "PONG":
+        return Frame("PONG", line, timestamp)
+    return Frame("UNKNOWN", line, timestamp)
+
+
+# =========================================================
+# 2. SERIAL I/O ENGINE
+# =========================================================
+
+class DispenseError(Exception):
+    """Raised when the FPGA rejects a command or does not answer in time."""
+
+
+class SerialLink:
+    """
+    Owns the serial port. A reader thread does blocking reads and parses
+    frames once; a command thread runs queued conversations one at a time so
+    only one FPGA command is ever in flight.
+
+    Card scans are the exception: scan_card() runs beside the command queue
+    so the next patient can tap in while a dispense is on the servos. PID
+    frames get their own queue.
+
+    With `trace_path`, every byte written and read is captured to a
+    uart_trace file for later replay.
+
+    `protocol="auto"` offers binary framing as the first conversation after
+    open (see negotiate_conversation); "ascii" never does. Commands are
+    always written as ASCII lines by callers and encoded on the way out.
+    """
+
+    def __init__(self, port="/dev/serial0", baudrate=115200, read_timeout=0.1, trace_path=None,
+                 protocol="auto"):
+        self.port = port
+        self.baudrate = baudrate
+        self.read_timeout = read_timeout
+        self.trace_path = trace_path
+        self.protocol = protocol
+        self.binary = False             # commands go out as binary frames
+        self._tx_seq = 0
+        self._negotiated = None
+        self.trace = None
+        self.ser = None
+        self.parser = FrameParser()
+        self._frames = queue.Queue()
+        self._pid_frames = queue.Queue()
+        self._commands = queue.Queue()
+        self._write_lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self.scanning = False           # a scan_card() is waiting for a card
+        self._stop = threading.Event()
+        self._threads = []
+        self._busy = False
+
+    def open(self, ser=None):
+        """Opens the port; `ser` substitutes an open serial-like object (e.g. uart_trace.ReplaySerial)."""
+        try:
+            self.ser = ser or serial.Serial(self.port, self.baudrate, timeout=self.read_timeout)
+            self.ser.reset_input_buffer()
+        except Exception as e:
+            print(f"Serial Port Error: {e}")
+            self.ser = None
+            return False
+
+        if self.trace_path:
+            # One trace file per link; a reopened port keeps appending to it
+            from uart_trace import TraceWriter, RecordingSerial
+            if self.trace is None:
+                self.trace = TraceWriter(self.trace_path)
+                print(f"[UART] Capturing trace to {self.trace_path}")
+            self.ser = RecordingSerial(self.ser, self.trace)
+
+        self.parser.reset()
+        self.binary = False
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._read_loop, name="uart-rx", daemon=True),
+            threading.Thread(target=self._command_loop, name="uart-cmd", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        if self.protocol == "auto":
+            # Queued first, so every later conversation sees the outcome
+            self._negotiated = self.submit(negotiate_conversation)
+        return True
+
+    def close(self):
+        self._stop.set()
+        self._commands.put(None)
+        for t in self._threads:
+            t.join(timeout=1)
+        if self.ser:
+            self.ser.close()
+        if self.trace:
+            self.trace.close()
+
+    @property
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
+
+    @property
+    def queue_depth(self):
+        """Commands waiting plus the one currently on the wire."""
+        return self._commands.qsize() + (1 if self._busy else 0)
+
+    @property
+    def framing(self):
+        parser = self.parser
+        return {"binary": self.binary, "lost": parser.lost, "duplicates": parser.duplicates,
+                "crc_errors": parser.crc_errors}
+
+    # --- Background threads ---
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            try:
+                chunk = self.ser.read(self.ser.in_waiting or 1)
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                print(f"[UART RX] Read error: {e}")
+                time.sleep(self.read_timeout)
+                continue
+
+            if not chunk:
+                continue
+            for frame in self.parser.feed(chunk):
+                print(f"[UART RX] Incoming: {frame.kind} {frame.payload}")
+                if frame.kind == "PID":
+                    self._pid_frames.put(frame)
+                    continue
+                self._frames.put(frame)
+
+    def _command_loop(self):
+        while not self._stop.is_set():
+            item = self._commands.get()
+            if item is None:
+                break
+
+            future, conversation, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            self._busy = True
+            self._drain()
+            try:
+                future.set_result(conversation(self, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._busy = False
+                if self.trace:
+                    self.trace.flush()
+
+    def _drain(self):
+        """Discard frames left over from an earlier (timed-out) command."""
+        while True:
+            try:
+                stale = self._frames.get_nowait()
+            except queue.Empty:
+                return
+            print(f"[UART RX] Discarding stale frame: {stale.kind} {stale.payload}")
+
+    # --- Command queue ---
+
+    def submit(self, conversation, *args, **kwargs):
+        """
+        Queues `conversation(link, *args, **kwargs)` to run with exclusive
+        use of the port and returns a Future for its result.
+        """
+        future = Future()
+        if not self.is_open:
+            future.set_exception(DispenseError("Serial port disconnected."))
+            return future
+        self._commands.put((future, conversation, args, kwargs))
+        return future
+
+    # --- Used from inside conversations (command thread only) ---
+
+    def send(self, line):
+        # scan_card() writes from the request thread too
+        with self._write_lock:
+            frame = encode_command(line, self._tx_seq) if self.binary else None
+            if frame is None:
+                frame = (line + "\n").encode("ascii")
+            else:
+                self._tx_seq = (self._tx_seq + 1) & 0xFF
+            self.ser.write(frame)
+        print(f"[UART TX] Command Sent: {line}")
+
+    def write(self, data):
+        """Writes raw bytes (e.g. a recorded command) as they are."""
+        with self._write_lock:
+            self.ser.write(data)
+
+    def expect(self, kinds, timeout):
+        """Waits for the next frame whose kind is in `kinds`; None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                frame = self._frames.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if frame.kind in kinds:
+                return frame
+
+    def expect_card(self, timeout):
+        """Waits for the next PID frame; None on timeout."""
+        try:
+            return self._pid_frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    # --- High-level helpers ---
+
+    def scan_card(self, timeout=10):
+        """
+        Authorizes the reader and returns the card UID as hex (None on
+        timeout). Does not wait for a running dispense: START is accepted
+        while the servos turn, and the card reply has its own queue.
+        """
+        if not self.is_open:
+            raise DispenseError("Serial port disconnected.")
+        if self._negotiated is not None:
+            # START has to go out in the framing the FPGA settled on
+            wait([self._negotiated], timeout=timeout)
+        with self._scan_lock:
+            self.scanning = True
+            try:
+                return scan_conversation(self, timeout)
+            finally:
+                self.scanning = False
+
+    def end_session(self):
+        return self.submit(end_conversation)
+
+    def dispense(self, commands, timeout=30, on_event=None):
+        return self.submit(dispense_conversation, commands, timeout, on_event).result()
+
+
+# =========================================================
+# 3. CONVERSATIONS
+# =========================================================
+
+def negotiate_conversation(link, timeout=1.0):
+    """
+    Offers binary framing. START comes first because firmware without it
+    answers unknown commands with ERR only once authorized; BIN1 then gets
+    either a binary HELLO or that ERR, and silence also keeps ASCII. END
+    closes the session again.
+    """
+    link.send("START")
+    link.send(f"BIN{PROTOCOL_VERSION}")
+    reply = link.expect(("HELLO", "ERR"), timeout)
+    with link._write_lock:
+        link.binary = reply is not None and reply.kind == "HELLO"
+        link._tx_seq = 0
+    print(f"[UART] Framing: {f'binary v{reply.payload}' if link.binary else 'ASCII'}")
+    link.send("END")
+    link.expect(("STK",), timeout)
+    return link.binary
+
+
+def scan_conversation(link, timeout=10):
+    """Authorizes the reader with START and returns the card UID as hex."""
+    while not link._pid_frames.empty():
+        # A card tapped before this scan belongs to nobody
+        link._pid_frames.get_nowait()
+    link.send("START")
+    frame = link.expect_card(timeout)
+    return frame.payload if frame else None
+
+
+def end_conversation(link):
+    """Ends the FPGA session; the STK reply is dropped by the next drain."""
+    if link.scanning:
+        # A newer scan owns the session now; END would de-authorize its reader
+        return
+    link.send("END")
+
+
+def dispense_conversation(link, commands, timeout=30, on_event=None):
+    """
+    Sends one or more MED: frames back to back in a single session, waiting
+    for DONE after each, then requests the stock bitmap with END. Returns
+    the STK payload (or None if it never arrived). `on_event(name, **data)`
+    is called as each stage is reached; `timeout` applies per frame.
+    Events carry their stage timings in seconds: "sent" the frame's write
+    (`tx`), "done" first frame sent to last DONE and "stk" END to STK
+    (`elapsed`).
+    """
+    notify = on_event or (lambda name, **data: None)
+    if isinstance(commands, str):
+        commands = [commands]
+
+    # MED: is only accepted inside a START session. The card was scanned on
+    # the primary machine, so a machine picked by the pool may not have one.
+    link.send("START")
+    first_sent = None
+    for index, command in enumerate(commands, start=1):
+        start = time.perf_counter()
+        link.send(command)
+        sent = time.perf_counter()
+        first_sent = first_sent or sent
+        notify("sent", command=command, frame=index, frames=len(commands), tx=sent - start)
+        frame = link.expect(("DONE", "ERR"), timeout)
+        if frame is None:
+            raise DispenseError(f"Hardware Timeout: 'DONE' not received (frame {index} of {len(commands)}).")
+        if frame.kind == "ERR":
+            raise DispenseError(f"FPGA returned ERR: Command rejected (frame {index} of {len(commands)}).")
+
+    print("[System] Dispense Complete. Requesting Stock Status...")
+    notify("done", frames=len(commands), elapsed=time.perf_counter() - first_sent if first_sent else 0.0)
+    start = time.perf_counter()
+    link.send("END")
+    stock = link.expect(("STK",), 5)
+    if link.scanning:
+        # END also de-authorized the reader a waiting scan had armed
+        link.send("START")
+    if stock:
+        print(f"[System] Stock Data Captured: {stock.payload}")
+        notify("stk", stock=stock.payload, elapsed=time.perf_counter() - start)
+        return stock.payload
+    return None
@@ -0,0 +1,96 @@
+# startup_bench.py
+#
+# Cold-start benchmark for the kiosk server. Reports
+#   import   - time to `import app` in a fresh interpreter
+#   first    - launch to the first 200 for "/" (auth.html)
+#   warm     - launch until /api/health reports warm-up finished, the
+#              Firestore client connected and at least one machine online
+#              (caches, listeners and the replica fill in after this)
+#
+# Usage:  python startup_bench.py --runs 5
+#         python startup_bench.py --server "gunicorn -c gunicorn.conf.py wsgi:app"
+
+import argparse
+import json
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def time_import():
+    code = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True, timeout=120)
+    if out.returncode != 0:
+        raise RuntimeError(out.stderr.strip().splitlines()[-1])
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status, response.read()
+    except OSError:
+        return None, None
+
+
+def time_server(command, port, timeout):
+    env = dict(os.environ, PORT=str(port), BIND=f"127.0.0.1:{port}", FLASK_DEBUG="0")
+    base = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first = warm = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if first is None:
+                status, _ = _get(base + "/")
+                if status == 200:
+                    first = time.perf_counter() - start
+            else:
+                status, body = _get(base + "/api/health")
+                health = json.loads(body) if status == 200 else {}
+                if health.get("warm") and health.get("firestore") and health.get("machines_online"):
+                    warm = time.perf_counter() - start
+                    break
+            time.sleep(0.01)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return first, warm
+
+
+def _summary(samples):
+    samples = [s for s in samples if s is not None]
+    if not samples:
+        return "n/a"
+    return f"median {statistics.median(samples) * 1000:7.0f} ms   min {min(samples) * 1000:7.0f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure kiosk server start-up time.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--server", default=f"{shlex.quote(sys.executable)} app.py",
+                        help="command that starts the server (PORT/BIND are set for it)")
+    args = parser.parse_args()
+
+    imports, firsts, warms = [], [], []
+    for _ in range(args.runs):
+        imports.append(time_import())
+        first, warm = time_server(shlex.split(args.server), args.port, args.timeout)
+        firsts.append(first)
+        warms.append(warm)
+
+    print(f"import app   {_summary(imports)}")
+    print(f"first page   {_summary(firsts)}")
+    print(f"warm         {_summary(warms)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -143,19 +143,10 @@ document.addEventListener('DOMContentLoaded', () => {
 
 		const result = await response.json(); 
 		
-		if (result.status === 'dispense_success') {
-		    const commandString = result.fpga_command; 
-		    
-		    dispenseButton.textContent = "Finalizing...";
-		    await new Promise(resolve => setTimeout(resolve, 1500)); 
-
-		    // Redirect to status with extra params for QR generation
-		    const nextUrl = `/status?title=Success` +
-				    `&message=${encodeURIComponent(result.message)}` +
-				    `&patient_id=${currentPatientId}` +
-				    `&visit_date=${currentVisitDate}`;
-		    
-		    window.location.href = nextUrl;
+		if (result.status === 'queued') {
+		    followDispenseJob(result.job_id);
+		} else {
+		    window.location.href = `/status?title=Error&message=${encodeURIComponent(result.message)}`;
 		}
 
 	    } catch (error) {
@@ -164,6 +155,66 @@ document.addEventListener('DOMContentLoaded', () => {
 	    }
 	});
 
+    /**
+     * Subscribes to the job's progress stream and redirects when it finishes
+     */
+    function followDispenseJob(jobId) {
+        const labels = {
+            queued: "Waiting for Dispenser...",
+            sent: "Processing Hardware...",
+            done: "Checking Stock...",
+            stk: "Finalizing..."
+        };
+        const source = new EventSource(`/api/dispense/${jobId}/events`);
+
+        Object.keys(labels).forEach((name) => {
+            source.addEventListener(name, (event) => {
+                const data = JSON.parse(event.data);
+                // Large orders are split into several frames; show which one is running
+                dispenseButton.textContent = (name === 'sent' && data.frames > 1)
+                    ? `Dispensing ${data.frame}/${data.frames}...`
+                    : labels[name];
+                if (name === 'sent') offerNextPatient();
+            });
+        });
+
+        source.addEventListener('db_committed', (event) => {
+            source.close();
+            const result = JSON.parse(event.data);
+
+            // Redirect to status with extra params for QR generation
+            window.location.href = `/status?title=Success` +
+                                   `&message=${encodeURIComponent(result.message)}` +
+                                   `&patient_id=${currentPatientId}` +
+                                   `&visit_date=${currentVisitDate}`;
+        });
+
+        source.addEventListener('failed', (event) => {
+            source.close();
+            const result = JSON.parse(event.data);
+            window.location.href = `/status?title=Error&message=${encodeURIComponent(result.message)}`;
+        });
+
+        source.onerror = () => {
+            // EventSource retries on its own; give up only once it has closed
+            if (source.readyState === EventSource.CLOSED) {
+                window.location.href = `/status?title=Error&message=Connection lost with dispenser.`;
+            }
+        };
+    }
+
+    /**
+     * Once the order is on the servos the job no longer needs this page, so
+     * the next patient can scan (and have their order staged) meanwhile
+     */
+    function offerNextPatient() {
+        const backButton = document.querySelector('.button-group .btn-secondary');
+        if (!backButton || backButton.dataset.nextPatient) return;
+        backButton.dataset.nextPatient = 'true';
+        backButton.textContent = "Next Patient";
+        backButton.onclick = () => { window.location.href = '/'; };
+    }
+
     // Initialize the page
     loadPrescription();
 });
\ No newline at end of file
@@ -0,0 +1,114 @@
+# static_files.py
+#
+# Static asset serving for production: cache headers, ETag revalidation and
+# precompressed variants. `precompress()` writes name.gz (and name.br when
+# the optional `brotli` package is installed) next to each text asset;
+# `send_static()` picks the best variant the browser accepts, so nothing is
+# compressed per request on the Pi.
+#
+# Usage:  python static_files.py [directory ...]   (defaults to the kiosk and dashboard assets)
+
+import gzip
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Assets are not fingerprinted, so keep max-age modest; ETags make the
+# revalidation after it expires cheap (304, no body)
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", "3600"))
+COMPRESSIBLE = (".html", ".css", ".js", ".json", ".svg", ".txt")
+MIN_COMPRESS_SIZE = 512
+
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# This points to: capstone/admin_dashboard/website
+ADMIN_DASHBOARD_PATH = os.path.join(os.getcwd(), 'admin_dashboard', 'website')
+
+
+def send_static(directory, filename, max_age=STATIC_MAX_AGE):
+    """send_from_directory() that serves a precompressed variant when one exists and is accepted."""
+    if not filename.endswith(COMPRESSIBLE):
+        response = send_from_directory(directory, filename, max_age=max_age)
+        response.cache_control.public = True
+        return response
+
+    sent, encoding = filename, None
+    source = safe_join(directory, filename)
+    if source and os.path.isfile(source):
+        for accepted, suffix in ENCODINGS:
+            if not request.accept_encodings[accepted]:
+                continue
+            # A variant older than its source was left behind by an edit
+            # without a precompress run; serve the source instead
+            path = source + suffix
+            if os.path.isfile(path) and not _stale(source, path):
+                sent, encoding = filename + suffix, accepted
+                break
+
+    # The ETag comes from the file sent, so each encoding revalidates on its own
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    response = send_from_directory(directory, sent, mimetype=mimetype, max_age=max_age)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+
+    response.cache_control.public = True
+    return response
+
+
+def _stale(source, target):
+    return not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source)
+
+
+def precompress(directory):
+    """Writes .gz/.br siblings for text assets under `directory` that changed. Returns files written."""
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            source = os.path.join(root, name)
+            if os.path.getsize(source) < MIN_COMPRESS_SIZE:
+                continue
+
+            with open(source, "rb") as f:
+                raw = f.read()
+            variants = [(".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append((".br", lambda data: brotli.compress(data, quality=11)))
+
+            for suffix, compress in variants:
+                target = source + suffix
+                if not _stale(source, target):
+                    continue
+                data = compress(raw)
+                if len(data) >= len(raw):
+                    continue
+                with open(target, "wb") as f:
+                    f.write(data)
+                written += 1
+    return written
+
+
+def main():
+    import sys
+
+    directories = sys.argv[1:] or [STATIC_DIR, ADMIN_DASHBOARD_PATH]
+    for directory in directories:
+        if os.path.isdir(directory):
+            print(f"[Static] {directory}: {precompress(directory)} file(s) compressed")
+    if brotli is None:
+        print("[Static] brotli not installed; wrote gzip variants only")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+# stock_forecast.py
+#
+# The STK reply only says whether each slot's IR sensor still sees pills, so
+# a slot is reported empty once it already is. This ledger keeps a unit
+# count per machine and slot instead:
+#   refill    staff set a slot's count (POST /api/stock/refill)
+#   dispense  every MED: frame sent subtracts its units
+#   sensor    an STK "empty" bit forces the count to 0; a "present" bit on a
+#             slot counted at 0 means an unrecorded refill (count unknown)
+# Consumption rates come from the dispense history over rolling windows, and
+# give each slot a predicted time to empty. The dispense path asks
+# shortfall() before queueing an order, so it is rerouted to another
+# machine or refused before the slot runs dry.
+#
+# NumPy is optional: without it counts and refusals still work, but no rates
+# or predictions are made.
+#
+# Usage:  python stock_forecast.py --days 7   (synthetic history, timings)
+#
+# Tested in tests/test_stock_forecast.py.
+
+import json
+import sqlite3
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:     # counts still work; forecasts are skipped
+    np = None
+
+from medicine_slots import slot_entries
+from serial_link import SLOTS, decode_stk
+
+# Rolling windows for consumption rates, in hours
+WINDOWS = {"1h": 1, "24h": 24, "7d": 24 * 7}
+# A slot predicted to run dry within this many hours is reported "low"
+REFILL_LEAD_HOURS = 4.0
+DEFAULT_CAPACITY = 100
+
+
+def load_slot_limits(config_path):
+    """{slot: (maxCapacity, minRefillLevel)} from the dashboard's config.json."""
+    try:
+        with open(config_path, encoding="utf-8") as f:
+            medications = json.load(f).get("medications", [])
+        # Slots are resolved as for the medicine -> slot map (medicine_slots.py)
+        return {slot: (int(entry.get("maxCapacity", DEFAULT_CAPACITY)), int(entry.get("minRefillLevel", 0)))
+                for slot, entry in slot_entries(medications)}
+    except (OSError, ValueError) as e:
+        print(f"[Forecast] Using default slot limits; {config_path} unreadable: {e}")
+        return {}
+
+
+def consumption_rates(timestamps, slot_index, units, now, windows, history_start=None):
+    """
+    Units per hour for each slot over each window, vectorized: one cumulative
+    sum over the time-sorted history, then a searchsorted per window.
+    Returns an array of shape (len(windows), len(SLOTS)).
+    With `history_start` (one time, or one per slot; inf for none), a window
+    longer than the recorded history has no rate yet (NaN): dividing by the
+    shorter span would turn one dispense right after the first refill into
+    hundreds of units per hour.
+    """
+    hours = np.asarray(list(windows), dtype=float)
+    rates = np.zeros((len(hours), len(SLOTS)))
+    if len(timestamps):
+        rates = _window_sums(timestamps, slot_index, units, now, hours) / hours[:, None]
+    if history_start is not None:
+        uncovered = hours[:, None] * 3600.0 > now - np.asarray(history_start, dtype=float)
+        rates[np.broadcast_to(uncovered, rates.shape)] = np.nan
+    return rates
+
+
+def _window_sums(timestamps, slot_index, units, now, hours):
+    order = np.argsort(timestamps, kind="stable")
+    timestamps = np.asarray(timestamps, dtype=float)[order]
+    per_slot = np.zeros((len(timestamps), len(SLOTS)))
+    per_slot[np.arange(len(timestamps)), np.asarray(slot_index)[order]] = np.asarray(units, dtype=float)[order]
+    cumulative = np.vstack([np.zeros(len(SLOTS)), np.cumsum(per_slot, axis=0)])
+
+    starts = np.searchsorted(timestamps, now - hours * 3600.0, side="left")
+    return cumulative[-1] - cumulative[starts]
+
+
+class StockLedger:
+    """
+    Per machine and slot unit counts in SQLite, with the dispense history
+    the forecasts are computed from. Units promised to queued jobs are held
+    as reservations until their frames are sent or the job ends.
+    """
+
+    def __init__(self, path, limits=None):
+        self.path = path
+        self.limits = limits or {}
+        self._levels = {}               # (machine_id, slot) -> units, None = unknown
+        self._reservations = {}         # job_id -> (machine_id, {slot: units not yet sent})
+        self._history_start = {}        # (machine_id, slot) -> time of its first event
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS stock_events (
+                ts         REAL NOT NULL,
+                machine_id TEXT NOT NULL,
+                slot       TEXT NOT NULL,
+                kind       TEXT NOT NULL,
+                units      INTEGER);
+            CREATE INDEX IF NOT EXISTS stock_events_kind_ts ON stock_events (kind, ts);
+            CREATE TABLE IF NOT EXISTS stock_levels (
+                machine_id TEXT NOT NULL,
+                slot       TEXT NOT NULL,
+                units      INTEGER,
+                updated    REAL NOT NULL,
+                PRIMARY KEY (machine_id, slot));
+        """)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        for machine_id, slot, units in self._conn.execute("SELECT machine_id, slot, units FROM stock_levels"):
+            self._levels[(machine_id, slot)] = units
+        for machine_id, slot, first in self._conn.execute(
+                "SELECT machine_id, slot, MIN(ts) FROM stock_events GROUP BY machine_id, slot"):
+            self._history_start[(machine_id, slot)] = first
+
+    def capacity(self, slot):
+        return self.limits.get(slot, (DEFAULT_CAPACITY, 0))[0]
+
+    def _set_level(self, machine_id, slot, units, kind, now):
+        self._levels[(machine_id, slot)] = units
+        self._conn.execute("INSERT OR REPLACE INTO stock_levels VALUES (?, ?, ?, ?)",
+                           (machine_id, slot, units, now))
+        self._conn.execute("INSERT INTO stock_events VALUES (?, ?, ?, ?, ?)",
+                           (now, machine_id, slot, kind, units))
+        self._history_start.setdefault((machine_id, slot), now)
+
+    # --- Events ---
+
+    def refill(self, machine_id, slot, units=None):
+        """Records a refill; `units` defaults to the slot's capacity."""
+        units = self.capacity(slot) if units is None else int(units)
+        with self._lock:
+            self._set_level(machine_id, slot, units, "refill", time.time())
+            self._conn.commit()
+        print(f"[Forecast] {machine_id} slot {slot} refilled to {units}")
+        return units
+
+    def record_frame(self, machine_id, counts, job_id=None):
+        """Subtracts one sent MED: frame's units (and its job's reservation)."""
+        now = time.time()
+        with self._lock:
+            for slot, qty in counts.items():
+                if not qty:
+                    continue
+                self._conn.execute("INSERT INTO stock_events VALUES (?, ?, ?, 'dispense', ?)",
+                                   (now, machine_id, slot, qty))
+                self._history_start.setdefault((machine_id, slot), now)
+                level = self._levels.get((machine_id, slot))
+                if level is not None:
+                    level = max(0, level - qty)
+                    self._levels[(machine_id, slot)] = level
+                    self._conn.execute("INSERT OR REPLACE INTO stock_levels VALUES (?, ?, ?, ?)",
+                                       (machine_id, slot, level, now))
+                reservation = self._reservations.get(job_id)
+                if reservation is not None:
+                    reservation[1][slot] = max(0, reservation[1].get(slot, 0) - qty)
+            self._conn.commit()
+
+    def observe_stk(self, machine_id, stock_status):
+        """Reconciles counts with an STK bitmap (E..A, 1 = empty)."""
+        now = time.time()
+        changed = False
+        with self._lock:
+            for slot, bit in decode_stk(stock_status).items():
+                level = self._levels.get((machine_id, slot))
+                if bit and level != 0:
+                    if level:
+                        print(f"[Forecast] {machine_id} slot {slot} reads empty with {level} units counted")
+                    self._set_level(machine_id, slot, 0, "sensor", now)
+                    changed = True
+                elif not bit and level == 0:
+                    # Refilled without a refill event: count unknown until the next one
+                    self._set_level(machine_id, slot, None, "sensor", now)
+                    changed = True
+            if changed:
+                self._conn.commit()
+
+    # --- Reservations (orders queued but not yet sent) ---
+
+    def reserve(self, job_id, machine_id, counts):
+        with self._lock:
+            self._reservations[job_id] = (machine_id, {s: q for s, q in counts.items() if q})
+
+    def release(self, job_id):
+        with self._lock:
+            self._reservations.pop(job_id, None)
+
+    def available(self, machine_id, slot):
+        """Counted units not promised to queued jobs; None when the count is unknown."""
+        with self._lock:
+            return self._available(machine_id, slot)
+
+    def _available(self, machine_id, slot):
+        level = self._levels.get((machine_id, slot))
+        if level is None:
+            return None
+        reserved = sum(counts.get(slot, 0) for m, counts in self._reservations.values() if m == machine_id)
+        return level - reserved
+
+    def shortfall(self, machine_id, counts):
+        """{slot: units missing} for an order on this machine; empty when it can be filled."""
+        with self._lock:
+            missing = {}
+            for slot, qty in counts.items():
+                available = self._available(machine_id, slot) if qty else None
+                if available is not None and available < qty:
+                    missing[slot] = qty - max(0, available)
+            return missing
+
+    # --- Forecast ---
+
+    def _history(self, since):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ts, machine_id, slot, units FROM stock_events WHERE kind = 'dispense' AND ts >= ?",
+                (since,)).fetchall()
+        return rows
+
+    def forecast(self, machine_ids, now=None):
+        """
+        {machine_id: {slot: {...}}} with units, reservations, consumption per
+        window (units/hour), hours to empty at the highest of those rates
+        (the pessimistic estimate) and a status: ok, low, empty or unknown.
+        Windows the slot's history does not cover yet (counted from its first
+        refill, dispense or sensor event) have a rate of None; with no covered
+        window there is no time to empty.
+        """
+        now = time.time() if now is None else now
+        rows = self._history(now - max(WINDOWS.values()) * 3600) if np is not None else []
+        result = {}
+        for machine_id in machine_ids:
+            rates = None
+            if np is not None:
+                mine = [r for r in rows if r[1] == machine_id]
+                with self._lock:
+                    starts = [self._history_start.get((machine_id, slot), np.inf) for slot in SLOTS]
+                rates = consumption_rates([r[0] for r in mine], [SLOTS.index(r[2]) for r in mine],
+                                          [r[3] for r in mine], now, WINDOWS.values(), starts)
+            result[machine_id] = {}
+            for i, slot in enumerate(SLOTS):
+                available = self.available(machine_id, slot)
+                entry = {"units": self._levels.get((machine_id, slot)), "available": available,
+                         "capacity": self.capacity(slot), "rate_per_hour": None, "hours_to_empty": None}
+                if rates is not None:
+                    entry["rate_per_hour"] = {name: None if np.isnan(rates[w, i]) else round(float(rates[w, i]), 3)
+                                              for w, name in enumerate(WINDOWS)}
+                    covered = rates[~np.isnan(rates[:, i]), i]
+                    peak = float(covered.max()) if len(covered) else 0.0
+                    if available is not None and peak > 0:
+                        entry["hours_to_empty"] = round(max(0, available) / peak, 2)
+                entry["status"] = self._status(slot, available, entry["hours_to_empty"])
+                result[machine_id][slot] = entry
+        return result
+
+    def _status(self, slot, available, hours_to_empty):
+        if available is None:
+            return "unknown"
+        if available <= 0:
+            return "empty"
+        min_level = self.limits.get(slot, (DEFAULT_CAPACITY, 0))[1]
+        if available <= min_level or (hours_to_empty is not None and hours_to_empty < REFILL_LEAD_HOURS):
+            return "low"
+        return "ok"
+
+
+# =========================================================
+# BENCHMARK: forecast over a synthetic dispense history
+# =========================================================
+
+def main():
+    import argparse
+    import os
+    import random
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Time the stock forecast over a synthetic history.")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--per-hour", type=float, default=20.0, help="dispensed frames per hour")
+    args = parser.parse_args()
+    if np is None:
+        raise SystemExit("NumPy is required for forecasts.")
+
+    rng = random.Random(0)
+    path = os.path.join(tempfile.mkdtemp(), "ledger.sqlite3")
+    ledger = StockLedger(path)
+    now = time.time()
+    start = now - args.days * 86400
+    for slot in SLOTS:
+        ledger.refill("MED-001", slot, 10 ** 6)
+    rows = []
+    for _ in range(int(args.days * 24 * args.per_hour)):
+        slot = rng.choice(SLOTS)
+        rows.append((rng.uniform(start, now), "MED-001", slot, "dispense", rng.randint(1, 9)))
+    ledger._conn.executemany("INSERT INTO stock_events VALUES (?, ?, ?, ?, ?)", rows)
+    ledger._conn.commit()
+    # Refilled just before the first dispense, so the longest window is covered
+    for slot in SLOTS:
+        ledger._history_start[("MED-001", slot)] = start - 60
+
+    t0 = time.perf_counter()
+    result = ledger.forecast(["MED-001"], now)
+    elapsed = time.perf_counter() - t0
+    print(f"{len(rows)} dispense events, forecast in {elapsed * 1000:.1f} ms")
+    for slot, entry in result["MED-001"].items():
+        print(f"  {slot}: {entry['rate_per_hour']}  hours to empty {entry['hours_to_empty']}")
+
+
+if __name__ == "__main__":
+    main()
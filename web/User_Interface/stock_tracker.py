@@ -0,0 +1,107 @@
+# stock_tracker.py
+
+import threading
+import time
+
+from serial_link import SLOTS, decode_stk
+
+
+class StockTracker:
+    """
+    Turns STK readings into delta writes for one sensor document.
+
+    Only fields that differ from the last committed state are written, and
+    nothing is written when no field changed. The first change after a quiet
+    period goes out at once; further changes within `debounce` seconds are
+    coalesced into one trailing write, so a slot flickering between
+    readings costs at most one write.
+
+    The last stored state is loaded by prime(), off the dispense path; until
+    it arrives every field counts as changed.
+    """
+
+    def __init__(self, write, load=None, debounce=2.0):
+        self.write = write              # write(fields) for trailing (debounced) flushes
+        self.load = load                # load() -> last stored fields, or None; see prime()
+        self.debounce = debounce
+        self.committed = None
+        self.latest = None
+        self.last_write = 0.0
+        self.readings = 0
+        self.writes = 0
+        self.writes_saved = 0
+        self.fields_saved = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def _diff(self, fields):
+        if self.committed is None:
+            return dict(fields)
+        return {k: v for k, v in fields.items() if self.committed.get(k) != v}
+
+    def _commit(self, delta):
+        self.committed = {**(self.committed or {}), **delta}
+        self.last_write = time.monotonic()
+        self.writes += 1
+        self.fields_saved += len(SLOTS) - len(delta)
+
+    def prime(self):
+        """Loads the last stored state, unless a reading has been committed since."""
+        if self.load is None:
+            return
+        try:
+            stored = self.load() or {}
+        except Exception as e:
+            print(f"[Stock] Could not load last sensor state: {e}")
+            return
+        with self._lock:
+            if self.committed is None:
+                self.committed = stored
+
+    def observe(self, stock_status):
+        """
+        Records one STK reading. Returns the fields to write now (to go in
+        the caller's batch), or None when the write is skipped or deferred.
+        """
+        fields = decode_stk(stock_status)
+        with self._lock:
+            self.readings += 1
+            self.latest = fields
+            delta = self._diff(fields)
+            if not delta:
+                self.writes_saved += 1
+                self.fields_saved += len(SLOTS)
+                return None
+
+            if time.monotonic() - self.last_write >= self.debounce and self._timer is None:
+                self._commit(delta)
+                return delta
+
+            # Inside the debounce window: fold into one trailing write
+            self.writes_saved += 1
+            if self._timer is None:
+                wait = max(0.0, self.debounce - (time.monotonic() - self.last_write))
+                self._timer = threading.Timer(wait, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+            return None
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+            delta = self._diff(self.latest)
+            if not delta:
+                return
+            self._commit(delta)
+            # The reading that scheduled this flush was counted as saved
+            self.writes_saved -= 1
+        self.write(delta)
+
+    def stats(self):
+        return {
+            "readings": self.readings,
+            "writes": self.writes,
+            "writes_saved": self.writes_saved,
+            "fields_saved": self.fields_saved,
+            "committed": self.committed,
+        }
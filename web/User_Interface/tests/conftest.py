@@ -0,0 +1,9 @@
+# conftest.py
+#
+# The modules under test live flat in web/User_Interface; make them importable
+# however pytest is invoked.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,76 @@
+# test_dispense_plan.py
+#
+# Usage:  python -m pytest tests/test_dispense_plan.py
+
+import random
+
+import pytest
+
+from dispense_plan import MAX_PER_FRAME, SLOTS, format_frame, frame_counts, plan_frames
+from fpga_sim import FPGASimulator
+from serial_link import SerialLink
+
+
+def _random_orders(seed, n):
+    rng = random.Random(seed)
+    return [{slot: rng.choice([0, 0, rng.randint(1, 9), rng.randint(10, 60)]) for slot in SLOTS}
+            for _ in range(n)]
+
+
+ORDERS = [
+    {},
+    {"A": 1},
+    {"A": 9, "E": 9},
+    {"A": 10},
+    {"B": 18, "C": 1},
+    {"A": 19, "B": 0, "C": 27, "D": 3, "E": 9},
+    {slot: 60 for slot in SLOTS},
+] + _random_orders(seed=0, n=40)
+
+
+def _totals(frames):
+    return {slot: sum(frame_counts(frame)[slot] for frame in frames) for slot in SLOTS}
+
+
+@pytest.mark.parametrize("counts", ORDERS)
+def test_frames_add_up_to_the_order(counts):
+    frames = plan_frames(counts)
+    assert _totals(frames) == {slot: counts.get(slot, 0) for slot in SLOTS}
+
+
+@pytest.mark.parametrize("counts", ORDERS)
+def test_frames_respect_the_per_slot_cap(counts):
+    frames = plan_frames(counts)
+    assert all(len(frame) == 14 for frame in frames)
+    assert all(qty <= MAX_PER_FRAME for frame in frames for qty in frame_counts(frame).values())
+    # No shorter plan exists: the largest slot alone needs this many frames
+    assert len(frames) == -(-max(counts.values(), default=0) // MAX_PER_FRAME)
+
+
+def test_frame_round_trip():
+    counts = {"A": 3, "B": 0, "C": 2, "D": 0, "E": 1}
+    assert format_frame(counts) == "MED:A3B0C2D0E1"
+    assert frame_counts(format_frame(counts)) == counts
+
+
+def test_negative_quantity_is_rejected():
+    with pytest.raises(ValueError):
+        plan_frames({"A": -1})
+
+
+@pytest.fixture(scope="module", params=["binary", "ascii"])
+def machine(request):
+    sim = FPGASimulator(units={slot: 10 ** 6 for slot in SLOTS}, turn_time=0.0)
+    link = SerialLink(sim.start(), protocol=request.param)
+    link.open()
+    yield sim, link
+    link.close()
+    sim.stop()
+
+
+@pytest.mark.parametrize("counts", [order for order in ORDERS if any(order.values())][:20])
+def test_simulator_dispenses_exactly_the_order(machine, counts):
+    sim, link = machine
+    before = dict(sim.units)
+    link.dispense(plan_frames(counts), timeout=5)
+    assert {slot: before[slot] - sim.units[slot] for slot in SLOTS} == {slot: counts.get(slot, 0) for slot in SLOTS}
@@ -0,0 +1,155 @@
+# test_stock_forecast.py
+#
+# Usage:  python -m pytest tests/test_stock_forecast.py
+
+import random
+import types
+
+import pytest
+
+import stock_forecast
+from stock_forecast import SLOTS, WINDOWS, StockLedger
+
+HOUR = 3600.0
+needs_numpy = pytest.mark.skipif(stock_forecast.np is None, reason="forecasts need NumPy")
+
+
+class Clock:
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def advance(self, hours):
+        self.now += hours * HOUR
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stock_forecast, "time", types.SimpleNamespace(time=clock.time))
+    return clock
+
+
+@pytest.fixture
+def ledger(tmp_path, clock):
+    ledger = StockLedger(str(tmp_path / "ledger.sqlite3"))
+    yield ledger
+    ledger._conn.close()
+
+
+def _rates(ledger, machine_id="MED-001", slot="A"):
+    return ledger.forecast([machine_id])[machine_id][slot]["rate_per_hour"]
+
+
+@needs_numpy
+def test_rates_match_a_reference_loop(ledger, clock):
+    rng = random.Random(0)
+    start = clock.now
+    for slot in SLOTS:
+        ledger.refill("MED-001", slot, 10 ** 6)
+    rows = []
+    for _ in range(2000):
+        rows.append((start + rng.uniform(60, 8 * 24 * HOUR), "MED-001", rng.choice(SLOTS), "dispense",
+                     rng.randint(1, 9)))
+    ledger._conn.executemany("INSERT INTO stock_events VALUES (?, ?, ?, ?, ?)", rows)
+    clock.advance(8 * 24)
+
+    result = ledger.forecast(["MED-001"])["MED-001"]
+    for name, hours in WINDOWS.items():
+        for slot in SLOTS:
+            expected = sum(r[4] for r in rows if r[2] == slot and r[0] >= clock.now - hours * HOUR) / hours
+            assert result[slot]["rate_per_hour"][name] == pytest.approx(expected, abs=1e-2)
+
+
+@needs_numpy
+def test_empty_history_has_no_rate(ledger):
+    entry = ledger.forecast(["MED-001"])["MED-001"]["A"]
+    assert entry["rate_per_hour"] == {name: None for name in WINDOWS}
+    assert entry["hours_to_empty"] is None
+    assert entry["status"] == "unknown"
+
+
+@needs_numpy
+def test_partially_covered_window(ledger, clock):
+    ledger.refill("MED-001", "A", 50)
+    clock.advance(2)
+    ledger.record_frame("MED-001", {"A": 4})
+
+    entry = ledger.forecast(["MED-001"])["MED-001"]["A"]
+    assert entry["rate_per_hour"] == {"1h": 4.0, "24h": None, "7d": None}
+    assert entry["hours_to_empty"] == pytest.approx(46 / 4.0)
+
+
+@needs_numpy
+def test_a_dispense_right_after_the_first_refill_has_no_rate(ledger, clock):
+    ledger.refill("MED-001", "A", 50)
+    clock.advance(0.01)
+    ledger.record_frame("MED-001", {"A": 9})
+
+    entry = ledger.forecast(["MED-001"])["MED-001"]["A"]
+    assert entry["rate_per_hour"] == {name: None for name in WINDOWS}
+    assert entry["status"] == "ok"
+
+
+@needs_numpy
+def test_coverage_is_per_machine_and_slot(ledger, clock):
+    ledger.refill("MED-001", "A", 50)
+    clock.advance(8 * 24)
+    ledger.refill("MED-001", "B", 50)
+    ledger.refill("MED-002", "A", 50)
+    clock.advance(0.5)
+
+    assert _rates(ledger, "MED-001", "A") == {"1h": 0.0, "24h": 0.0, "7d": 0.0}
+    assert _rates(ledger, "MED-001", "B") == {name: None for name in WINDOWS}
+    assert _rates(ledger, "MED-002", "A") == {name: None for name in WINDOWS}
+
+
+@needs_numpy
+def test_refill_keeps_the_history(ledger, clock):
+    ledger.refill("MED-001", "A", 20)
+    clock.advance(2)
+    ledger.record_frame("MED-001", {"A": 6})
+    ledger.refill("MED-001", "A", 20)
+
+    assert _rates(ledger)["1h"] == 6.0
+    assert ledger.available("MED-001", "A") == 20
+
+
+def test_stk_reset(ledger):
+    ledger.refill("MED-001", "A", 20)
+    ledger.refill("MED-001", "B", 20)
+
+    # E..A: slot A reads empty with units still counted
+    ledger.observe_stk("MED-001", "00001")
+    assert ledger.available("MED-001", "A") == 0
+    assert ledger.available("MED-001", "B") == 20
+
+    # Pills seen again without a refill event: the count is unknown
+    ledger.observe_stk("MED-001", "00000")
+    assert ledger.available("MED-001", "A") is None
+    assert ledger.forecast(["MED-001"])["MED-001"]["A"]["status"] == "unknown"
+
+
+def test_shortfall_counts_reservations(ledger):
+    ledger.refill("MED-001", "A", 10)
+    ledger.reserve("job-1", "MED-001", {"A": 7})
+    assert ledger.shortfall("MED-001", {"A": 5}) == {"A": 2}
+    ledger.record_frame("MED-001", {"A": 7}, "job-1")
+    ledger.release("job-1")
+    assert ledger.shortfall("MED-001", {"A": 3}) == {}
+    assert ledger.shortfall("MED-001", {"A": 4}) == {"A": 1}
+
+
+def test_history_start_survives_a_restart(ledger, clock):
+    ledger.refill("MED-001", "A", 50)
+    clock.advance(2)
+    ledger.record_frame("MED-001", {"A": 4})
+
+    reopened = StockLedger(ledger.path)
+    try:
+        assert reopened._history_start[("MED-001", "A")] == clock.now - 2 * HOUR
+        assert reopened.available("MED-001", "A") == 46
+    finally:
+        reopened._conn.close()
@@ -0,0 +1,126 @@
+# test_uart_bench.py
+#
+# Serial-layer benchmarks (pytest-benchmark), ASCII against binary framing:
+# reply parsing, MED: encoding, and full scan + dispense cycles through
+# SerialLink against fpga_sim. A recorded trace is replayed as well when
+# UART_TRACE names one (UART_TRACE_SPEED: 1 = recorded timing, 0 = no delays).
+#
+# Usage:  python -m pytest tests/test_uart_bench.py --benchmark-group-by=group
+#         python -m pytest tests/test_uart_bench.py --benchmark-skip   (checks only)
+
+import os
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from fpga_sim import FPGASimulator
+from serial_link import FrameParser, SerialLink, describe_command, encode_command
+from uart_bench import (BAUD, BITS_PER_BYTE, recorded_stream, replay_trace, session_bytes,
+                        synthetic_stream, trace_steps)
+
+FRAMINGS = ["ascii", "binary"]
+STREAM_FRAMES = 20000
+
+
+def _parse(chunks):
+    parser = FrameParser()
+    return sum(len(parser.feed(chunk)) for chunk in chunks)
+
+
+# =========================================================
+# 1. PARSING AND ENCODING
+# =========================================================
+
+@pytest.mark.benchmark(group="parse")
+@pytest.mark.parametrize("framing", FRAMINGS)
+def test_parse_synthetic_stream(benchmark, framing):
+    chunks = synthetic_stream(STREAM_FRAMES, binary=framing == "binary")
+    frames = benchmark(_parse, chunks)
+    # The binary stream opens with HELLO
+    assert frames == STREAM_FRAMES + (framing == "binary")
+    benchmark.extra_info["bytes"] = sum(len(c) for c in chunks)
+
+
+@pytest.mark.benchmark(group="encode")
+def test_encode_med_frames(benchmark):
+    commands = [f"MED:A{i % 10}B{i // 10 % 10}C0D{i % 3}E1" for i in range(STREAM_FRAMES)]
+    encoded = benchmark(lambda: [encode_command(c, i & 0xFF) for i, c in enumerate(commands)])
+    assert [describe_command(frame) for frame in encoded] == commands
+
+
+def test_binary_session_is_smaller():
+    ascii_bytes, binary_bytes = session_bytes()
+    assert binary_bytes < ascii_bytes
+    # Under 3.5 ms of line time per patient at 115200 baud
+    assert binary_bytes * BITS_PER_BYTE / BAUD < 0.0035
+
+
+# =========================================================
+# 2. SCAN + DISPENSE CYCLES AGAINST THE SIMULATOR
+# =========================================================
+
+@pytest.fixture(params=FRAMINGS)
+def machine(request):
+    sim = FPGASimulator(units={slot: 10 ** 6 for slot in "ABCDE"}, scan_delay=0.0, turn_time=0.0,
+                        binary=request.param == "binary")
+    link = SerialLink(sim.start())
+    link.open()
+    yield sim, link, request.param
+    link.close()
+    sim.stop()
+
+
+def _cycle(link):
+    uid = link.scan_card(timeout=5)
+    stock = link.dispense(["MED:A1B2C0D0E1"], timeout=5)
+    return uid, stock
+
+
+@pytest.mark.benchmark(group="scan+dispense")
+def test_scan_dispense_cycle(benchmark, machine):
+    sim, link, framing = machine
+    uid, stock = benchmark(_cycle, link)
+    assert link.framing["binary"] == (framing == "binary")
+    assert uid == sim.uid.hex().upper()
+    assert stock == sim.stock_bitmap
+
+
+@pytest.mark.benchmark(group="dispense")
+def test_dispense_only(benchmark, machine):
+    sim, link, framing = machine
+    before, runs = sim.units["B"], []
+
+    def dispense():
+        runs.append(link.dispense(["MED:A1B2C0D0E1"], timeout=5))
+
+    benchmark(dispense)
+    assert runs and all(stock == sim.stock_bitmap for stock in runs)
+    assert before - sim.units["B"] == 2 * len(runs)
+
+
+# =========================================================
+# 3. RECORDED TRACE
+# =========================================================
+
+@pytest.fixture
+def trace_path():
+    path = os.environ.get("UART_TRACE")
+    if not path:
+        pytest.skip("set UART_TRACE to a recorded .utrace file")
+    return path
+
+
+@pytest.mark.benchmark(group="parse")
+def test_parse_recorded_stream(benchmark, trace_path):
+    chunks = recorded_stream(trace_path)
+    assert benchmark(_parse, chunks) > 0
+
+
+@pytest.mark.benchmark(group="replay")
+def test_replay_recorded_trace(benchmark, trace_path):
+    steps = trace_steps(trace_path)
+    speed = float(os.environ.get("UART_TRACE_SPEED", "0"))
+    timings, mismatches = benchmark.pedantic(replay_trace, args=(trace_path, steps, speed), rounds=5)
+    assert mismatches == 0
+    assert len(timings) == len(steps)
@@ -0,0 +1,88 @@
+# test_write_behind.py
+#
+# Usage:  python -m pytest tests/test_write_behind.py
+
+import pytest
+
+import write_behind
+from write_behind import WriteBehindQueue
+
+
+class Rejected(Exception):
+    """A write the server refuses (e.g. an invalid document path)."""
+
+
+class Offline(Exception):
+    pass
+
+
+class FakeFirestore:
+    def __init__(self, offline_calls=0):
+        self.batches = []
+        self.offline_calls = offline_calls
+
+    def commit(self, ops):
+        if self.offline_calls:
+            self.offline_calls -= 1
+            raise Offline("unreachable")
+        if any(op["path"] == "bad" for op in ops):
+            raise Rejected("invalid path")
+        self.batches.append([op["path"] for op in ops])
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(write_behind, "BASE_BACKOFF", 0.01)
+
+
+def _queue(tmp_path, backend):
+    return WriteBehindQueue(str(tmp_path / "journal.sqlite3"), backend.commit,
+                            is_transient=lambda e: isinstance(e, Offline))
+
+
+def _drain(queue):
+    queue.start()
+    try:
+        assert queue.flush(timeout=5)
+    finally:
+        queue.stop()
+
+
+def test_groups_are_committed_in_order(tmp_path):
+    backend = FakeFirestore()
+    queue = _queue(tmp_path, backend)
+    for path in ("a", "b", "c"):
+        queue.enqueue([{"path": path, "data": {}}])
+    _drain(queue)
+    assert [path for batch in backend.batches for path in batch] == ["a", "b", "c"]
+    assert queue.stats()["committed"] == 3
+
+
+def test_transient_errors_are_retried(tmp_path):
+    backend = FakeFirestore(offline_calls=3)
+    queue = _queue(tmp_path, backend)
+    queue.enqueue([{"path": "a", "data": {}}])
+    _drain(queue)
+    assert backend.batches == [["a"]]
+    assert queue.stats()["failures"] == 3
+    assert queue.dead_letters() == []
+
+
+def test_rejected_group_is_dead_lettered_and_the_rest_lands(tmp_path):
+    backend = FakeFirestore()
+    queue = _queue(tmp_path, backend)
+    for path in ("a", "bad", "c"):
+        queue.enqueue([{"path": path, "data": {}}])
+    _drain(queue)
+
+    assert [path for batch in backend.batches for path in batch] == ["a", "c"]
+    (row_id, error, ops), = queue.dead_letters()
+    assert error == "invalid path" and ops == [{"path": "bad", "data": {}}]
+    assert queue.stats()["dead_lettered"] == 1
+
+
+def test_dead_letters_survive_a_restart(tmp_path):
+    queue = _queue(tmp_path, FakeFirestore())
+    queue.enqueue([{"path": "bad", "data": {}}])
+    _drain(queue)
+    assert len(_queue(tmp_path, FakeFirestore()).dead_letters()) == 1
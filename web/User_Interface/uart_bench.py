@@ -0,0 +1,123 @@
+# uart_bench.py
+#
+# Workloads for the serial-layer benchmarks in tests/test_uart_bench.py:
+#
+#   parse     synthetic reply streams (ASCII or binary) and recorded UART
+#             traces (see uart_trace.py), cut into UART-sized chunks
+#   codec     bytes on the wire per patient in either framing
+#   replay    a recorded trace re-sent through SerialLink at a chosen speed
+#
+# Usage:  python -m pytest tests/test_uart_bench.py
+#         UART_TRACE=serial0.utrace UART_TRACE_SPEED=1 python -m pytest tests/test_uart_bench.py
+
+import random
+import time
+
+from serial_link import FrameParser, SerialLink, describe_command, encode_command, encode_frame
+from uart_trace import ReplaySerial, read_trace, RX, TX
+
+BAUD = 115200
+BITS_PER_BYTE = 10                      # 8N1
+
+
+# =========================================================
+# 1. REPLY STREAMS
+# =========================================================
+
+def synthetic_stream(frames, seed=0, binary=False):
+    """A realistic reply mix, cut into the small chunks a UART read returns."""
+    rng = random.Random(seed)
+    replies = [(0xA, b"DISPENSING...\n"), (0xB, b"DONE\n"), (0xD, b"PONG\n"), (0xE, b"ERR\n")]
+    # A binary stream opens with HELLO, as after negotiation
+    data = bytearray(encode_frame(0x8, 0, b"\x01") if binary else b"")
+    for seq in range(1, frames + 1):
+        kind = rng.random()
+        if kind < 0.2:
+            uid = bytes(rng.randrange(256) for _ in range(4))
+            data += encode_frame(0x9, seq, uid) if binary else b"PID:" + uid + b"\n"
+        elif kind < 0.4:
+            bits = rng.randrange(32)
+            data += encode_frame(0xC, seq, bytes((bits,))) if binary else f"STK:{bits:05b}\n".encode()
+        else:
+            frame_type, line = rng.choice(replies)
+            data += encode_frame(frame_type, seq) if binary else line
+
+    chunks, offset = [], 0
+    while offset < len(data):
+        size = rng.randint(1, 64)
+        chunks.append(bytes(data[offset:offset + size]))
+        offset += size
+    return chunks
+
+
+def recorded_stream(path, min_bytes=1 << 20):
+    """The trace's RX chunks, repeated until at least `min_bytes`."""
+    _, records = read_trace(path)
+    chunks = [data for direction, _, data in records if direction == RX]
+    if not chunks:
+        raise ValueError(f"{path} has no received bytes.")
+    size = sum(len(c) for c in chunks)
+    return chunks * max(1, min_bytes // size)
+
+
+# =========================================================
+# 2. WIRE SIZE
+# =========================================================
+
+# One patient: scan, one MED: frame, stock check
+SESSION_COMMANDS = ["START", "MED:A3B0C2D0E1", "END"]
+SESSION_REPLIES = [(0x9, b"PID:\xac\xc0\x17\x6d\n", b"\xac\xc0\x17\x6d"), (0xA, b"DISPENSING...\n", b""),
+                   (0xB, b"DONE\n", b""), (0xC, b"STK:01000\n", b"\x08")]
+
+
+def session_bytes():
+    """(ASCII bytes, binary bytes) on the wire for one patient, both directions."""
+    ascii_bytes = sum(len(c) + 1 for c in SESSION_COMMANDS) + sum(len(line) for _, line, _ in SESSION_REPLIES)
+    binary_bytes = (sum(len(encode_command(c, 0)) for c in SESSION_COMMANDS)
+                    + sum(len(encode_frame(t, 0, payload)) for t, _, payload in SESSION_REPLIES))
+    return ascii_bytes, binary_bytes
+
+
+# =========================================================
+# 3. TRACE REPLAY
+# =========================================================
+
+def trace_steps(path):
+    """Splits a trace into (command, raw bytes, [reply kinds]) steps, as the FPGA answered them."""
+    _, records = read_trace(path)
+    parser = FrameParser()
+    steps = []
+    for direction, _, data in records:
+        if direction == TX:
+            steps.append((describe_command(data), data, []))
+        elif steps:
+            steps[-1][2].extend(frame.kind for frame in parser.feed(data))
+    return steps
+
+
+def replay_conversation(link, steps, timeout=10):
+    """Re-writes a trace's commands byte for byte, waiting for each recorded reply. Returns [(command, seconds)]."""
+    timings = []
+    for command, raw, kinds in steps:
+        start = time.perf_counter()
+        link.write(raw)
+        for kind in kinds:
+            # Card reports have their own queue (see SerialLink.scan_card)
+            frame = link.expect_card(timeout) if kind == "PID" else link.expect((kind,), timeout)
+            if frame is None:
+                raise TimeoutError(f"{kind} not replayed after {command}")
+        timings.append((command, time.perf_counter() - start))
+    return timings
+
+
+def replay_trace(path, steps, speed=0.0):
+    """One replay of `path` through a SerialLink. Returns ([(command, seconds)], command mismatches)."""
+    replay = ReplaySerial(path, speed=speed)
+    # The trace already holds whatever negotiation was recorded
+    link = SerialLink("replay", protocol="ascii")
+    link.open(ser=replay)
+    try:
+        timings = link.submit(replay_conversation, steps).result()
+    finally:
+        link.close()
+    return timings, replay.mismatches
@@ -0,0 +1,259 @@
+# uart_trace.py
+#
+# Binary capture and replay of the UART conversation with the FPGA.
+#
+# File format (little endian):
+#   header  b"UTRC" | version u8 | reserved 3 bytes | wall-clock start f64
+#   record  direction u8 (0 = TX, 1 = RX) | time since start u64 (ns) | length u16 | bytes
+#
+# Capture:  SerialLink(port, trace_path="serial0.utrace") records every byte
+#           written to and read from the port (or set UART_TRACE_DIR for app.py).
+# Replay:   SerialLink(...).open(ser=ReplaySerial("serial0.utrace", speed=10))
+#
+# Usage:  python uart_trace.py dump serial0.utrace
+#         python uart_trace.py record sim.utrace --cycles 5   (capture a simulator session)
+
+import struct
+import threading
+import time
+
+MAGIC = b"UTRC"
+VERSION = 1
+HEADER = struct.Struct("<4sB3xd")
+RECORD = struct.Struct("<BQH")
+TX, RX = 0, 1
+MAX_RECORD = 0xFFFF
+
+
+class TraceWriter:
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._file = open(path, "wb")
+        self._file.write(HEADER.pack(MAGIC, VERSION, time.time()))
+        self._start = time.monotonic_ns()
+        self._lock = threading.Lock()
+
+    def write(self, direction, data):
+        now = time.monotonic_ns() - self._start
+        with self._lock:
+            if self._file.closed:
+                return
+            for i in range(0, len(data), MAX_RECORD):
+                chunk = data[i:i + MAX_RECORD]
+                self._file.write(RECORD.pack(direction, now, len(chunk)) + chunk)
+                self.records += 1
+
+    def flush(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path):
+    """Returns (wall-clock start, [(direction, seconds since start, bytes), ...])."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    magic, version, started = HEADER.unpack_from(raw)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} UART trace.")
+
+    records = []
+    offset = HEADER.size
+    while offset + RECORD.size <= len(raw):
+        direction, t_ns, length = RECORD.unpack_from(raw, offset)
+        offset += RECORD.size
+        records.append((direction, t_ns / 1e9, raw[offset:offset + length]))
+        offset += length
+    return started, records
+
+
+# =========================================================
+# CAPTURE: pass-through wrapper around an open serial.Serial
+# =========================================================
+
+class RecordingSerial:
+    def __init__(self, ser, writer):
+        self.ser = ser
+        self.writer = writer
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        if data:
+            self.writer.write(RX, data)
+        return data
+
+    def write(self, data):
+        self.writer.write(TX, bytes(data))
+        return self.ser.write(data)
+
+    @property
+    def in_waiting(self):
+        return self.ser.in_waiting
+
+    @property
+    def is_open(self):
+        return self.ser.is_open
+
+    def reset_input_buffer(self):
+        self.ser.reset_input_buffer()
+
+    def close(self):
+        self.ser.close()
+
+
+# =========================================================
+# REPLAY: serial-like object that plays the FPGA's side of a trace
+# =========================================================
+
+class ReplaySerial:
+    """
+    Plays back the RX side of a trace in response to writes. Each received
+    chunk is released once the host has written as many times as it had
+    before the chunk was captured, delayed by the same gap after that write
+    divided by `speed` (speed <= 0 releases it immediately). So the FPGA's
+    response times are reproduced relative to the host's actual writes,
+    whatever the host's own timing. Writes that differ from the trace are
+    counted in `mismatches`.
+    """
+
+    def __init__(self, path, speed=1.0, timeout=0.1):
+        self.speed = speed
+        self.timeout = timeout
+        self.is_open = True
+        self.mismatches = 0
+        _, records = read_trace(path)
+
+        self.expected_tx = [data for direction, _, data in records if direction == TX]
+        # (writes that precede the chunk, seconds after the last of them, bytes)
+        self._pending = []
+        writes, anchor = 0, 0.0
+        for direction, t, data in records:
+            if direction == TX:
+                writes, anchor = writes + 1, t
+            else:
+                self._pending.append((writes, t - anchor, data))
+
+        self._start = time.monotonic()
+        self._write_times = []
+        self._buffer = bytearray()
+        self._cond = threading.Condition()
+
+    def _release_due(self):
+        """Moves every chunk whose time has come into the read buffer; returns seconds until the next one."""
+        now = time.monotonic()
+        while self._pending:
+            writes, gap, data = self._pending[0]
+            if writes > len(self._write_times):
+                return None                     # waits for the host
+            anchor = self._write_times[writes - 1] if writes else self._start
+            due = anchor + (gap / self.speed if self.speed > 0 else 0.0)
+            if due > now:
+                return due - now
+            self._buffer += data
+            self._pending.pop(0)
+        return None
+
+    def read(self, size=1):
+        deadline = time.monotonic() + (self.timeout or 0)
+        with self._cond:
+            while True:
+                wait = self._release_due()
+                if self._buffer:
+                    data = bytes(self._buffer[:size])
+                    del self._buffer[:size]
+                    return data
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.is_open:
+                    return b""
+                self._cond.wait(min(remaining, wait) if wait is not None else remaining)
+
+    def write(self, data):
+        with self._cond:
+            index = len(self._write_times)
+            if index >= len(self.expected_tx) or self.expected_tx[index] != bytes(data):
+                self.mismatches += 1
+            self._write_times.append(time.monotonic())
+            self._cond.notify_all()
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            self._release_due()
+            return len(self._buffer)
+
+    @property
+    def exhausted(self):
+        return not self._pending and not self._buffer
+
+    def reset_input_buffer(self):
+        with self._cond:
+            self._buffer.clear()
+
+    def close(self):
+        with self._cond:
+            self.is_open = False
+            self._cond.notify_all()
+
+
+def tx_lines(path):
+    """The host's commands in a trace, e.g. ["START", "MED:A1B0C0D0E0", "END"], in either framing."""
+    from serial_link import describe_command
+
+    _, records = read_trace(path)
+    return [describe_command(data) for direction, _, data in records if direction == TX]
+
+
+# =========================================================
+# COMMAND LINE
+# =========================================================
+
+def dump(path):
+    started, records = read_trace(path)
+    print(f"{path}: {len(records)} records, captured {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}")
+    for direction, t, data in records:
+        print(f"{t:12.6f}  {'TX' if direction == TX else 'RX'}  {data!r}")
+
+
+def record_simulator(path, cycles):
+    from fpga_sim import FPGASimulator
+    from serial_link import SerialLink
+
+    sim = FPGASimulator()
+    link = SerialLink(sim.start(), trace_path=path)
+    link.open()
+    try:
+        for _ in range(cycles):
+            link.scan_card(timeout=5)
+            link.dispense(["MED:A1B2C0D0E1"], timeout=10)
+    finally:
+        link.close()
+        sim.stop()
+    print(f"Recorded {cycles} scan + dispense cycles to {path}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or record UART traces.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_dump = sub.add_parser("dump")
+    p_dump.add_argument("path")
+    p_record = sub.add_parser("record")
+    p_record.add_argument("path")
+    p_record.add_argument("--cycles", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "dump":
+        dump(args.path)
+    else:
+        record_simulator(args.path, args.cycles)
+
+
+if __name__ == "__main__":
+    main()
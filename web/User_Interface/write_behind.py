@@ -0,0 +1,164 @@
+# write_behind.py
+
+import json
+import random
+import sqlite3
+import threading
+import time
+
+MAX_BATCH_OPS = 500         # Firestore's per-batch write limit
+BASE_BACKOFF = 1.0          # seconds; doubled per failed attempt
+MAX_BACKOFF = 60.0
+
+
+class WriteBehindQueue:
+    """
+    Durable queue of Firestore write groups. Each `enqueue()` call is one
+    group of JSON-serialisable ops that must land together; groups are
+    journaled to SQLite first, then a background thread commits them in
+    order (several at a time, up to MAX_BATCH_OPS) through `commit(ops)`
+    and retries with exponential backoff while the network is down.
+
+    `is_transient(exc)` tells network trouble (retried) from a write the
+    server rejects (not retried): a rejected batch is re-sent one group at
+    a time, and the group that fails alone is moved to the dead_letters
+    table so the writes behind it keep flowing. Without it every error is
+    retried.
+    """
+
+    def __init__(self, journal_path, commit, is_transient=None):
+        self.journal_path = journal_path
+        self.commit = commit
+        self.is_transient = is_transient or (lambda e: True)
+        self.committed = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.last_error = None
+        self._conn = sqlite3.connect(journal_path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pending (
+                id      INTEGER PRIMARY KEY AUTOINCREMENT,
+                created REAL NOT NULL,
+                ops     TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id      INTEGER PRIMARY KEY,
+                created REAL NOT NULL,
+                failed  REAL NOT NULL,
+                error   TEXT NOT NULL,
+                ops     TEXT NOT NULL);
+        """)
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def enqueue(self, ops):
+        with self._lock:
+            self._conn.execute("INSERT INTO pending (created, ops) VALUES (?, ?)",
+                               (time.time(), json.dumps(ops)))
+            self._conn.commit()
+        self._wake.set()
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def dead_letters(self):
+        """[(id, error, ops)] of the groups Firestore rejected, oldest first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, error, ops FROM dead_letters ORDER BY id").fetchall()
+        return [(row_id, error, json.loads(ops)) for row_id, error, ops in rows]
+
+    def flush(self, timeout=None):
+        """Retries immediately and blocks until the journal is empty (or `timeout` passes)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            self._wake.set()
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "committed": self.committed,
+            "failures": self.failures,
+            "dead_lettered": self.dead_lettered,
+            "last_error": self.last_error,
+        }
+
+    # --- Background flusher ---
+
+    def _next_batch(self, limit=100):
+        with self._lock:
+            rows = self._conn.execute("SELECT id, ops FROM pending ORDER BY id LIMIT ?", (limit,)).fetchall()
+        ids, ops = [], []
+        for row_id, row_ops in rows:
+            group = json.loads(row_ops)
+            if ops and len(ops) + len(group) > MAX_BATCH_OPS:
+                break
+            ids.append(row_id)
+            ops.extend(group)
+        return ids, ops
+
+    def _dead_letter(self, row_id, error):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO dead_letters (id, created, failed, error, ops)"
+                " SELECT id, created, ?, ?, ops FROM pending WHERE id = ?", (time.time(), error, row_id))
+            self._conn.execute("DELETE FROM pending WHERE id = ?", (row_id,))
+            self._conn.commit()
+        self.dead_lettered += 1
+        print(f"[Firestore] Write-behind group {row_id} rejected ({error}); moved to dead_letters")
+
+    def _run(self):
+        attempts = 0
+        isolate = 0             # groups left to send one at a time after a rejected batch
+        while not self._stop.is_set():
+            ids, ops = self._next_batch(1 if isolate else 100)
+            if not ids:
+                isolate = 0
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            try:
+                self.commit(ops)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                if not self.is_transient(e):
+                    attempts = 0
+                    if len(ids) > 1:
+                        isolate = len(ids)
+                    else:
+                        isolate = 0
+                        self._dead_letter(ids[0], str(e))
+                    continue
+                attempts += 1
+                delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+                print(f"[Firestore] Write-behind commit failed ({e}); retrying in {delay:.1f}s")
+                self._wake.wait(delay)
+                self._wake.clear()
+                continue
+
+            attempts = 0
+            isolate = max(0, isolate - len(ids))
+            with self._lock:
+                self._conn.executemany("DELETE FROM pending WHERE id = ?", [(i,) for i in ids])
+                self._conn.commit()
+            self.committed += len(ids)